@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from opera_tropo import __version__
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+# Bytes of the input file hashed for its fingerprint: the HDF5 superblock
+# and root metadata, which change with any rewrite of the file
+FINGERPRINT_BYTES = 2**20
+
+
+def get_input_fingerprint(file_path: str | Path) -> dict:
+    """Get a fingerprint of an input file from its size, mtime and header."""
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    with open(file_path, "rb") as f:
+        header_hash = hashlib.sha256(f.read(FINGERPRINT_BYTES)).hexdigest()
+    return {
+        "path": str(file_path.resolve()),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "header_sha256": header_hash,
+    }
+
+
+def _to_json(value):
+    """Convert array and tuple options to JSON types."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def open_checkpoint(root_dir: str | Path, file_path: str | Path, options: dict) -> Path:
+    """Get the checkpoint directory of a run, creating its manifest if needed.
+
+    The directory is keyed by the input fingerprint and the hash of the
+    product options, so a rerun with the same input and options resumes
+    from the blocks already saved there. Temporary files of blocks whose
+    save was interrupted, e.g. by a killed worker, are removed when
+    resuming.
+
+    Parameters
+    ----------
+    root_dir : str | Path
+        Directory holding the checkpoints of all runs.
+    file_path : str | Path
+        Path to the input HRES file.
+    options : dict
+        Product options determining the content of the output blocks.
+
+    Returns
+    -------
+    Path
+        Checkpoint directory of the run.
+
+    """
+    manifest = {
+        "input": get_input_fingerprint(file_path),
+        "options": {key: _to_json(value) for key, value in sorted(options.items())},
+        "version": __version__,
+    }
+    run_hash = hashlib.sha256(
+        json.dumps(manifest, sort_keys=True).encode()
+    ).hexdigest()[:16]
+    checkpoint_dir = Path(root_dir) / run_hash
+    manifest_file = checkpoint_dir / MANIFEST_NAME
+
+    if manifest_file.exists():
+        stale_files = list(checkpoint_dir.glob("*.tmp"))
+        for tmp_file in stale_files:
+            tmp_file.unlink(missing_ok=True)
+        if stale_files:
+            logger.info(f"Removed {len(stale_files)} interrupted block saves")
+        n_blocks = len(list(checkpoint_dir.glob("*.npy")))
+        logger.info(f"Resuming from {n_blocks} saved blocks in {checkpoint_dir}")
+    else:
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        manifest["created"] = datetime.now(timezone.utc).isoformat()
+        manifest_file.write_text(json.dumps(manifest, indent=2))
+        logger.info(f"Saving finished blocks to {checkpoint_dir}")
+    return checkpoint_dir
+
+
+def get_block_name(times: np.ndarray, lat: np.ndarray, lon: np.ndarray) -> str:
+    """Get a file name identifying a block from its coordinates."""
+    time = np.datetime_as_string(times[0], unit="s").replace(":", "")
+    return f"block_{time}_{lat[0]:.4f}_{lon[0]:.4f}_{lat.size}x{lon.size}.npy"
+
+
+def run_checkpointed(
+    func: Callable, checkpoint_dir: str | Path, block_name: str, *args, **kwargs
+) -> np.ndarray:
+    """Run `func` on the arrays of a block, or load its saved result.
+
+    Results are written to a temporary file and renamed when complete,
+    so blocks interrupted while saving are computed again. A temporary
+    file removed while saving, by a run resuming from the same checkpoint,
+    leaves the block unsaved.
+    """
+    block_file = Path(checkpoint_dir) / block_name
+    if block_file.exists():
+        return np.load(block_file)
+
+    out = func(*args, **kwargs)
+    tmp_file = block_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, "wb") as f:
+        np.save(f, out)
+    try:
+        tmp_file.replace(block_file)
+    except FileNotFoundError:
+        logger.debug(f"Temporary file of {block_name} removed, block not saved")
+    return out
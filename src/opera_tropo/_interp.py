@@ -0,0 +1,69 @@
+import numpy as np
+from scipy.interpolate import interp1d
+
+
+def get_height_weights(
+    source_heights: np.ndarray,
+    target_heights: np.ndarray,
+    method: str = "cubic",
+) -> np.ndarray:
+    """Build the linear operator interpolating profiles between two height grids.
+
+    Spline interpolation is linear in the data, so interpolating the identity
+    matrix gives weights that reproduce ``interp1d(source, values)(target)``
+    for any profile as a matrix product. The weights only depend on the
+    height grids and can be built once and reused for every block.
+
+    Parameters
+    ----------
+    source_heights : np.ndarray
+        Increasing heights (m) of the input profiles.
+    target_heights : np.ndarray
+        Heights (m) to interpolate to.
+    method : str, optional
+        Interpolation kind passed to `scipy.interpolate.interp1d`.
+        Default is "cubic".
+
+    Returns
+    -------
+    np.ndarray
+        Weights with shape (target, source). Rows of targets outside the
+        source range are NaN.
+
+    """
+    source_heights = np.asarray(source_heights, dtype=np.float64)
+    target_heights = np.asarray(target_heights, dtype=np.float64)
+    identity = np.eye(len(source_heights))
+    weights = interp1d(
+        source_heights,
+        identity,
+        kind=method,
+        axis=0,
+        bounds_error=False,
+        fill_value=np.nan,
+    )(target_heights)
+    return np.ascontiguousarray(weights)
+
+
+def interpolate_heights(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Interpolate profiles along the last axis with precomputed weights.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Profiles with shape (..., source).
+    weights : np.ndarray
+        Weights from `get_height_weights` with shape (target, source).
+
+    Returns
+    -------
+    np.ndarray
+        Interpolated profiles with shape (..., target).
+
+    """
+    if values.shape[-1] != weights.shape[1]:
+        raise ValueError(
+            f"Profiles have {values.shape[-1]} heights, weights expect"
+            f" {weights.shape[1]}."
+        )
+    return np.matmul(values, weights.T)
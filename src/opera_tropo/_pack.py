@@ -1,8 +1,102 @@
 import numpy as np
 import xarray as xr
 
+from .bitinfo import BandKeepBits, get_error_bits
 from .product_info import GLOBAL_ATTRS, TROPO_PRODUCTS
-from .utils import round_mantissa
+from .utils import cast_round_mantissa, get_height_mask
+
+
+def _round_height_bands(
+    data: np.ndarray,
+    zs: np.ndarray,
+    name: str,
+    dtype,
+    keep_bits: BandKeepBits,
+    out: np.ndarray | None = None,
+) -> np.ndarray:
+    """Cast and round delays with the keep_bits of their height bands.
+
+    Bands with values too large for their keep_bits to stay within
+    the maximum error keep more bits.
+    """
+    if out is None:
+        out = np.empty(data.shape, dtype=dtype)
+    height_bits = keep_bits.get_height_keep_bits(name, zs)
+    # Runs of consecutive heights with the same keep_bits
+    starts = np.flatnonzero(np.diff(height_bits, prepend=-1))
+    for start, stop in zip(starts, [*starts[1:], len(zs)]):
+        band = data[..., start:stop]
+        # Largest magnitude, ignoring NaNs, without an absolute value copy
+        max_abs = max(np.fmax.reduce(band, axis=None), -np.fmin.reduce(band, axis=None))
+        bits = max(
+            int(height_bits[start]),
+            get_error_bits(float(max_abs), keep_bits.max_error, dtype),
+        )
+        cast_round_mantissa(band, dtype, keep_bits=bits, out=out[..., start:stop])
+    return out
+
+
+def pack_delays(
+    wet_ztd: np.ndarray,
+    hydrostatic_ztd: np.ndarray,
+    zs: np.ndarray,
+    keep_bits: bool | BandKeepBits = True,
+    max_height: float | None = None,
+    min_height: float | None = None,
+    out: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Trim, cast and round delays to the product data layout.
+
+    The cast and rounding are done in one pass with `cast_round_mantissa`.
+
+    Parameters
+    ----------
+    wet_ztd, hydrostatic_ztd, zs, keep_bits, max_height, min_height
+        See `pack_ztd`.
+    out : np.ndarray, optional
+        Array with dimensions (2, time, height, latitude, longitude) to
+        write the packed wet and hydrostatic delays to. Default is None.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        Wet and hydrostatic delays with dimensions
+        (time, height, latitude, longitude), and the float64 heights.
+
+    """
+    # Trim the height axis first, so dropped levels are never cast or rounded
+    height_mask = get_height_mask(zs, min_height, max_height)
+    if not height_mask.all():
+        wet_ztd = wet_ztd[..., height_mask]
+        hydrostatic_ztd = hydrostatic_ztd[..., height_mask]
+        zs = zs[height_mask]
+
+    # Single model time
+    if wet_ztd.ndim == 3:
+        wet_ztd = wet_ztd[np.newaxis]
+        hydrostatic_ztd = hydrostatic_ztd[np.newaxis]
+
+    # total_zenith_delay = hydrostatic_ztd + wet_ztd
+    packed = []
+    products = [TROPO_PRODUCTS.wet_delay, TROPO_PRODUCTS.hydrostatic_delay]
+    for i, (data, product) in enumerate(zip([wet_ztd, hydrostatic_ztd], products)):
+        # (time, latitude, longitude, height) view of the output
+        target = None if out is None else out[i].transpose(0, 2, 3, 1)
+        if isinstance(keep_bits, BandKeepBits):
+            data = _round_height_bands(
+                data, zs, product.name, product.dtype, keep_bits, out=target
+            )
+        elif keep_bits:
+            data = cast_round_mantissa(
+                data, product.dtype, keep_bits=product.keep_bits, out=target
+            )
+        elif target is not None:
+            np.copyto(target, data, casting="same_kind")
+            data = target
+        else:
+            data = data.astype(product.dtype)
+        packed.append(data.transpose(0, 3, 1, 2))
+    return packed[0], packed[1], zs.astype("float64")
 
 
 def pack_ztd(
@@ -13,7 +107,9 @@ def pack_ztd(
     zs: np.ndarray,
     model_time: np.ndarray,
     chunk_size={"longitude": 128, "latitude": 128, "height": -1, "time": 1},
-    keep_bits: bool = True,
+    keep_bits: bool | BandKeepBits = True,
+    max_height: float | None = None,
+    min_height: float | None = None,
 ):
     """Package Zenith Total Delay (ZTD) data into an xarray Dataset.
 
@@ -25,9 +121,12 @@ def pack_ztd(
     Parameters
     ----------
     wet_ztd : np.ndarray
-        A NumPy array containing the wet zenith total delays.
+        A NumPy array containing the wet zenith total delays with dimensions
+        (latitude, longitude, height), or (time, latitude, longitude, height)
+        for several model times.
     hydrostatic_ztd : np.ndarray
-        A NumPy array containing the hydrostatic zenith total delays.
+        A NumPy array containing the hydrostatic zenith total delays,
+        with the same dimensions as `wet_ztd`.
     lons : np.ndarray
         A NumPy array containing the longitude values (in degrees).
     lats : np.ndarray
@@ -39,8 +138,16 @@ def pack_ztd(
     chunk_size : dict, optional
         A dictionary specifying the chunk sizes for the dataset dimensions.
         Defaults to `{"longitude": 128, "latitude": 128, "height": -1, "time": 1}`.
-    keep_bits : bool, optional
-        If `True`, preserves the bit-level precision of the data. Default is `True`.
+    keep_bits : bool or BandKeepBits, optional
+        If `True`, rounds the mantissa of the data to the `keep_bits` of
+        `TROPO_PRODUCTS`. A `BandKeepBits` sets them per height band, and
+        is recorded in the variable attributes. Default is `True`.
+    max_height : float, optional
+        Drop heights above this value (m) before casting and rounding.
+        Default is None (keep all heights).
+    min_height : float, optional
+        Drop heights below this value (m) before casting and rounding.
+        Default is None (keep all heights).
 
     Returns
     -------
@@ -49,38 +156,31 @@ def pack_ztd(
         coordinates and chunking applied.
 
     """
-    dim = ["height", "latitude", "longitude"]
+    dim = ["time", "height", "latitude", "longitude"]
     reference_time = model_time.astype("datetime64[s]").astype("O")[0]
     reference_time = reference_time.strftime("%Y-%m-%d %H:%M:%S")
 
-    # total_zenith_delay = hydrostatic_ztd + wet_ztd
-    wet_ztd = wet_ztd.astype(TROPO_PRODUCTS.wet_delay.dtype)
-    hydrostatic_ztd = hydrostatic_ztd.astype(TROPO_PRODUCTS.hydrostatic_delay.dtype)
-    zs = zs.astype("float64")
-
-    # Rounding,
-    if keep_bits:
-        round_mantissa(wet_ztd, keep_bits=TROPO_PRODUCTS.wet_delay.keep_bits)
-        round_mantissa(
-            hydrostatic_ztd, keep_bits=TROPO_PRODUCTS.hydrostatic_delay.keep_bits
-        )
+    wet_ztd, hydrostatic_ztd, zs = pack_delays(
+        wet_ztd, hydrostatic_ztd, zs, keep_bits, max_height, min_height
+    )
 
     ds = xr.Dataset(
         data_vars={
             "wet_delay": (
                 dim,
-                wet_ztd.transpose(2, 0, 1),
+                wet_ztd,
                 TROPO_PRODUCTS.wet_delay.to_dict(),
             ),
             "hydrostatic_delay": (
                 dim,
-                hydrostatic_ztd.transpose(2, 0, 1),
+                hydrostatic_ztd,
                 TROPO_PRODUCTS.hydrostatic_delay.to_dict(),
             ),
         },
         # normalizing longitudes to the range [-180, 180] from [0, 360]
         # GDAL expects coordinates to be float64
         coords={
+            "time": model_time,
             "height": zs,
             "latitude": np.float64(lats),
             "longitude": (np.float64(lons) + 180) % 360 - 180,
@@ -93,8 +193,7 @@ def pack_ztd(
     ds["latitude"].attrs.update(TROPO_PRODUCTS.coords.latitude.get_attr)
     ds["longitude"].attrs.update(TROPO_PRODUCTS.coords.longitude.get_attr)
 
-    # Add time
-    ds = ds.expand_dims({"time": model_time})
+    # Add time attrs
     ds["time"].attrs.update(TROPO_PRODUCTS.coords.time.get_attr)
     # Remove time units due to conflicts with encoding
     del ds["time"].attrs["units"]
@@ -108,6 +207,9 @@ def pack_ztd(
     hydro_fill = TROPO_PRODUCTS.hydrostatic_delay.fillvalue
     ds["wet_delay"].attrs["_FillValue"] = wet_fill
     ds["hydrostatic_delay"].attrs["_FillValue"] = hydro_fill
+    if isinstance(keep_bits, BandKeepBits):
+        for key in ["wet_delay", "hydrostatic_delay"]:
+            ds[key].attrs.update(keep_bits.to_attrs(key))
 
     # Add chunks to data variables
     if chunk_size is not None:
@@ -0,0 +1,512 @@
+from __future__ import annotations
+
+import logging
+import warnings
+import zlib
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import dask
+import dask.array as da
+import dask.multiprocessing
+import h5py
+import numpy as np
+import xarray as xr
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "SubmittedWrite",
+    "submit_netcdf",
+    "write_netcdf",
+    "write_zarr",
+    "zarr_to_netcdf",
+]
+
+
+# NetCDF encoding options of the variables whose chunks are encoded outside of
+# HDF5: no compression or zlib, with the shuffle filter
+DIRECT_ENCODING_KEYS = {
+    "zlib",
+    "compression",
+    "complevel",
+    "shuffle",
+    "chunksizes",
+    "_FillValue",
+    "dtype",
+}
+
+
+def _get_direct_variables(ds: xr.Dataset, encoding: dict) -> dict[str, xr.Variable]:
+    """Get the Dask data variables whose chunks can be encoded outside of HDF5.
+
+    Their stored values are the data, with NaNs replaced by an encoded
+    `_FillValue`, as by xarray. Non-dimension coordinates, which xarray lists in
+    a "coordinates" attribute of the data variables, are not supported.
+    """
+    if set(ds.coords) - set(ds.dims):
+        return {}
+    direct = {}
+    for name, var in ds.data_vars.items():
+        options = encoding.get(name, {})
+        fillvalue = options.get("_FillValue", var.attrs.get("_FillValue", np.nan))
+        if (
+            isinstance(var.data, da.Array)
+            and var.dtype.kind == "f"
+            and np.dtype(options.get("dtype", var.dtype)) == var.dtype
+            and set(options) <= DIRECT_ENCODING_KEYS
+            and options.get("compression") in (None, "zlib")
+            and "chunksizes" in options
+            and fillvalue is not None
+            and not {"scale_factor", "add_offset"} & set(var.attrs)
+        ):
+            direct[name] = var
+    return direct
+
+
+def _create_variables(
+    output_file: str | Path, variables: dict[str, xr.Variable], encoding: dict
+) -> None:
+    """Create empty variables in a NetCDF file, as `to_netcdf` would."""
+    import netCDF4
+
+    with netCDF4.Dataset(output_file, "a") as nc:
+        for name, var in variables.items():
+            for dim, size in var.sizes.items():
+                if dim not in nc.dimensions:
+                    nc.createDimension(dim, size)
+            options = encoding[name]
+            attrs = {k: v for k, v in var.attrs.items() if k != "_FillValue"}
+            nc_var = nc.createVariable(
+                name,
+                var.dtype,
+                var.dims,
+                fill_value=options.get(
+                    "_FillValue", var.attrs.get("_FillValue", np.nan)
+                ),
+                **{
+                    key: value
+                    for key, value in options.items()
+                    if key not in ("_FillValue", "dtype")
+                },
+            )
+            nc_var.setncatts(attrs)
+
+
+def _encode_chunk(
+    block: np.ndarray,
+    chunk_shape: tuple[int, ...],
+    dtype: np.dtype,
+    fillvalue,
+    shuffle: bool,
+    complevel: Optional[int],
+    fill_nan: bool = False,
+) -> bytes:
+    """Encode a block as a stored HDF5 chunk: shuffle then deflate filters.
+
+    Blocks at the array edges are padded to the full chunk shape, as HDF5
+    stores them. With `fill_nan`, NaNs are replaced by the fill value.
+    """
+    chunk = np.full(chunk_shape, fillvalue, dtype=dtype)
+    chunk[tuple(slice(0, size) for size in block.shape)] = block
+    if fill_nan and not np.isnan(fillvalue):
+        chunk[np.isnan(chunk)] = fillvalue
+    data = chunk.tobytes()
+    if shuffle and dtype.itemsize > 1:
+        data = np.frombuffer(data, dtype=np.uint8).reshape(-1, dtype.itemsize)
+        data = data.T.tobytes()
+    if complevel is not None:
+        data = zlib.compress(data, complevel)
+    return data
+
+
+def _get_chunk_tasks(
+    source: da.Array, dset: h5py.Dataset, fill_nan: bool = False
+) -> list:
+    """Build the delayed encoded chunks of `source` with their offsets."""
+    source = source.rechunk(dset.chunks)
+    # Without optimizing each variable alone, which would fuse the tasks
+    # shared with the other variables into it and compute them twice
+    blocks = source.to_delayed(optimize_graph=False)
+    encode = dask.delayed(_encode_chunk, pure=True)
+    tasks = []
+    for index in np.ndindex(blocks.shape):
+        offset = tuple(int(i * c) for i, c in zip(index, dset.chunks))
+        chunk = encode(
+            blocks[index],
+            dset.chunks,
+            dset.dtype,
+            dset.fillvalue,
+            dset.shuffle,
+            dset.compression_opts,
+            fill_nan,
+        )
+        tasks.append((dset.name, offset, chunk))
+    return tasks
+
+
+def _get_client():
+    """Get the Dask distributed client used by the current scheduler, if any."""
+    scheduler = dask.base.get_scheduler()
+    client = getattr(scheduler, "__self__", None)
+    # Bound `Client.get` method for distributed, plain functions otherwise
+    return client if hasattr(client, "compute") else None
+
+
+def write_netcdf(
+    ds: xr.Dataset,
+    output_file: str | Path,
+    encoding: Optional[dict] = None,
+    compute_with: Any = None,
+) -> Any:
+    """Write a dataset to NetCDF4, compressing the chunks in parallel.
+
+    The file layout, attributes and coordinates are written by xarray with
+    `xr.Dataset.to_netcdf`, and the empty Dask float variables with zlib or
+    no compression are added with netCDF4 as `to_netcdf` creates them. They
+    are then rechunked to the file chunks, which are shuffled and
+    zlib-compressed by the Dask workers and written with HDF5 direct chunk
+    writes. The file content is the same as written by `to_netcdf`.
+
+    Variables with other encodings are written by `to_netcdf`.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset to write.
+    output_file : str | Path
+        Path to the output NetCDF file, overwritten if it exists.
+    encoding : dict, optional
+        Per-variable encoding, as for `xr.Dataset.to_netcdf`.
+    compute_with : Any, optional
+        Dask collections, or nested lists/dicts of them, computed in the
+        same graph as the written data, sharing its input tasks.
+
+    Returns
+    -------
+    Any
+        Computed `compute_with`.
+
+    Notes
+    -----
+    With a Dask distributed client, the compressed chunks are written by
+    this process as they complete. With the local threaded and synchronous
+    schedulers, each chunk is written by the task compressing it. The
+    local "processes" scheduler can not share the open file, the local
+    threaded scheduler is used instead. Chunks are released once written.
+
+    """
+    # The open file can not be shared with a process pool
+    if dask.base.get_scheduler() is dask.multiprocessing.get:
+        with dask.config.set(scheduler="threads"):
+            return write_netcdf(ds, output_file, encoding, compute_with)
+
+    client = _get_client()
+    if client is not None:
+        from distributed import as_completed
+
+        write = submit_netcdf(ds, output_file, encoding, compute_with, client)
+        for future, data in as_completed(write.futures, with_results=True):
+            write.add_result(future, data)
+        return write.close()
+
+    encoding = encoding or {}
+    direct = _get_direct_variables(ds, encoding)
+    layout = _write_layout(ds, output_file, encoding, direct)
+    if not direct:
+        return dask.compute(layout, compute_with)[1]
+
+    layout.compute()
+    _create_variables(output_file, direct, encoding)
+    with h5py.File(output_file, "r+") as hf:
+        tasks = _get_file_chunk_tasks(hf, direct, encoding)
+        logger.debug(f"Writing {len(tasks)} precompressed chunks to {output_file}")
+
+        # Each chunk is written, and released, by the task compressing it
+        def _write_chunk(data: bytes, name: str, offset: tuple[int, ...]):
+            hf[name].id.write_direct_chunk(offset, data)
+
+        write_chunk = dask.delayed(_write_chunk, pure=False)
+        writes = [write_chunk(chunk, name, offset) for name, offset, chunk in tasks]
+        return dask.compute(writes, compute_with)[1]
+
+
+def _write_layout(
+    ds: xr.Dataset, output_file: str | Path, encoding: dict, direct: dict
+) -> Any:
+    """Get the delayed `to_netcdf` write of all but the `direct` variables."""
+    return ds.drop_vars(list(direct)).to_netcdf(
+        output_file,
+        mode="w",
+        engine="netcdf4",
+        encoding={k: v for k, v in encoding.items() if k not in direct},
+        compute=False,
+    )
+
+
+def _get_file_chunk_tasks(
+    hf: h5py.File, direct: dict[str, xr.Variable], encoding: dict
+) -> list:
+    """Build the delayed encoded chunks of the `direct` variables of a file."""
+    tasks = []
+    for name, var in direct.items():
+        # xarray only masks NaNs with a `_FillValue` given as encoding
+        fill_nan = "_FillValue" in encoding[name]
+        tasks.extend(_get_chunk_tasks(var.data, hf[name], fill_nan))
+    return tasks
+
+
+class SubmittedWrite:
+    """Output written from futures of a Dask distributed client.
+
+    Created by `submit_netcdf`, or from the single future of a write done
+    by the workers, as for Zarr stores. The results of `futures`, as they
+    complete, are passed to `add_result`, which writes the compressed
+    chunks to the open NetCDF file `hf`. Once `done`, `close` closes the
+    file and returns the computed `compute_with`.
+    """
+
+    def __init__(
+        self,
+        output_file: Path,
+        result_future: Any,
+        hf: Optional[h5py.File] = None,
+        chunk_futures: Sequence = (),
+        locations: Sequence[tuple[str, tuple[int, ...]]] = (),
+    ):
+        self.output_file = output_file
+        self.futures = [*chunk_futures, result_future]
+        self._hf = hf
+        # Futures of identical chunks share their key, not their identity
+        self._locations = dict(zip(chunk_futures, locations))
+        self._result_future = result_future
+        self._pending = set(self.futures)
+        self._result = None
+
+    @property
+    def done(self) -> bool:
+        """Whether the results of all `futures` were added."""
+        return not self._pending
+
+    def add_result(self, future, data: Any) -> None:
+        """Write a completed chunk, or keep the computed `compute_with`."""
+        self._pending.discard(future)
+        if future is self._result_future:
+            self._result = data
+        else:
+            name, offset = self._locations.pop(future)
+            self._hf[name].id.write_direct_chunk(offset, data)
+        future.release()
+
+    def close(self) -> Any:
+        """Close the file and return the computed `compute_with`."""
+        if self._hf is not None:
+            self._hf.close()
+            self._hf = None
+        return self._result
+
+
+def submit_netcdf(
+    ds: xr.Dataset,
+    output_file: str | Path,
+    encoding: Optional[dict] = None,
+    compute_with: Any = None,
+    client: Any = None,
+) -> SubmittedWrite:
+    """Submit the write of a dataset to NetCDF4 to a Dask distributed client.
+
+    As `write_netcdf`, with the chunks compressed by the workers and
+    written by this process with `SubmittedWrite.add_result` as they complete.
+    Several files can be written at the same time, with their futures
+    gathered by one `distributed.as_completed`.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset to write.
+    output_file : str | Path
+        Path to the output NetCDF file, overwritten if it exists.
+    encoding : dict, optional
+        Per-variable encoding, as for `xr.Dataset.to_netcdf`.
+    compute_with : Any, optional
+        Dask collections computed in the same graph as the written data.
+    client : distributed.Client, optional
+        Client computing the chunks. Default is the current client.
+
+    Returns
+    -------
+    SubmittedWrite
+        Submitted write, with the file open until `SubmittedWrite.close`.
+
+    """
+    if client is None:
+        from distributed import get_client
+
+        client = get_client()
+    encoding = encoding or {}
+    direct = _get_direct_variables(ds, encoding)
+    layout = _write_layout(ds, output_file, encoding, direct)
+    if not direct:
+        result = client.compute(dask.delayed([layout, compute_with])[1])
+        return SubmittedWrite(Path(output_file), result)
+
+    # Computed here, so that this process closes its handle of the file
+    # before reopening it, the layout only holds the small variables
+    layout.compute(scheduler="threads")
+    _create_variables(output_file, direct, encoding)
+    hf = h5py.File(output_file, "r+")
+    try:
+        tasks = _get_file_chunk_tasks(hf, direct, encoding)
+        logger.debug(f"Submitting {len(tasks)} compressed chunks of {output_file}")
+        *futures, result = client.compute(
+            [chunk for _, _, chunk in tasks] + [dask.delayed(compute_with)]
+        )
+    except BaseException:
+        hf.close()
+        raise
+    locations = [task[:2] for task in tasks]
+    return SubmittedWrite(Path(output_file), result, hf, futures, locations)
+
+
+def _get_zarr_compressor(options: dict, zarr_format: int):
+    """Get the Zarr compressor equivalent to NetCDF compression options."""
+    compression = options.get("compression")
+    if compression is None and options.get("zlib", False):
+        compression = "zlib"
+    if compression is None:
+        return None
+    clevel = options.get("complevel", 4)
+    if compression == "zlib":
+        cname, shuffle = "zlib", "shuffle" if options.get("shuffle", True) else None
+    elif compression.startswith("blosc_"):
+        cname = compression.removeprefix("blosc_")
+        shuffle = {1: "shuffle", 2: "bitshuffle"}.get(options.get("blosc_shuffle", 1))
+    elif compression == "zstd":
+        if zarr_format == 2:
+            from numcodecs import Zstd
+
+            return Zstd(level=clevel)
+
+        from zarr.codecs import ZstdCodec
+
+        return ZstdCodec(level=clevel)
+    else:
+        raise ValueError(f"Unsupported compression for Zarr output: {compression}")
+
+    if zarr_format == 2:
+        from numcodecs import Blosc
+
+        shuffles = {"shuffle": Blosc.SHUFFLE, "bitshuffle": Blosc.BITSHUFFLE}
+        return Blosc(
+            cname=cname, clevel=clevel, shuffle=shuffles.get(shuffle, Blosc.NOSHUFFLE)
+        )
+
+    from zarr.codecs import BloscCodec
+
+    return BloscCodec(cname=cname, clevel=clevel, shuffle=shuffle or "noshuffle")
+
+
+def write_zarr(
+    ds: xr.Dataset,
+    output_store: str | Path,
+    encoding: Optional[dict] = None,
+    zarr_format: int = 2,
+    compute: bool = True,
+    compute_with: Any = None,
+):
+    """Write a dataset to a Zarr store with consolidated metadata.
+
+    The Dask variables are rechunked to the store chunks, so that every
+    chunk is compressed and written by the workers without locks.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset to write.
+    output_store : str | Path
+        Path to the output Zarr store, overwritten if it exists.
+    encoding : dict, optional
+        Per-variable NetCDF encoding, as for `xr.Dataset.to_netcdf`.
+        'chunksizes' set the Zarr chunks, and the zlib, zstd and Blosc
+        compression options are mapped to the equivalent Zarr compressor.
+    zarr_format : int, optional
+        Zarr format version, 2 or 3. Default is 2.
+    compute : bool, optional
+        Write the data immediately, or return a `dask.delayed.Delayed`
+        object to write it later. Default is True.
+    compute_with : Any, optional
+        Dask collections computed in the same graph as the written data,
+        if `compute` is True.
+
+    Returns
+    -------
+    dask.delayed.Delayed or Any
+        Delayed write if `compute` is False, else the computed
+        `compute_with`.
+
+    """
+    try:
+        import zarr  # noqa: F401
+    except ImportError as e:
+        raise ImportError(f"Zarr output requires the zarr package. Error: {e}")
+
+    ds = ds.copy()
+    zarr_encoding = {}
+    for name, options in (encoding or {}).items():
+        zarr_encoding[name] = {}
+        if "chunksizes" in options:
+            chunks = tuple(options["chunksizes"])
+            zarr_encoding[name]["chunks"] = chunks
+            if ds[name].chunks is not None:
+                ds[name] = ds[name].chunk(dict(zip(ds[name].dims, chunks)))
+        compressor = _get_zarr_compressor(options, zarr_format)
+        zarr_encoding[name]["compressors"] = [compressor] if compressor else None
+
+    with warnings.catch_warnings():
+        # Consolidated metadata is an extension of the Zarr v3 specification
+        warnings.filterwarnings("ignore", message="Consolidated metadata")
+        write = ds.to_zarr(
+            output_store,
+            mode="w",
+            encoding=zarr_encoding,
+            zarr_format=zarr_format,
+            consolidated=True,
+            compute=False,
+        )
+        if not compute:
+            return write
+        return dask.compute(write, compute_with)[1]
+
+
+def zarr_to_netcdf(
+    input_store: str | Path,
+    output_file: str | Path,
+    compression_options: Optional[dict | str] = None,
+) -> None:
+    """Export a Zarr product store to NetCDF4.
+
+    Parameters
+    ----------
+    input_store : str | Path
+        Path to the Zarr store written by `write_zarr`.
+    output_file : str | Path
+        Path to the output NetCDF file.
+    compression_options : dict or str, optional
+        NetCDF compression options of the data variables, or the name of
+        a compression profile, as for `tropo`.
+        Default is zlib level 4 with shuffle.
+
+    """
+    from opera_tropo.compression import get_compression_options
+
+    compression_options = get_compression_options(compression_options)
+
+    with xr.open_zarr(input_store) as ds:
+        encoding = {
+            name: {
+                **compression_options,
+                "chunksizes": ds[name].encoding["chunks"],
+            }
+            for name in ds.data_vars
+        }
+        write_netcdf(ds, output_file, encoding=encoding)
@@ -0,0 +1,509 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+from RAiDER.models import HRES
+
+from opera_tropo.log.loggin_setup import remove_raider_logs
+
+remove_raider_logs()
+
+# Model constants are read once from RAiDER's HRES definition, so that
+# the native engine integrates with exactly the same coefficients as RAiDER
+_HRES = HRES()
+K1, K2, K3 = _HRES._k1, _HRES._k2, _HRES._k3
+R_D, R_V = _HRES._R_d, _HRES._R_v
+G0 = _HRES._g0
+ZMIN = _HRES._zmin
+N_LEVELS = _HRES._levels
+A_COEFFS, B_COEFFS = _HRES._a, _HRES._b
+# Uniform output heights, ordered from the surface to the top of the atmosphere
+ZLEVELS = np.asarray(_HRES._zlevels, dtype=np.float64)
+
+# Temperature used to fill missing values above the model top,
+# avoids division by zero in the refractivity
+T_FILL_VALUE = 1e16
+# Number of columns processed together, bounds the size of the 3D intermediates
+COLUMN_CHUNK = 4096
+# Top output heights, above 45 km, where zero delays are expected
+N_TOP_ZERO_HEIGHTS = 15
+
+
+def calculate_geoh(
+    z: np.ndarray,
+    lnsp: np.ndarray,
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    out: Optional[tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Calculate geopotential, pressure and geopotential height on model levels.
+
+    Integrates the hypsometric equation from the surface up through the
+    hybrid model levels defined by the HRES a/b coefficients, using
+    cumulative sums over the level axis for the whole block at once.
+
+    Parameters
+    ----------
+    z : np.ndarray
+        Surface geopotential (m²/s²), shape (...).
+    lnsp : np.ndarray
+        Log of surface pressure (Pa), shape (...).
+    temperature : np.ndarray
+        Temperature (K) with shape (level, ...), ordered top to bottom.
+    humidity : np.ndarray
+        Specific humidity (kg/kg) with shape (level, ...), ordered top to bottom.
+    out : tuple[np.ndarray, np.ndarray, np.ndarray], optional
+        Preallocated (geopotential, pressure, geopotential height) buffers
+        with the shape of `temperature`. Default allocates new arrays.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        Geopotential (m²/s²), pressure (Pa) and geopotential height (m),
+        each with the shape and level order of `temperature`.
+
+    """
+    n_levels = temperature.shape[0]
+    if len(A_COEFFS) != n_levels + 1 or len(B_COEFFS) != n_levels + 1:
+        raise ValueError(
+            f"Input has {n_levels} levels, but the model coefficients a and b "
+            f"have lengths {len(A_COEFFS)} and {len(B_COEFFS)}."
+        )
+
+    if out is None:
+        geopotential = np.zeros_like(temperature)
+        pressure = np.zeros_like(temperature)
+        geo_height = None
+    else:
+        geopotential, pressure, geo_height = out
+
+    sp = np.exp(lnsp)
+    # Use the precision that the scalar coefficients give when scaling `sp`
+    dtype = np.result_type(A_COEFFS[0], B_COEFFS[0], sp)
+    coeff_shape = (n_levels + 1,) + (1,) * sp.ndim
+    a = np.asarray(A_COEFFS, dtype=dtype).reshape(coeff_shape)
+    b = np.asarray(B_COEFFS, dtype=dtype).reshape(coeff_shape)
+
+    # Pressure on the half levels, from the top of the atmosphere to the surface
+    ph = a + (b * sp)
+    pressure[...] = ph[:-1]
+
+    log_ph = np.log(ph[1:])
+    dlog_p = np.empty_like(log_ph)
+    dlog_p[0] = np.log(ph[1] / 0.1)
+    np.subtract(log_ph[1:], log_ph[:-1], out=dlog_p[1:])
+    del log_ph
+    alpha = 1 - ((ph[1:-1] / (ph[2:] - ph[1:-1])) * dlog_p[1:])
+    del ph
+
+    # Virtual temperature times the gas constant of dry air
+    t_rd = temperature * (1 + 0.609133 * humidity) * R_D
+
+    # Geopotential at the lower half level of each layer, integrated upwards
+    z_h = t_rd * dlog_p
+    z_h[-2::-1] = np.cumsum(z_h[:0:-1], axis=0)
+    z_h[-1] = 0
+    del dlog_p
+
+    geopotential[1:] = z_h[1:] + t_rd[1:] * alpha + z
+    geopotential[0] = z_h[0] + t_rd[0] * np.log(2) + z
+
+    if geo_height is None:
+        return geopotential, pressure, geopotential / G0
+    np.divide(geopotential, G0, out=geo_height)
+    return geopotential, pressure, geo_height
+
+
+def geo_to_height(lat: np.ndarray, geo_height: np.ndarray) -> np.ndarray:
+    """Convert geopotential heights to heights above the WGS84 ellipsoid.
+
+    Parameters
+    ----------
+    lat : np.ndarray
+        Latitude (degrees), broadcastable against `geo_height`.
+    geo_height : np.ndarray
+        Geopotential height (m).
+
+    Returns
+    -------
+    np.ndarray
+        Ellipsoidal height (m).
+
+    """
+    g0 = 9.80665
+    cos_2lat = np.cos(np.radians(2 * lat))
+    # Latitude dependent gravity
+    g = 9.80616 * (1 - 0.002637 * cos_2lat + 0.0000059 * (cos_2lat) ** 2)
+
+    r_max = 6378137  # WGS84 equatorial radius (m)
+    r_min = 6356752  # WGS84 polar radius (m)
+    r_e = np.sqrt(
+        1
+        / (
+            ((np.cos(np.radians(lat)) ** 2) / r_max**2)
+            + ((np.sin(np.radians(lat)) ** 2) / r_min**2)
+        )
+    )
+    return (geo_height * r_e) / (g / g0 * r_e - geo_height)
+
+
+def find_svp(temperature: np.ndarray) -> np.ndarray:
+    """Calculate the saturation vapour pressure (Pa) over water and ice."""
+    t1 = 273.15  # 0 Celsius
+    t2 = 250.15  # -23 Celsius
+
+    tref = temperature - t1
+    wgt = (temperature - t2) / (t1 - t2)
+    svpw = 6.1121 * np.exp((17.502 * tref) / (240.97 + tref))
+    svpi = 6.1121 * np.exp((22.587 * tref) / (273.86 + tref))
+
+    svp = svpi + (svpw - svpi) * wgt**2
+    svp = np.where(temperature > t1, svpw, svp)
+    svp = np.where(temperature < t2, svpi, svp)
+    return (svp * 100).astype(np.float32)
+
+
+def find_e(
+    temperature: np.ndarray, humidity: np.ndarray, pressure: np.ndarray
+) -> np.ndarray:
+    """Calculate the partial pressure of water vapour (Pa) from specific humidity."""
+    svp = find_svp(temperature)
+    # q = w / (w + 1), so w = q / (1 - q)
+    w = humidity / (1 - humidity)
+    return w * R_V * (pressure - svp) / R_D
+
+
+def interpolate_to_levels(
+    heights: np.ndarray,
+    values: list[np.ndarray],
+    zlevels: np.ndarray,
+) -> list[np.ndarray]:
+    """Linearly interpolate columns from model level heights to fixed heights.
+
+    Matches `numpy.interp` for every column, with NaN outside the column range.
+
+    Parameters
+    ----------
+    heights : np.ndarray
+        Heights (m) of the model levels with shape (level, ...),
+        increasing along the first axis.
+    values : list[np.ndarray]
+        Arrays with the same shape as `heights` to interpolate.
+    zlevels : np.ndarray
+        Increasing output heights (m).
+
+    Returns
+    -------
+    list[np.ndarray]
+        Interpolated float32 arrays with shape (len(zlevels), ...).
+
+    """
+    n_levels = heights.shape[0]
+    col_shape = heights.shape[1:]
+    zs = heights.reshape(n_levels, -1).astype(np.float64)
+    n_cols = zs.shape[1]
+    n_z = len(zlevels)
+    x = np.asarray(zlevels, dtype=np.float64)[:, np.newaxis]
+
+    # Number of model levels at or below each output height, per column
+    pos = np.searchsorted(zlevels, zs, side="left")
+    pos += (n_z + 1) * np.arange(n_cols)
+    count = np.bincount(pos.ravel(), minlength=(n_z + 1) * n_cols)
+    count = np.cumsum(count.reshape(n_cols, n_z + 1)[:, :n_z], axis=1).T
+
+    j = np.clip(count - 1, 0, n_levels - 2)
+    x0 = np.take_along_axis(zs, j, axis=0)
+    x1 = np.take_along_axis(zs, j + 1, axis=0)
+    outside = (count == 0) | (x > zs[-1])
+    at_top = ~outside & (count == n_levels)
+    at_node = x == x0
+
+    out = []
+    for value in values:
+        fp = value.reshape(n_levels, -1).astype(np.float64)
+        y0 = np.take_along_axis(fp, j, axis=0)
+        y1 = np.take_along_axis(fp, j + 1, axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = (y1 - y0) / (x1 - x0)
+            res = slope * (x - x0) + y0
+            # If we get nan in one direction, try the other
+            retry = np.isnan(res)
+            res[retry] = (slope * (x - x1) + y1)[retry]
+        res = np.where(np.isnan(res) & (y0 == y1), y0, res)
+        res = np.where(at_node, y0, res)
+        res = np.where(at_top, fp[-1], res)
+        res[outside] = np.nan
+        out.append(res.astype(np.float32).reshape((n_z, *col_shape)))
+    return out
+
+
+def fill_nans(values: np.ndarray, fill_value: float = 0.0) -> np.ndarray:
+    """Fill NaNs along the first (height) axis of an array.
+
+    Leading NaNs (below the surface) take the nearest valid value above,
+    interior NaNs are linearly interpolated and trailing NaNs (above the
+    model top) are set to `fill_value`.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array with shape (height, ...), heights increasing along the first axis.
+    fill_value : float, optional
+        Value for the NaNs above the last valid value. Default is 0.
+
+    Returns
+    -------
+    np.ndarray
+        Array with the same shape and dtype as `values` without NaNs.
+
+    """
+    nan_mask = np.isnan(values)
+    if not nan_mask.any():
+        return values
+
+    n_z = values.shape[0]
+    idx = np.arange(n_z).reshape((n_z,) + (1,) * (values.ndim - 1))
+    prev_valid = np.maximum.accumulate(np.where(nan_mask, -1, idx), axis=0)
+    next_valid = np.flip(
+        np.minimum.accumulate(np.flip(np.where(nan_mask, n_z, idx), axis=0), axis=0),
+        axis=0,
+    )
+
+    out = values.copy()
+    lower = nan_mask & (prev_valid < 0) & (next_valid < n_z)
+    inner = nan_mask & (prev_valid >= 0) & (next_valid < n_z)
+    upper = nan_mask & (next_valid == n_z)
+
+    y1 = np.take_along_axis(values, np.minimum(next_valid, n_z - 1), axis=0)
+    out[lower] = y1[lower]
+    if inner.any():
+        y0 = np.take_along_axis(values, np.maximum(prev_valid, 0), axis=0)
+        x = np.broadcast_to(idx, values.shape)[inner]
+        x0, y0 = prev_valid[inner], y0[inner].astype(np.float64)
+        slope = (y1[inner] - y0) / (next_valid[inner] - x0)
+        out[inner] = slope * (x - x0) + y0
+    out[upper] = fill_value
+    return out
+
+
+def integrate_ztd(
+    refractivity: np.ndarray,
+    zlevels: np.ndarray,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Integrate refractivity from each height to the top of the atmosphere.
+
+    Parameters
+    ----------
+    refractivity : np.ndarray
+        Refractivity with shape (height, ...), heights increasing
+        along the first axis.
+    zlevels : np.ndarray
+        Increasing heights (m) of the first axis of `refractivity`.
+    out : np.ndarray, optional
+        Preallocated float64 output with the shape of `refractivity`.
+
+    Returns
+    -------
+    np.ndarray
+        Zenith delay (m) from each height to the top, float64.
+
+    """
+    if out is None:
+        out = np.empty(refractivity.shape, dtype=np.float64)
+    dz = np.diff(zlevels).reshape((-1,) + (1,) * (refractivity.ndim - 1))
+    # Trapezoidal segments, accumulated from the top downwards
+    segments = dz * (refractivity[1:] + refractivity[:-1]) / 2.0
+    np.cumsum(segments[::-1], axis=0, out=out[-2::-1])
+    out[-1] = 0
+    out *= 1e-6
+    return out
+
+
+def get_zero_mask(wet_ztd: np.ndarray, hydrostatic_ztd: np.ndarray) -> np.ndarray:
+    """Get the mask of the zero delays, along the last (height) axis.
+
+    Zero delays are often caused by remaining NaNs in the input. The top
+    `N_TOP_ZERO_HEIGHTS` heights, where zeros might occur, are not masked.
+    """
+    below_top = (..., slice(None, -N_TOP_ZERO_HEIGHTS))
+    mask = np.zeros(wet_ztd.shape, dtype=bool)
+    mask[below_top] = (hydrostatic_ztd[below_top] == 0) | (wet_ztd[below_top] == 0)
+    return mask
+
+
+def get_output_heights(zlevels: Optional[np.ndarray] = None) -> np.ndarray:
+    """Get the heights (m) of the delays computed on `zlevels`.
+
+    The grid is padded with a level at the minimum model height if
+    it does not reach that low.
+    """
+    zlevels = ZLEVELS if zlevels is None else np.asarray(zlevels, dtype=np.float64)
+    if ZMIN < np.nanmin(zlevels):
+        return np.insert(zlevels, 0, ZMIN)
+    return zlevels
+
+
+def _ztd_chunk(
+    lat: np.ndarray,
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    z: np.ndarray,
+    lnsp: np.ndarray,
+    zlevels: np.ndarray,
+    wet_out: np.ndarray,
+    hydrostatic_out: np.ndarray,
+) -> None:
+    """Compute refractivity and integrate it into the outputs for a column chunk."""
+    _, pressure, geo_height = calculate_geoh(z, lnsp, temperature, humidity)
+    heights = geo_to_height(lat, geo_height)
+    del geo_height
+
+    # Reorder levels from the surface to the top of the atmosphere
+    heights = np.flip(heights, axis=0)
+    pressure = np.flip(pressure, axis=0)
+    temperature = np.flip(temperature, axis=0)
+    humidity = np.flip(humidity, axis=0)
+
+    e = find_e(temperature, humidity, pressure)
+    t, p, e = interpolate_to_levels(heights, [temperature, pressure, e], zlevels)
+    del heights, pressure
+
+    # Fill NaNs below the surface and above the model top
+    p = fill_nans(p)
+    t = fill_nans(t, fill_value=T_FILL_VALUE)
+    e = fill_nans(e)
+
+    # Pad with a level at the minimum height if the grid does not go that low
+    pad = len(wet_out) > len(zlevels)
+    if pad:
+        zlevels = np.insert(zlevels, 0, ZMIN)
+
+    # Integrate each refractivity as soon as it is computed
+    refractivity = K2 * e / t + K3 * e / t**2
+    del e
+    if pad:
+        refractivity = np.concatenate([refractivity[:1], refractivity], axis=0)
+    integrate_ztd(refractivity, zlevels, out=wet_out)
+
+    refractivity = K1 * p / t
+    del t, p
+    if pad:
+        refractivity = np.concatenate([refractivity[:1], refractivity], axis=0)
+    integrate_ztd(refractivity, zlevels, out=hydrostatic_out)
+
+
+def ztd_columns(
+    lat: np.ndarray,
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    z: np.ndarray,
+    lnsp: np.ndarray,
+    zlevels: Optional[np.ndarray] = None,
+    chunk_size: Optional[int] = COLUMN_CHUNK,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute wet and hydrostatic zenith delays for a batch of N grid columns.
+
+    Every column is independent, so the batch can be any set of grid
+    points, e.g. a flattened (lat, lon) tile or scattered columns.
+    Columns are processed in chunks of `chunk_size`, so only the output
+    delays are held for the whole batch.
+
+    Parameters
+    ----------
+    lat : np.ndarray
+        Latitude (degrees) of the columns, shape (N,).
+    temperature : np.ndarray
+        Temperature (K) with shape (level, N), ordered top to bottom.
+    humidity : np.ndarray
+        Specific humidity (kg/kg) with shape (level, N), ordered top to bottom.
+    z : np.ndarray
+        Surface geopotential (m²/s²), shape (N,).
+    lnsp : np.ndarray
+        Log of surface pressure (Pa), shape (N,).
+    zlevels : np.ndarray, optional
+        Increasing heights (m) to compute the delays at.
+        Default is the HRES native heights.
+    chunk_size : int, optional
+        Number of columns processed at a time. None processes all
+        columns at once. Default is 4096.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        Wet and hydrostatic delays (m) with shape (height, N),
+        and the corresponding heights (m).
+
+    """
+    zlevels = ZLEVELS if zlevels is None else np.asarray(zlevels, dtype=np.float64)
+    out_zlevels = get_output_heights(zlevels)
+
+    n_cols = temperature.shape[1]
+    wet_ztd = np.empty((len(out_zlevels), n_cols), dtype=np.float64)
+    hydrostatic_ztd = np.empty_like(wet_ztd)
+
+    step = n_cols if not chunk_size else chunk_size
+    for start in range(0, n_cols, step):
+        cols = slice(start, start + step)
+        _ztd_chunk(
+            lat[cols],
+            temperature[:, cols],
+            humidity[:, cols],
+            z[cols],
+            lnsp[cols],
+            zlevels,
+            wet_ztd[:, cols],
+            hydrostatic_ztd[:, cols],
+        )
+    return wet_ztd, hydrostatic_ztd, out_zlevels
+
+
+def compute_ztd(
+    lat: np.ndarray,
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    z: np.ndarray,
+    lnsp: np.ndarray,
+    zlevels: Optional[np.ndarray] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute wet and hydrostatic zenith delays on a (lat, lon) grid.
+
+    The grid is flattened into a single column axis and passed
+    to `ztd_columns`.
+
+    Parameters
+    ----------
+    lat : np.ndarray
+        1D array of latitude values (degrees), shape (lat,).
+    temperature : np.ndarray
+        Temperature (K) with shape (level, lat, lon), ordered top to bottom.
+    humidity : np.ndarray
+        Specific humidity (kg/kg) with shape (level, lat, lon),
+        ordered top to bottom.
+    z : np.ndarray
+        Surface geopotential (m²/s²), shape (lat, lon).
+    lnsp : np.ndarray
+        Log of surface pressure (Pa), shape (lat, lon).
+    zlevels : np.ndarray, optional
+        Increasing heights (m) to compute the delays at.
+        Default is the HRES native heights.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        Wet and hydrostatic delays (m) with shape (height, lat, lon),
+        and the corresponding heights (m).
+
+    """
+    n_levels, n_lat, n_lon = temperature.shape
+    wet_ztd, hydrostatic_ztd, zlevels = ztd_columns(
+        lat=np.repeat(lat, n_lon),
+        temperature=temperature.reshape(n_levels, -1),
+        humidity=humidity.reshape(n_levels, -1),
+        z=z.ravel(),
+        lnsp=lnsp.ravel(),
+        zlevels=zlevels,
+    )
+    out_shape = (len(zlevels), n_lat, n_lon)
+    return wet_ztd.reshape(out_shape), hydrostatic_ztd.reshape(out_shape), zlevels
@@ -0,0 +1,382 @@
+from __future__ import annotations
+
+import logging
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Sequence
+
+import dask
+import xarray as xr
+from dask.distributed import Client, as_completed
+
+from opera_tropo._checkpoint import open_checkpoint
+from opera_tropo._writer import SubmittedWrite, submit_netcdf, write_zarr
+from opera_tropo.resources import AUTO
+from opera_tropo.run import (
+    BLOCK_SIZE,
+    OUTPUT_FORMATS,
+    build_tropo,
+    get_local_scheduler,
+    get_task_native_threads,
+    inspect_input,
+    report_product_validation,
+    resolve_resources,
+    select_scheduler,
+    start_client,
+    stop_client,
+    write_product,
+)
+from opera_tropo.utils import get_hres_datetime
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["select_inputs", "tropo_many"]
+
+
+def select_inputs(
+    paths: Sequence[str | Path],
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> list[Path]:
+    """Collect HRES files, optionally within a range of model times.
+
+    Parameters
+    ----------
+    paths : Sequence[str | Path]
+        HRES files, or directories searched for `*.nc` files.
+    start_date : datetime, optional
+        Keep files with a model time on or after `start_date`.
+    end_date : datetime, optional
+        Keep files with a model time on or before `end_date`.
+
+    Returns
+    -------
+    list[Path]
+        Selected files sorted by model time.
+
+    """
+    files: list[Path] = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.nc")) if path.is_dir() else [path])
+
+    selected = []
+    for file in files:
+        hres_date, hres_hour = get_hres_datetime(file)
+        model_time = datetime.strptime(f"{hres_date}T{int(hres_hour):02d}", "%Y%m%dT%H")
+        if start_date is not None and model_time < start_date:
+            continue
+        if end_date is not None and model_time > end_date:
+            continue
+        selected.append((model_time, file))
+    return [file for _, file in sorted(selected)]
+
+
+def tropo_many(
+    file_paths: Sequence[str | Path],
+    output_files: Sequence[str | Path],
+    *,
+    max_in_flight: int = 2,
+    num_workers: int | str = 4,
+    num_threads: int | str = 2,
+    max_memory: int | str = "16GB",
+    temp_dir: Optional[str] = None,
+    scheduler: str = "auto",
+    client: Optional[Client] = None,
+    output_format: str = "netcdf",
+    zarr_format: int = 2,
+    checkpoint: bool = False,
+    **tropo_kwargs,
+) -> list[dict]:
+    """Run the troposphere workflow on many HRES files with one Dask cluster.
+
+    The cluster, and the imports and caches of its workers, are reused for
+    every file. Up to `max_in_flight` products are computed at the same time,
+    so reading, computing and writing of consecutive files overlap. As
+    with `opera_tropo._writer.write_netcdf`, the NetCDF chunks are
+    compressed by the workers and written by this process as they complete.
+
+    A file failing to be processed, from an invalid input or an error
+    while computing its product, does not stop the batch: the error is
+    recorded in its report, its partial output is removed and the other
+    files are processed.
+
+    Parameters
+    ----------
+    file_paths : Sequence[str | Path]
+        Paths to the input HRES files.
+    output_files : Sequence[str | Path]
+        Paths to the output NetCDF files or Zarr stores, one per input file.
+    max_in_flight : int, optional
+        Maximum number of products computed at the same time. Default is 2.
+    num_workers : int or "auto", optional
+        Number of parallel workers. Default is 4.
+    num_threads : int or "auto", optional
+        Number of threads per worker. Default is 2.
+    max_memory : int or str, optional
+        Maximum memory allocation per worker, or "auto". Default is '16GB'.
+        "auto" settings, including a `block_size` of "auto", are planned
+        once from the first input file.
+    temp_dir : str, optional
+        Directory for temporary files. Default is None.
+    scheduler : str, optional
+        Dask scheduler, see `opera_tropo.run.tropo`. "auto" selects one from
+        the size of the first input file. With the local "threads",
+        "processes" and "synchronous" schedulers, the files are processed
+        one at a time. Ignored if `client` is given. Default is "auto".
+    client : Client, optional
+        Existing Dask client to run on, kept open after processing.
+        Default is None (start a local cluster for the batch).
+    output_format : str, optional
+        Output format, "netcdf" or "zarr". Default is "netcdf".
+    zarr_format : int, optional
+        Zarr format version, 2 or 3. Default is 2.
+    checkpoint : bool, optional
+        Save the finished output blocks of each file under `temp_dir`, see
+        `opera_tropo.run.tropo`. A rerun of the batch after a failure then
+        only computes the missing blocks. Default is False.
+    **tropo_kwargs
+        Product options passed to `opera_tropo.run.build_tropo`.
+
+    Returns
+    -------
+    list[dict]
+        Per-file report, in order of completion, with the input and output
+        paths, the "status" ("succeeded" or "failed"), the "error" of a
+        failed file (None otherwise) and the processing time in seconds
+        (from submission to the written file). Succeeded files also report
+        the throughput in grid columns per second.
+
+    Raises
+    ------
+    ValueError
+        If the number of input and output files differ, or output
+        files are repeated.
+
+    """
+    if len(file_paths) != len(output_files):
+        raise ValueError(
+            f"Got {len(file_paths)} input files and {len(output_files)} output files."
+        )
+    if len({str(Path(f)) for f in output_files}) != len(output_files):
+        raise ValueError("Output files must be unique.")
+    if max_in_flight < 1:
+        raise ValueError(f"max_in_flight must be >= 1, got {max_in_flight}")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unknown output format: {output_format}. Choose from {OUTPUT_FORMATS}."
+        )
+
+    # Plan "auto" resources once, the inputs of a batch share the grid
+    block_size = tropo_kwargs.get("block_size", BLOCK_SIZE)
+    resources = (num_workers, num_threads, max_memory, block_size)
+    input_nbytes = 0
+    if file_paths:
+        sizes, input_nbytes = inspect_input(
+            str(file_paths[0]), tropo_kwargs.get("bbox")
+        )
+    if file_paths and ((client is None and AUTO in resources) or block_size == AUTO):
+        plan = resolve_resources(
+            sizes,
+            tropo_kwargs.get("out_heights"),
+            tropo_kwargs.get("engine", "raider"),
+            *resources,
+            client=client,
+        )
+        num_workers, num_threads = plan.n_workers, plan.threads_per_worker
+        max_memory = plan.max_memory
+        if block_size == AUTO:
+            tropo_kwargs["block_size"] = plan.block_shape
+
+    own_client = False
+    if client is None:
+        scheduler = select_scheduler(scheduler, input_nbytes, max_memory)
+        if scheduler == "distributed":
+            client = start_client(num_workers, num_threads, max_memory, temp_dir)
+            own_client = True
+
+    native_threads = get_task_native_threads(
+        scheduler, num_workers, num_threads, client
+    )
+
+    t_start = time.perf_counter()
+    reports: list[dict] = []
+
+    # Options setting the content of the output blocks, keying their checkpoints
+    product_options = {
+        key: value
+        for key, value in tropo_kwargs.items()
+        if key not in ("out_chunk_size", "compression_options")
+    }
+    checkpoint_root = Path(temp_dir or tempfile.gettempdir()) / "checkpoints"
+
+    def _report(report: dict, validation_stats: Optional[dict]) -> None:
+        checkpoint_dir = report.pop("checkpoint_dir")
+        if checkpoint_dir is not None:
+            shutil.rmtree(checkpoint_dir)
+        if validation_stats is not None:
+            logger.info(f"Input checkup of {report['input']}:")
+            report_product_validation(validation_stats, report["output"])
+        report["seconds"] = time.perf_counter() - report.pop("start")
+        report["columns_per_second"] = report.pop("columns") / report["seconds"]
+        logger.info(
+            f"Written {report['output']} in {report['seconds']:.1f} s"
+            f" ({report['columns_per_second']:.0f} columns/s)"
+        )
+        reports.append(report)
+
+    def _fail(report: dict, error: Exception, written: bool = True) -> None:
+        # Called while handling `error`, to log its traceback
+        logger.exception(f"Failed to process {report['input']}")
+        if written:
+            output_path = Path(report["output"])
+            if output_path.is_dir():
+                shutil.rmtree(output_path)
+            else:
+                output_path.unlink(missing_ok=True)
+        # Saved blocks are kept for a rerun
+        report.pop("checkpoint_dir", None)
+        report.pop("columns", None)
+        report["status"] = "failed"
+        report["error"] = f"{type(error).__name__}: {error}"
+        report["seconds"] = time.perf_counter() - report.pop("start")
+        reports.append(report)
+
+    def _start(file_path, output_file) -> dict:
+        logger.info(f"Submitting {file_path}")
+        return {
+            "input": str(file_path),
+            "output": str(output_file),
+            "status": "succeeded",
+            "error": None,
+            "start": time.perf_counter(),
+            "checkpoint_dir": None,
+        }
+
+    def _build(file_path, report: dict) -> tuple[xr.Dataset, dict, Optional[dict]]:
+        if checkpoint:
+            report["checkpoint_dir"] = open_checkpoint(
+                checkpoint_root, file_path, product_options
+            )
+        out_ds, encoding, validation_stats = build_tropo(
+            str(file_path),
+            output_format=output_format,
+            checkpoint_dir=report["checkpoint_dir"],
+            native_threads=native_threads,
+            **tropo_kwargs,
+        )
+        report["columns"] = (
+            out_ds.sizes["time"] * out_ds.sizes["latitude"] * out_ds.sizes["longitude"]
+        )
+        return out_ds, encoding, validation_stats
+
+    if client is None:
+        # Local schedulers use all threads for one file at a time
+        with get_local_scheduler(scheduler, num_workers, num_threads):
+            for file_path, output_file in zip(file_paths, output_files):
+                report = _start(file_path, output_file)
+                written = False
+                try:
+                    out_ds, encoding, validation_stats = _build(file_path, report)
+                    written = True
+                    validation_stats = write_product(
+                        out_ds,
+                        output_file,
+                        encoding,
+                        validation_stats,
+                        output_format=output_format,
+                        zarr_format=zarr_format,
+                        scheduler=scheduler,
+                    )
+                    _report(report, validation_stats)
+                except Exception as e:
+                    _fail(report, e, written)
+        _log_batch(reports, t_start)
+        return reports
+
+    # Writes in flight, and the write of each of their futures
+    writes: dict = {}
+    owners: dict = {}
+    completed = False
+
+    def _collect(future, data) -> None:
+        write = owners.pop(future)
+        if write not in writes:
+            # Remaining future of a failed write
+            future.release()
+            return
+        report = writes[write]
+        try:
+            if future.status == "error":
+                future.result()  # Raise processing errors
+            write.add_result(future, data)
+            if write.done:
+                del writes[write]
+                _report(report, write.close())
+        except Exception as e:
+            writes.pop(write, None)
+            write.close()
+            _fail(report, e)
+
+    try:
+        in_flight = as_completed(with_results=True, raise_errors=False)
+        for file_path, output_file in zip(file_paths, output_files):
+            report = _start(file_path, output_file)
+            written = False
+            try:
+                out_ds, encoding, validation_stats = _build(file_path, report)
+                written = True
+                if output_format == "zarr":
+                    write = write_zarr(
+                        out_ds, output_file, encoding, zarr_format, compute=False
+                    )
+                    # Input statistics are computed from the same blocks as the
+                    # product
+                    write = SubmittedWrite(
+                        Path(output_file),
+                        client.compute(dask.delayed([write, validation_stats])[1]),
+                    )
+                else:
+                    # Chunks compressed by the workers, written here as they
+                    # complete
+                    write = submit_netcdf(
+                        out_ds, output_file, encoding, validation_stats, client
+                    )
+            except Exception as e:
+                _fail(report, e, written)
+                continue
+            writes[write] = report
+            owners.update(dict.fromkeys(write.futures, write))
+            in_flight.update(write.futures)
+
+            # Wait for a product to finish before submitting more
+            while len(writes) >= max_in_flight:
+                _collect(*next(in_flight))
+
+        for future, data in in_flight:
+            _collect(future, data)
+        completed = True
+    finally:
+        for write in writes:
+            write.close()
+        if own_client:
+            # Keep the blocks saved under the temp. directory for a rerun
+            failed = any(report["status"] == "failed" for report in reports)
+            keep_temp = checkpoint and (failed or not completed)
+            stop_client(client, None if keep_temp else temp_dir)
+
+    _log_batch(reports, t_start)
+    return reports
+
+
+def _log_batch(reports: list[dict], t_start: float) -> None:
+    elapsed = time.perf_counter() - t_start
+    logger.info(
+        f"Processed {len(reports)} products in {elapsed:.1f} s"
+        f" ({3600 * len(reports) / elapsed:.1f} products/hour)"
+    )
+    failed = [report["input"] for report in reports if report["status"] == "failed"]
+    if failed:
+        logger.error(f"Failed to process {len(failed)} products: {failed}")
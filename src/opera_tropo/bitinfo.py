@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import logging
+import math
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+from numpy.typing import DTypeLike
+from scipy.stats import norm
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "BandKeepBits",
+    "get_bit_information",
+    "get_error_bits",
+    "get_information_bits",
+    "plan_keep_bits",
+]
+
+# Upper edges (m) of the height bands sharing their keep_bits:
+# boundary layer, free troposphere, upper troposphere, stratosphere, above
+HEIGHT_BANDS = (3000.0, 8000.0, 15000.0, 30000.0)
+# Largest rounding error (m), the error of the default keep_bits on the delays
+# near the ground: 10 bits for wet delays below 1 m, 12 for hydrostatic below 4 m
+MAX_ERROR = 2.5e-4
+# Fraction of the real information kept in the mantissa bits
+INFORMATION_LEVEL = 0.99
+# Confidence level of the information distinguished from random bits
+CONFIDENCE = 0.99
+
+
+@dataclass(frozen=True)
+class BandKeepBits:
+    """Mantissa bits kept per height band of the product variables.
+
+    Bands are delimited by `height_edges`: band 0 holds the heights below
+    the first edge, band i the heights in [edge i-1, edge i), the last band
+    those at or above the last edge. The data is rounded to at least
+    `keep_bits` mantissa bits, and more where its magnitude requires them
+    to stay within `max_error`.
+    """
+
+    height_edges: tuple[float, ...]
+    keep_bits: dict[str, tuple[int, ...]]
+    max_error: float
+
+    def get_height_keep_bits(self, name: str, heights: np.ndarray) -> np.ndarray:
+        """Get the keep_bits of variable `name` at each of `heights`."""
+        bands = np.digitize(heights, self.height_edges)
+        return np.asarray(self.keep_bits[name])[bands]
+
+    def to_attrs(self, name: str) -> dict:
+        """Get the variable attributes recording the keep_bits of `name`."""
+        return {
+            "keep_bits": np.asarray(self.keep_bits[name], dtype=np.int32),
+            "keep_bits_height_edges": np.asarray(self.height_edges, dtype=np.float64),
+            "max_quantization_error": self.max_error,
+        }
+
+
+def _get_free_entropy(n_samples: int, confidence: float = CONFIDENCE) -> float:
+    """Get the mutual information of random bits at a confidence level.
+
+    Bits of `n_samples` independent pairs reach this information by chance.
+    """
+    p = 0.5 + norm.ppf(1 - (1 - confidence) / 2) * math.sqrt(0.25 / n_samples)
+    p = min(p, 1.0)
+    entropy = -sum(q * math.log2(q) for q in (p, 1 - p) if q > 0)
+    return 1 - entropy
+
+
+def get_bit_information(
+    data: np.ndarray, axis: int = -1, confidence: float = CONFIDENCE
+) -> np.ndarray:
+    """Get the real information content of each bit of a float array.
+
+    The information of a bit is the mutual information of its values in
+    neighbours along `axis` (Klöwer et al., 2021, Compressing atmospheric
+    data into its real information content, Nat. Comput. Sci.).
+    Information below the level reached by random bits is set to zero.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Float array. Pairs with a NaN are ignored.
+    axis : int, optional
+        Axis of the neighbours. Default is the last axis.
+    confidence : float, optional
+        Confidence level separating information from random bits.
+        Default is 0.99.
+
+    Returns
+    -------
+    np.ndarray
+        Information in bits of each bit of the data type, from the sign
+        bit to the last mantissa bit.
+
+    """
+    data = np.moveaxis(np.asarray(data), axis, -1)
+    n_bits = 8 * data.dtype.itemsize
+    bits = data.view(f"u{data.dtype.itemsize}")
+    valid = ~(np.isnan(data[..., :-1]) | np.isnan(data[..., 1:]))
+    first, second = bits[..., :-1][valid], bits[..., 1:][valid]
+    n_samples = first.size
+    information = np.zeros(n_bits)
+    if n_samples == 0:
+        return information
+
+    for i in range(n_bits):
+        shift = first.dtype.type(n_bits - 1 - i)
+        pairs = 2 * ((first >> shift) & 1) + ((second >> shift) & 1)
+        joint = np.bincount(pairs.astype(np.intp), minlength=4).reshape(2, 2)
+        joint = joint / n_samples
+        independent = np.outer(joint.sum(axis=1), joint.sum(axis=0))
+        nonzero = joint > 0
+        information[i] = np.sum(
+            joint[nonzero] * np.log2(joint[nonzero] / independent[nonzero])
+        )
+    information[information <= _get_free_entropy(n_samples, confidence)] = 0
+    return information
+
+
+def get_information_bits(
+    information: np.ndarray,
+    dtype: DTypeLike = np.float32,
+    information_level: float = INFORMATION_LEVEL,
+) -> int:
+    """Get the mantissa bits holding a fraction of the real information.
+
+    Parameters
+    ----------
+    information : np.ndarray
+        Information of each bit, from `get_bit_information`.
+    dtype : DTypeLike, optional
+        Float type of the data. Default is float32.
+    information_level : float, optional
+        Fraction of the total information kept. Default is 0.99.
+
+    Returns
+    -------
+    int
+        Number of mantissa bits to keep.
+
+    """
+    n_mantissa = np.finfo(dtype).nmant
+    n_sign_exponent = len(information) - n_mantissa
+    total = information.sum()
+    if total == 0:
+        return 0
+    cumulative = np.cumsum(information) / total
+    n_kept = int(np.argmax(cumulative >= information_level)) + 1
+    return int(np.clip(n_kept - n_sign_exponent, 0, n_mantissa))
+
+
+def get_error_bits(
+    max_abs: float, max_error: float, dtype: DTypeLike = np.float32
+) -> int:
+    """Get the mantissa bits bounding the rounding error of values.
+
+    Rounding to `keep_bits` mantissa bits changes a value in [2**e, 2**(e+1))
+    by at most 2**(e - keep_bits - 1), after the error of the cast of
+    higher-precision values to `dtype`, at most 2**(e - nmant - 1).
+
+    Parameters
+    ----------
+    max_abs : float
+        Largest absolute value rounded.
+    max_error : float
+        Largest absolute rounding error.
+    dtype : DTypeLike, optional
+        Float type of the data. Default is float32.
+
+    Returns
+    -------
+    int
+        Smallest number of mantissa bits to keep.
+
+    """
+    n_mantissa = np.finfo(dtype).nmant
+    if not np.isfinite(max_abs) or max_abs <= np.finfo(dtype).tiny:
+        return 0
+    exponent = math.floor(math.log2(max_abs))
+    cast_error = 2.0 ** (exponent - n_mantissa - 1)
+    if max_error <= cast_error:
+        return n_mantissa
+    bits = math.ceil(exponent - 1 - math.log2(max_error - cast_error))
+    return int(np.clip(bits, 0, n_mantissa))
+
+
+def plan_keep_bits(
+    delays: dict[str, np.ndarray],
+    heights: np.ndarray,
+    max_bits: dict[str, int],
+    height_edges: Sequence[float] = HEIGHT_BANDS,
+    max_error: float = MAX_ERROR,
+    information_level: float = INFORMATION_LEVEL,
+    dtype: DTypeLike = np.float32,
+) -> BandKeepBits:
+    """Choose the keep_bits of each variable and height band from a sample.
+
+    The keep_bits of a band hold `information_level` of the real
+    information along longitude, at most `max_bits`, and at least the bits
+    keeping the rounding error of the sample within `max_error`.
+
+    Parameters
+    ----------
+    delays : dict[str, np.ndarray]
+        Sample delays of each variable, with dimensions
+        (time, latitude, longitude, height).
+    heights : np.ndarray
+        Heights (m) of the last axis of the delays.
+    max_bits : dict[str, int]
+        Largest keep_bits of each variable.
+    height_edges : Sequence[float], optional
+        Edges (m) between the height bands. Default is `HEIGHT_BANDS`.
+    max_error : float, optional
+        Largest rounding error (m). Default is `MAX_ERROR`.
+    information_level : float, optional
+        Fraction of the real information kept. Default is 0.99.
+    dtype : DTypeLike, optional
+        Float type of the product. Default is float32.
+
+    Returns
+    -------
+    BandKeepBits
+        Chosen keep_bits.
+
+    """
+    if max_error <= 0:
+        raise ValueError(f"max_error must be > 0, got {max_error}")
+    height_edges = tuple(float(edge) for edge in height_edges)
+    bands = np.digitize(heights, height_edges)
+
+    keep_bits = {}
+    for name, data in delays.items():
+        data = np.asarray(data, dtype=dtype)
+        band_bits = []
+        for band in range(len(height_edges) + 1):
+            in_band = bands == band
+            if not in_band.any():
+                band_bits.append(max_bits[name])
+                continue
+            band_data = data[..., in_band]
+            information = get_bit_information(band_data, axis=2)
+            bits = min(
+                get_information_bits(information, dtype, information_level),
+                max_bits[name],
+            )
+            max_abs = float(np.nanmax(np.abs(band_data), initial=0))
+            band_bits.append(max(bits, get_error_bits(max_abs, max_error, dtype)))
+        keep_bits[name] = tuple(band_bits)
+    return BandKeepBits(height_edges, keep_bits, max_error)
@@ -71,9 +71,10 @@ def make_browse_image_from_nc(
     height: float = 800,
 ) -> None:
     """Create a PNG browse image for the output product from product in NetCDF file."""
-    # Extract ZTD at zero height for browse image
+    # Extract ZTD at zero height for browse image, or the lowest height
+    # if `min_height` or `out_heights` trimmed it
     with xr.open_dataset(input_filename) as ds:
-        wet = ds.wet_delay.isel(time=0).sel(height=0).data
+        wet = ds.wet_delay.isel(time=0).sel(height=0, method="nearest").data
         hydrostatic = (
             ds.hydrostatic_delay.isel(time=0).sel(height=height, method="nearest").data
         )
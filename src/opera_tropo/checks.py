@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import logging
-from typing import Tuple
+import math
+import time
+from typing import Literal, Optional, Tuple
 
 import dask as da
 import numpy as np
@@ -29,6 +31,8 @@ VALID_RANGE: dict[str, tuple[float, float]] = {
     "lnsp": (10.2, 11.75),  # Log of surface pressure (unitless)
 }
 
+SAMPLE_METHODS = ("strided", "random")
+
 
 def get_min_max_nan(var_data: xr.DataArray) -> Tuple[float, float, int]:
     """Get min/max and nan_count."""
@@ -142,8 +146,132 @@ def check_nans_valid_range(ds: xr.Dataset) -> dict[str, list[float]]:
     return out_range_vars
 
 
+def _get_block_stats(block: np.ndarray) -> tuple[float, float, int]:
+    """Get the min/max and NaN count of one chunk."""
+    n_nans = int(np.isnan(block).sum())
+    if n_nans == block.size:
+        return np.nan, np.nan, n_nans
+    return float(np.nanmin(block)), float(np.nanmax(block)), n_nans
+
+
+def _select_blocks(
+    n_blocks: int, n_sampled: int, method: str, rng: np.random.Generator
+) -> np.ndarray:
+    """Select the indices of the sampled chunks."""
+    if method == "random":
+        return np.sort(rng.choice(n_blocks, n_sampled, replace=False))
+    # Evenly spaced, including the first and last chunks
+    return np.unique(np.linspace(0, n_blocks - 1, n_sampled).round().astype(int))
+
+
+def get_sampled_stats(
+    ds: xr.Dataset,
+    sample_fraction: float,
+    method: Literal["strided", "random"] = "strided",
+    seed: Optional[int] = None,
+) -> dict[str, tuple[float, float, int]]:
+    """Estimate the min/max/NaN count of the input variables from a sample.
+
+    Only a subset of the Dask chunks of each variable is read. With the
+    dataset opened with its on-disk chunks, e.g. with `chunks={}`, each
+    sampled chunk is one HDF5 chunk of the file.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Input dataset, chunked with Dask.
+    sample_fraction : float
+        Fraction of the chunks of each variable to read, in (0, 1].
+    method : {"strided", "random"}, optional
+        Read evenly spaced chunks, or a random subset of them.
+        Default is "strided".
+    seed : int, optional
+        Seed of the random chunk selection. Default is None.
+
+    Returns
+    -------
+    dict[str, tuple[float, float, int]]
+        (min, max, NaN count) of the sampled values of each variable.
+
+    """
+    if not 0 < sample_fraction <= 1:
+        raise ValueError(f"sample_fraction must be in (0, 1], got {sample_fraction}")
+    if method not in SAMPLE_METHODS:
+        raise ValueError(
+            f"Unknown sample method: {method}. Choose from {SAMPLE_METHODS}."
+        )
+
+    rng = np.random.default_rng(seed)
+    get_stats = da.delayed(_get_block_stats, pure=True)
+    block_stats = {}
+    for var in sorted(EXPECTED_VARS):
+        data = _get_checked_data(ds, var).data
+        # In-memory data is a single chunk
+        blocks = data.to_delayed().ravel() if da.is_dask_collection(data) else [data]
+        n_sampled = max(1, math.ceil(sample_fraction * len(blocks)))
+        indices = _select_blocks(len(blocks), n_sampled, method, rng)
+        block_stats[var] = [get_stats(blocks[i]) for i in indices]
+
+    (block_stats,) = da.compute(block_stats)
+    stats = {}
+    for var, values in block_stats.items():
+        mins, maxs, nans = zip(*values)
+        stats[var] = (
+            float(np.nanmin(mins)) if not np.isnan(mins).all() else np.nan,
+            float(np.nanmax(maxs)) if not np.isnan(maxs).all() else np.nan,
+            int(sum(nans)),
+        )
+    return stats
+
+
+def sample_check(
+    ds: xr.Dataset,
+    sample_fraction: float,
+    method: Literal["strided", "random"] = "strided",
+    seed: Optional[int] = None,
+) -> bool:
+    """Check the valid range and NaNs of the input variables on a sample.
+
+    See `get_sampled_stats` for the parameters.
+
+    Returns
+    -------
+    bool
+        True if the sampled values are all valid, False if the sample
+        contains NaNs or values out of their valid range, and the data
+        needs a full scan.
+
+    """
+    t0 = time.perf_counter()
+    stats = get_sampled_stats(ds, sample_fraction, method, seed)
+    elapsed = time.perf_counter() - t0
+
+    issues = []
+    for var, (min_val, max_val, nan_count) in stats.items():
+        valid_min, valid_max = VALID_RANGE[var]
+        if nan_count > 0:
+            issues.append(f'"{var}" has {nan_count} NaNs')
+        elif min_val < valid_min or max_val > valid_max:
+            issues.append(f'"{var}" in [{min_val:.5f}, {max_val:.5f}]')
+        else:
+            logger.debug(
+                f'   Variable "{var}" sampled stats:'
+                f" min = {min_val:.5f}, max = {max_val:.5f}"
+            )
+
+    logger.info(
+        f"  Sampled check ({method}, {sample_fraction:.0%} of chunks)"
+        f" in {elapsed:.2f} s: {'; '.join(issues) if issues else 'no issues found'}."
+    )
+    return not issues
+
+
 @log_runtime
-def validate_input(ds: xr.Dataset) -> xr.Dataset:
+def validate_input(
+    ds: xr.Dataset,
+    sample_fraction: Optional[float] = None,
+    sample_method: Literal["strided", "random"] = "strided",
+) -> xr.Dataset:
     """Validate and sanitize an xarray Dataset.
 
     This function performs a series of validation checks on the input dataset:
@@ -155,15 +283,26 @@ def validate_input(ds: xr.Dataset) -> xr.Dataset:
     - Checks that all data variables are within their predefined valid ranges.
     - Clips values falling outside valid ranges to the nearest acceptable bound.
 
+    With `sample_fraction`, the valid range and NaNs are first checked on a
+    subset of the chunks of each variable with `sample_check`, and the
+    full scan (and clipping) only runs if the sample shows issues.
+
     Note
     ----
     Known ECMWF artifacts may result in small negative humidity values due to
     numerical or interpolation effects. These are clipped during validation.
+    A clean sample does not guarantee clean data: values out of range in
+    unsampled chunks are then not clipped.
 
     Parameters
     ----------
     ds : xr.Dataset
         The input xarray Dataset to be validated.
+    sample_fraction : float, optional
+        Fraction of the chunks of each variable read by the sampled check,
+        in (0, 1]. Default is None (full scan only).
+    sample_method : {"strided", "random"}, optional
+        Chunk selection of the sampled check. Default is "strided".
 
     Returns
     -------
@@ -182,9 +321,16 @@ def validate_input(ds: xr.Dataset) -> xr.Dataset:
     logger.info("  Checking coordinate ranges and data variables.")
     check_coords_and_variables(ds)
 
+    if sample_fraction is not None:
+        if sample_check(ds, sample_fraction, sample_method):
+            return ds
+        logger.info("  Sample shows issues, falling back to a full scan.")
+
     # Check Nans and valid range
     logger.info("  Checking nans and data valid range.")
+    t0 = time.perf_counter()
     vars_out = check_nans_valid_range(ds)
+    logger.info(f"  Full check in {time.perf_counter() - t0:.2f} s.")
 
     for var, (vmin_actual, vmax_actual) in vars_out.items():
         vmin_valid, vmax_valid = VALID_RANGE[var]
@@ -208,3 +354,122 @@ def validate_input(ds: xr.Dataset) -> xr.Dataset:
                 ds[var] = ds[var].where(ds[var] <= vmax_valid, np.nan)
 
     return ds
+
+
+def _get_checked_data(ds: xr.Dataset, var: str) -> xr.DataArray:
+    """Get the data of a variable checked for valid range and NaNs."""
+    return ds[var].isel(level=0) if var in ["z", "lnsp"] else ds[var]
+
+
+def get_validation_stats(ds: xr.Dataset) -> dict[str, tuple]:
+    """Get lazy min/max/NaN count statistics of the input variables.
+
+    The statistics are reduced from the same Dask chunks as the ones
+    processed, so computing them together with the product reads the
+    input only once.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Input dataset, chunked as processed.
+
+    Returns
+    -------
+    dict[str, tuple]
+        Lazy (min, max, NaN count) of each variable, to compute and pass
+        to `report_validation`.
+
+    """
+    stats = {}
+    for var in sorted(EXPECTED_VARS):
+        data = _get_checked_data(ds, var).data
+        stats[var] = (
+            da.array.nanmin(data),
+            da.array.nanmax(data),
+            da.array.isnan(data).sum(),
+        )
+    return stats
+
+
+def clip_valid_range(ds: xr.Dataset) -> xr.Dataset:
+    """Clip the input variables of a (block) dataset to their valid range.
+
+    Applies the same clipping as `validate_input`: negative and NaN humidity
+    values are set to 0, and values outside of `VALID_RANGE` are masked
+    with NaN.
+    """
+    ds = ds.copy()
+    for var in VALID_RANGE:
+        ds[var] = ds[var].copy(data=clip_valid_data(var, ds[var].values))
+    return ds
+
+
+def clip_valid_data(var: str, data: np.ndarray) -> np.ndarray:
+    """Clip the array of an input variable to its valid range.
+
+    See `clip_valid_range`.
+    """
+    vmin_valid, vmax_valid = VALID_RANGE[var]
+    clipped = data
+    if var == "q":
+        # As `validate_input`, NaN humidity is filled with negatives
+        clipped = np.where((clipped < 0) | np.isnan(clipped), 0, clipped)
+        clipped = np.where(clipped > vmax_valid, np.nan, clipped)
+    else:
+        clipped = np.where(
+            (clipped < vmin_valid) | (clipped > vmax_valid), np.nan, clipped
+        )
+    return clipped.astype(data.dtype, copy=False)
+
+
+def report_validation(stats: dict[str, tuple]) -> dict[str, list[float]]:
+    """Report the computed input statistics of `get_validation_stats`.
+
+    Parameters
+    ----------
+    stats : dict[str, tuple]
+        Computed (min, max, NaN count) of each variable.
+
+    Returns
+    -------
+    dict[str, list[float]]
+        [min, max] of the variables out of their valid range, which were
+        clipped during processing.
+
+    Raises
+    ------
+    ValidationError
+        If a variable contains only NaN values.
+
+    """
+    issues: list[str] = []
+    nan_issues: list[str] = []
+    out_range_vars: dict[str, list[float]] = {}
+
+    for var, (min_val, max_val, nan_count) in stats.items():
+        min_val, max_val, nan_count = float(min_val), float(max_val), int(nan_count)
+        if np.isnan(min_val):
+            issues.append(f'Variable "{var}" contains only NaN values.')
+            continue
+
+        valid_min, valid_max = VALID_RANGE[var]
+        if (min_val < valid_min) or (max_val > valid_max):
+            logger.warning(
+                f'   Variable "{var}" is out of valid range {VALID_RANGE[var]}: '
+                f"min = {min_val:.5f} [<{valid_min}],"
+                f"max = {max_val:.5f} [>{valid_max}], clipped"
+            )
+            out_range_vars[var] = [min_val, max_val]
+        else:
+            logger.info(
+                f'   Variable "{var}" stats:'
+                f" min = {min_val:.5f}, max = {max_val:.5f}, NaNs = {nan_count}"
+            )
+        if nan_count > 0:
+            nan_issues.append(f'Data Variable "{var}" contains {nan_count} NaNs.')
+
+    if issues:
+        raise ValidationError("Failed validation checks:\n" + "\n".join(issues))
+    if nan_issues:
+        logger.warning(nan_issues)
+    return out_range_vars
@@ -1,9 +1,12 @@
 import click
 
+from .bench import bench_encoding
 from .config import run_create_config
 from .download import download, list_dates
+from .export import export_netcdf
 from .make_browse import make_browse
-from .run import run_cli
+from .points import point_delays
+from .run import run_batch_cli, run_cli
 from .validate import validate
 
 
@@ -22,8 +25,12 @@ cli_app.add_command(download)
 cli_app.add_command(list_dates)
 cli_app.add_command(run_create_config)
 cli_app.add_command(run_cli)
+cli_app.add_command(run_batch_cli)
 cli_app.add_command(validate)
 cli_app.add_command(make_browse)
+cli_app.add_command(point_delays)
+cli_app.add_command(export_netcdf)
+cli_app.add_command(bench_encoding)
 
 if __name__ == "__main__":
     cli_app()
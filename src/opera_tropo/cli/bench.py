@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import functools
+
+import click
+
+__all__ = ["bench_encoding"]
+# Always show defaults
+click.option = functools.partial(click.option, show_default=True)
+
+
+def _parse_chunks(_ctx, _param, value):
+    """Parse chunk shapes given as comma-separated sizes."""
+    try:
+        return [tuple(int(size) for size in shape.split(",")) for shape in value]
+    except ValueError:
+        raise click.BadParameter("expected comma-separated integers, e.g. 1,8,512,512")
+
+
+@click.command("bench-encoding")
+@click.option("-i", "--in-fname", required=True, help="Path to input TROPO product")
+@click.option(
+    "-c",
+    "--chunks",
+    multiple=True,
+    callback=_parse_chunks,
+    help=(
+        "Chunk shape (time,height,lat,lon), can be repeated."
+        " Default: 1,64,64,64 1,8,512,512 1,145,32,32"
+    ),
+)
+@click.option(
+    "-p",
+    "--profile",
+    multiple=True,
+    type=click.Choice(["zlib", "zstd", "blosc-lz4", "blosc-zstd"]),
+    help="Compression profile, can be repeated. Default: all supported",
+)
+@click.option(
+    "-k",
+    "--keep-bits",
+    multiple=True,
+    type=int,
+    help="Mantissa bits kept, can be repeated. Default: as stored",
+)
+@click.option("--n-reads", default=5, type=int, help="Reads per access pattern")
+@click.option("--window", default=64, type=int, help="Lat/lon size of cube reads")
+@click.option(
+    "--sort-by",
+    default="size",
+    type=click.Choice(
+        ["size", "encode_s", "write_s", "map_ms", "column_ms", "cube_ms"]
+    ),
+    help="Column ranking the results",
+)
+@click.option("-o", "--out-fname", help="Path to output CSV table")
+@click.option("--work-dir", help="Directory of the temporary products")
+@click.option("--debug", is_flag=True)
+def bench_encoding(
+    in_fname,
+    chunks,
+    profile,
+    keep_bits,
+    n_reads,
+    window,
+    sort_by,
+    out_fname,
+    work_dir,
+    debug,
+):
+    """Benchmark output chunks, compression and keep_bits on a product.
+
+    Reports the file size, encoding CPU time, write time and read latencies
+    of a single-height map, a single column and a DEM-window cube, ranked
+    by `--sort-by`.
+    """
+    # rest of imports here so --help doesn't take forever
+    import pandas as pd
+
+    from opera_tropo.compression import bench_encoding
+    from opera_tropo.log.loggin_setup import setup_logging
+
+    setup_logging(logger_name="opera_tropo", debug=debug)
+
+    reports = bench_encoding(
+        in_fname,
+        chunk_shapes=chunks or None,
+        profiles=profile or None,
+        keep_bits=keep_bits or (None,),
+        n_reads=n_reads,
+        window=window,
+        sort_by=sort_by,
+        work_dir=work_dir,
+    )
+    df = pd.DataFrame(reports)
+    df.insert(0, "rank", range(1, len(df) + 1))
+    df["size_mb"] = df.pop("size") / 1e6
+    click.echo(df.to_string(index=False, float_format="{:.4g}".format))
+    if out_fname is not None:
+        df.to_csv(out_fname, index=False)
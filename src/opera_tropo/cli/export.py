@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import functools
+from pathlib import Path
+
+import click
+
+__all__ = ["export_netcdf"]
+# Always show defaults
+click.option = functools.partial(click.option, show_default=True)
+
+
+@click.command("export-netcdf")
+@click.option("-i", "--in-store", required=True, help="Path to input Zarr product")
+@click.option("-o", "--out-fname", help="Path to output NetCDF file")
+@click.option(
+    "--profile",
+    default="zlib",
+    type=click.Choice(["zlib", "zstd", "blosc-lz4", "blosc-zstd"]),
+    help="Compression profile",
+)
+@click.option(
+    "--complevel",
+    type=int,
+    help="Compression level. Default is the level of the profile.",
+)
+def export_netcdf(in_store, out_fname, profile, complevel):
+    """Export a Zarr troposphere product to NetCDF4."""
+    from opera_tropo._writer import zarr_to_netcdf
+
+    if out_fname is None:
+        out_fname = Path(in_store).with_suffix(".nc")
+    if Path(out_fname).resolve() == Path(in_store).resolve():
+        raise click.BadParameter(
+            f"Output file {out_fname} would overwrite the input store.",
+            param_hint="'-o' / '--out-fname'",
+        )
+
+    compression_options = {"profile": profile}
+    if complevel is not None:
+        compression_options["complevel"] = complevel
+    zarr_to_netcdf(in_store, out_fname, compression_options=compression_options)
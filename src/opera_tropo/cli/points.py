@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import functools
+
+import click
+
+__all__ = ["point_delays"]
+# Always show defaults
+click.option = functools.partial(click.option, show_default=True)
+
+
+@click.command("point-delays")
+@click.option("-i", "--in-fname", required=True, help="Path to input HRES file")
+@click.option(
+    "-p",
+    "--points",
+    required=True,
+    type=click.Path(exists=True),
+    help=(
+        "CSV file of points with 'latitude', 'longitude' and 'height' columns."
+        " Other columns are copied to the output."
+    ),
+)
+@click.option("-o", "--out-fname", required=True, help="Path to output CSV file")
+@click.option("--debug", is_flag=True)
+def point_delays(in_fname, points, out_fname, debug):
+    """Compute zenith delays at points from an HRES model file."""
+    # rest of imports here so --help doesn't take forever
+    import pandas as pd
+
+    from opera_tropo.log.loggin_setup import setup_logging
+    from opera_tropo.points import compute_point_delays
+
+    setup_logging(logger_name="opera_tropo", debug=debug)
+
+    df = pd.read_csv(points)
+    out_ds = compute_point_delays(
+        in_fname, df[["latitude", "longitude", "height"]].to_numpy()
+    )
+    # One row per point and model time
+    delays = (
+        out_ds[["wet_delay", "hydrostatic_delay"]]
+        .reset_coords(drop=True)
+        .to_dataframe()
+        .reset_index()
+    )
+    df = df.reset_index(names="point").merge(delays, on="point")
+    df.drop(columns="point").to_csv(out_fname, index=False)
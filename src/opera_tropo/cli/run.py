@@ -2,7 +2,7 @@
 
 import click
 
-__all__ = ["run_cli", "run_main"]
+__all__ = ["run_batch_cli", "run_cli", "run_main"]
 
 
 def run_main(config_file: str, debug: bool = False) -> None:
@@ -25,3 +25,65 @@ def run_cli(
 ) -> None:
     """Run the troposphere correction workflow for CONFIG_FILE."""
     run_main(config_file=config_file, debug=ctx.obj["debug"])
+
+
+@click.command("run-batch")
+@click.argument("config_file", type=click.Path(exists=True))
+@click.argument("inputs", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--start-date",
+    type=click.DateTime(),
+    default=None,
+    help="Only process model times on or after this date.",
+)
+@click.option(
+    "--end-date",
+    type=click.DateTime(),
+    default=None,
+    help="Only process model times on or before this date.",
+)
+@click.option(
+    "--max-in-flight",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help="Maximum number of products computed at the same time.",
+)
+@click.pass_context
+def run_batch_cli(
+    ctx: click.Context,
+    config_file: str,
+    inputs: tuple[str, ...],
+    start_date,
+    end_date,
+    max_in_flight: int,
+) -> None:
+    """Run the workflow of CONFIG_FILE on many INPUTS with one Dask cluster.
+
+    INPUTS are HRES files or directories of HRES files; the input file
+    of CONFIG_FILE is ignored.
+    """
+    # rest of imports here so --help doesn't take forever
+    from opera_tropo.batch import select_inputs
+    from opera_tropo.config.pge_runconfig import RunConfig
+    from opera_tropo.main import run_batch
+
+    file_paths = select_inputs(inputs, start_date=start_date, end_date=end_date)
+    if not file_paths:
+        raise click.UsageError("No input files found for the given dates.")
+
+    pge_runconfig = RunConfig.from_yaml(config_file)
+    cfg = pge_runconfig.to_workflow()
+    reports = run_batch(
+        cfg, file_paths, max_in_flight=max_in_flight, debug=ctx.obj["debug"]
+    )
+    for report in reports:
+        if report["status"] == "failed":
+            click.echo(f"{report['input']}: failed, {report['error']}")
+            continue
+        click.echo(
+            f"{report['input']}: {report['seconds']:.1f} s,"
+            f" {report['columns_per_second']:.0f} columns/s"
+        )
+    if any(report["status"] == "failed" for report in reports):
+        ctx.exit(1)
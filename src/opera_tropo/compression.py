@@ -0,0 +1,455 @@
+from __future__ import annotations
+
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
+
+import numpy as np
+import xarray as xr
+from dask.utils import format_bytes
+
+from opera_tropo._writer import _encode_chunk, _get_zarr_compressor, write_netcdf
+from opera_tropo.utils import cast_round_mantissa
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "BENCH_CHUNK_SHAPES",
+    "COMPRESSION_PROFILES",
+    "bench_encoding",
+    "compare_compression",
+    "get_compression_options",
+]
+
+# NetCDF encodings of the named compression profiles. All are lossless, the
+# delays are already rounded to `keep_bits` mantissa bits before encoding.
+# Zstd and Blosc are HDF5 filter plugins (IDs 32015 and 32001), shipped with
+# netcdf-c and readable with h5py through the same plugins or `hdf5plugin`.
+COMPRESSION_PROFILES: dict[str, dict[str, Any]] = {
+    "zlib": {"zlib": True, "complevel": 4, "shuffle": True},
+    "zstd": {"compression": "zstd", "complevel": 3},
+    # Blosc bit shuffle groups the zeroed mantissa bits of the rounded floats
+    "blosc-lz4": {"compression": "blosc_lz4", "complevel": 5, "blosc_shuffle": 2},
+    "blosc-zstd": {"compression": "blosc_zstd", "complevel": 5, "blosc_shuffle": 2},
+}
+# Default chunk shapes (time, height, latitude, longitude) of `bench_encoding`:
+# the runconfig and `tropo` defaults, and full columns
+BENCH_CHUNK_SHAPES = [(1, 64, 64, 64), (1, 8, 512, 512), (1, 145, 32, 32)]
+ACCESS_PATTERNS = ("map", "column", "cube")
+# Highest height of the DEM-window reads, above the highest topography
+DEM_MAX_HEIGHT = 9000.0
+# netCDF4 library support flags of the plugin filters
+_PLUGIN_SUPPORT = {
+    "zstd": "__has_zstandard_support__",
+    "blosc_lz4": "__has_blosc_support__",
+    "blosc_zstd": "__has_blosc_support__",
+}
+
+
+def _check_plugin(compression: Optional[str]) -> None:
+    """Check that the netCDF4 library can write a plugin filter."""
+    flag = _PLUGIN_SUPPORT.get(compression or "")
+    if flag is None:
+        return
+    import netCDF4
+
+    if not getattr(netCDF4, flag, False):
+        raise ValueError(
+            f"{compression} compression is not supported by the netCDF4 library,"
+            " check that its HDF5 filter plugins are installed (HDF5_PLUGIN_PATH)."
+        )
+
+
+def get_compression_options(
+    options: Optional[str | dict] = None, check_plugin: bool = True
+) -> dict:
+    """Resolve compression options or a named profile to a NetCDF encoding.
+
+    Parameters
+    ----------
+    options : str or dict, optional
+        Name of a profile of `COMPRESSION_PROFILES`, or a dict of NetCDF
+        encoding options. A "profile" key in the dict selects the profile
+        the other options override, e.g. {"profile": "zstd", "complevel": 5}.
+        Options without a "profile" or "compression" key update the
+        "zlib" profile. Default is None (the "zlib" profile).
+    check_plugin : bool, optional
+        Check that the netCDF4 library can write the filter. Disable for
+        Zarr outputs, which are encoded with numcodecs. Default is True.
+
+    Returns
+    -------
+    dict
+        Per-variable NetCDF encoding options, as for `xr.Dataset.to_netcdf`.
+
+    Raises
+    ------
+    ValueError
+        If the profile is unknown, or its filter is not available.
+
+    """
+    if options is None:
+        options = {}
+    elif isinstance(options, str):
+        options = {"profile": options}
+    options = dict(options)
+
+    profile = options.pop("profile", None)
+    if profile is None and "compression" not in options:
+        profile = "zlib"
+    if profile is not None:
+        if profile not in COMPRESSION_PROFILES:
+            raise ValueError(
+                f"Unknown compression profile: {profile}."
+                f" Choose from {list(COMPRESSION_PROFILES)}."
+            )
+        options = {**COMPRESSION_PROFILES[profile], **options}
+
+    if check_plugin:
+        _check_plugin(options.get("compression"))
+    return options
+
+
+def _get_supported_profiles() -> list[str]:
+    """Get the names of the profiles supported by the netCDF4 library."""
+    profiles = []
+    for name, options in COMPRESSION_PROFILES.items():
+        try:
+            _check_plugin(options.get("compression"))
+        except ValueError:
+            logger.warning(f"Skipping unsupported profile {name}")
+            continue
+        profiles.append(name)
+    return profiles
+
+
+def _get_chunk_encoder(options: dict) -> Callable[[np.ndarray], bytes]:
+    """Get a function encoding a chunk as stored by the filters of `options`.
+
+    Zlib chunks are shuffled and deflated as by `write_netcdf`, the plugin
+    filters are applied with their numcodecs equivalents.
+    """
+    compression = options.get("compression")
+    if compression is None and not options.get("zlib", False):
+        return np.ndarray.tobytes
+    if compression in (None, "zlib"):
+        shuffle = options.get("shuffle", True)
+        complevel = options.get("complevel", 4)
+        return lambda chunk: _encode_chunk(
+            chunk, chunk.shape, chunk.dtype, np.nan, shuffle, complevel
+        )
+    return _get_zarr_compressor(options, zarr_format=2).encode
+
+
+def _get_encode_time(
+    ds: xr.Dataset, data_vars: list[str], chunks: dict[str, tuple], options: dict
+) -> float:
+    """Get the CPU time in seconds to encode the chunks of the data variables.
+
+    The chunks are encoded one at a time by this process, the same way for
+    all compression options, see `_get_chunk_encoder`.
+    """
+    encode = _get_chunk_encoder(options)
+    cpu_time = 0.0
+    for name in data_vars:
+        values = ds[name].values
+        shape = chunks[name]
+        grid = [-(-size // chunk) for size, chunk in zip(values.shape, shape)]
+        for index in np.ndindex(*grid):
+            selection = tuple(slice(i * c, (i + 1) * c) for i, c in zip(index, shape))
+            chunk = np.ascontiguousarray(values[selection])
+            t_start = time.process_time()
+            encode(chunk)
+            cpu_time += time.process_time() - t_start
+    return cpu_time
+
+
+def compare_compression(
+    product_file: str | Path,
+    profiles: Optional[Sequence[str]] = None,
+    work_dir: Optional[str | Path] = None,
+) -> list[dict]:
+    """Compare the compression profiles on an existing product.
+
+    The data variables are rewritten with each profile, with the chunks
+    of the product, and read back. The compression cost is the CPU time to
+    encode every chunk with the profile in this process, measured the same
+    way for all profiles. The write time is that of the product writer,
+    `opera_tropo._writer.write_netcdf`, which compresses zlib chunks in
+    parallel and leaves the plugin filters to HDF5, one chunk at a time.
+
+    Parameters
+    ----------
+    product_file : str | Path
+        Path to a TROPO product NetCDF file.
+    profiles : Sequence[str], optional
+        Names of the compared profiles. Default is all of
+        `COMPRESSION_PROFILES` supported by the netCDF4 library.
+    work_dir : str | Path, optional
+        Directory of the temporary product copies. Default is the
+        system temporary directory.
+
+    Returns
+    -------
+    list[dict]
+        Per-profile report with the file size in bytes, the compression
+        ratio of the data variables, the encoding throughput per CPU
+        second, and the write and decoding (read) throughput, all in MB/s
+        of uncompressed data.
+
+    """
+    if profiles is None:
+        profiles = _get_supported_profiles()
+
+    with xr.open_dataset(product_file) as ds:
+        # In memory, to only time the writes, as Dask arrays with the product
+        # chunks for `write_netcdf` to compress them as in the workflow
+        ds = ds.load()
+    data_vars = [name for name in ds.data_vars if ds[name].ndim > 0]
+    nbytes = sum(ds[name].nbytes for name in data_vars)
+    chunks = {
+        name: tuple(ds[name].encoding.get("chunksizes") or ds[name].shape)
+        for name in data_vars
+    }
+    for name in data_vars:
+        ds[name] = ds[name].chunk(dict(zip(ds[name].dims, chunks[name])))
+
+    reports = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        for profile in profiles:
+            options = get_compression_options(profile)
+            encoding = {
+                name: {**options, "chunksizes": chunks[name]} for name in data_vars
+            }
+            out_file = Path(tmp_dir) / f"{profile}.nc"
+            encode_time = _get_encode_time(ds, data_vars, chunks, options)
+
+            t_start = time.perf_counter()
+            write_netcdf(ds, out_file, encoding=encoding)
+            write_time = time.perf_counter() - t_start
+
+            t_start = time.perf_counter()
+            with xr.open_dataset(out_file) as out_ds:
+                out_ds[data_vars].load()
+            read_time = time.perf_counter() - t_start
+
+            size = out_file.stat().st_size
+            reports.append(
+                {
+                    "profile": profile,
+                    "size": size,
+                    "ratio": nbytes / size,
+                    "encode_mb_s": nbytes / encode_time / 1e6,
+                    "write_mb_s": nbytes / write_time / 1e6,
+                    "decode_mb_s": nbytes / read_time / 1e6,
+                }
+            )
+            logger.info(
+                f"{profile:>10}: {format_bytes(size):>10}"
+                f" (ratio {reports[-1]['ratio']:.2f}),"
+                f" encode {reports[-1]['encode_mb_s']:.1f} MB/s,"
+                f" write {reports[-1]['write_mb_s']:.1f} MB/s,"
+                f" decode {reports[-1]['decode_mb_s']:.1f} MB/s"
+            )
+    return reports
+
+
+def _get_read_selections(
+    sizes: dict[str, int],
+    heights: np.ndarray,
+    n_reads: int,
+    window: int,
+    dem_max_height: float,
+    seed: int,
+) -> dict[str, list[dict]]:
+    """Get random index selections of the benchmarked access patterns."""
+    rng = np.random.default_rng(seed)
+    n_lat, n_lon = sizes["latitude"], sizes["longitude"]
+    lat_window, lon_window = min(window, n_lat), min(window, n_lon)
+    dem_heights = np.flatnonzero(heights <= dem_max_height)
+    if dem_heights.size:
+        dem_heights = slice(dem_heights.min(), dem_heights.max() + 1)
+    else:
+        dem_heights = slice(None)
+
+    selections: dict[str, list[dict]] = {pattern: [] for pattern in ACCESS_PATTERNS}
+    for _ in range(n_reads):
+        time_index = rng.integers(sizes["time"])
+        selections["map"].append(
+            {"time": time_index, "height": rng.integers(sizes["height"])}
+        )
+        selections["column"].append(
+            {
+                "time": time_index,
+                "latitude": rng.integers(n_lat),
+                "longitude": rng.integers(n_lon),
+            }
+        )
+        lat = rng.integers(n_lat - lat_window + 1)
+        lon = rng.integers(n_lon - lon_window + 1)
+        selections["cube"].append(
+            {
+                "time": time_index,
+                "height": dem_heights,
+                "latitude": slice(lat, lat + lat_window),
+                "longitude": slice(lon, lon + lon_window),
+            }
+        )
+    return selections
+
+
+def _get_read_latency(
+    file: Path, data_vars: list[str], selections: list[dict]
+) -> float:
+    """Get the median time in seconds to open a file and read selections."""
+    times = []
+    for selection in selections:
+        t_start = time.perf_counter()
+        with xr.open_dataset(file) as ds:
+            ds[data_vars].isel(selection).load()
+        times.append(time.perf_counter() - t_start)
+    return float(np.median(times))
+
+
+def bench_encoding(
+    product_file: str | Path,
+    chunk_shapes: Optional[Sequence[Sequence[int]]] = None,
+    profiles: Optional[Sequence[str | dict]] = None,
+    keep_bits: Sequence[Optional[int]] = (None,),
+    n_reads: int = 5,
+    window: int = 64,
+    dem_max_height: float = DEM_MAX_HEIGHT,
+    sort_by: str = "size",
+    work_dir: Optional[str | Path] = None,
+    seed: int = 0,
+) -> list[dict]:
+    """Benchmark chunk shapes, compression profiles and keep_bits on a product.
+
+    The product is rewritten for each combination, as done by `tropo`,
+    and read back with the typical access patterns: a single-height map
+    ("map"), a single column ("column"), and a `window` x `window` cube of
+    the heights up to `dem_max_height` ("cube"), as read to correct an
+    interferogram over a DEM. Each read opens the file, the reported read
+    latencies are medians over `n_reads` random positions. Files just
+    written are read from the page cache, so read latencies mostly measure
+    decoding.
+
+    The write time is that of the product writer, which compresses zlib
+    chunks in parallel with Dask and leaves the plugin filters to HDF5,
+    one chunk at a time. The codecs are compared by their encoding time,
+    the CPU time to encode every chunk in this process, measured the same
+    way for all profiles.
+
+    Parameters
+    ----------
+    product_file : str | Path
+        Path to a TROPO product NetCDF file.
+    chunk_shapes : Sequence[Sequence[int]], optional
+        Chunk shapes (time, height, latitude, longitude), clipped to the
+        product shape. Default is `BENCH_CHUNK_SHAPES`.
+    profiles : Sequence[str | dict], optional
+        Compression profiles or options, as for `get_compression_options`.
+        Default is all profiles supported by the netCDF4 library.
+    keep_bits : Sequence[int or None], optional
+        Mantissa bits kept in all data variables before encoding. None
+        keeps the data as stored. Default is (None,).
+    n_reads : int, optional
+        Number of reads per access pattern. Default is 5.
+    window : int, optional
+        Latitude and longitude size of the cube reads. Default is 64.
+    dem_max_height : float, optional
+        Highest height in meters of the cube reads. Default is 9000.
+    sort_by : str, optional
+        Report key ranking the results, in increasing order: "size",
+        "encode_s", "write_s", "map_ms", "column_ms" or "cube_ms".
+        Default is "size".
+    work_dir : str | Path, optional
+        Directory of the temporary product copies. Default is the
+        system temporary directory.
+    seed : int, optional
+        Seed of the read positions, the same for all combinations.
+        Default is 0.
+
+    Returns
+    -------
+    list[dict]
+        Per-combination report, ranked by `sort_by`: chunk shape, profile,
+        keep_bits, maximum absolute error of the rounding, file size in
+        bytes, encoding CPU time and write time in seconds, and read
+        latencies in milliseconds.
+
+    """
+    sort_keys = (
+        "size",
+        "encode_s",
+        "write_s",
+        *(f"{p}_ms" for p in ACCESS_PATTERNS),
+    )
+    if sort_by not in sort_keys:
+        raise ValueError(f"Unknown sort key: {sort_by}. Choose from {sort_keys}.")
+    if chunk_shapes is None:
+        chunk_shapes = BENCH_CHUNK_SHAPES
+    if profiles is None:
+        profiles = _get_supported_profiles()
+
+    with xr.open_dataset(product_file) as ds:
+        ds = ds.load()
+    data_vars = [name for name in ds.data_vars if ds[name].ndim == 4]
+    dims = ds[data_vars[0]].dims
+    selections = _get_read_selections(
+        ds.sizes, ds.height.values, n_reads, window, dem_max_height, seed
+    )
+
+    reports = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        for bits in keep_bits:
+            rounded = ds.copy()
+            max_error = 0.0
+            for name in data_vars if bits is not None else []:
+                values = ds[name].values
+                rounded_values = cast_round_mantissa(values, values.dtype, bits)
+                rounded[name] = ds[name].copy(data=rounded_values)
+                error = np.nanmax(np.abs(rounded_values - values))
+                max_error = max(max_error, float(error))
+
+            for shape in chunk_shapes:
+                chunks = tuple(min(c, ds.sizes[d]) for c, d in zip(shape, dims))
+                chunked = rounded.chunk(dict(zip(dims, chunks)))
+                for profile in profiles:
+                    options = get_compression_options(profile)
+                    encoding = {
+                        name: {**options, "chunksizes": chunks} for name in data_vars
+                    }
+                    out_file = Path(tmp_dir) / "bench.nc"
+                    encode_time = _get_encode_time(
+                        rounded, data_vars, dict.fromkeys(data_vars, chunks), options
+                    )
+
+                    t_start = time.perf_counter()
+                    write_netcdf(chunked, out_file, encoding=encoding)
+                    report = {
+                        "chunks": chunks,
+                        "profile": profile if isinstance(profile, str) else options,
+                        "keep_bits": bits,
+                        "max_error": max_error,
+                        "encode_s": encode_time,
+                        "write_s": time.perf_counter() - t_start,
+                        "size": out_file.stat().st_size,
+                    }
+                    for pattern, pattern_selections in selections.items():
+                        latency = _get_read_latency(
+                            out_file, data_vars, pattern_selections
+                        )
+                        report[f"{pattern}_ms"] = 1e3 * latency
+                    logger.info(
+                        f"chunks {chunks}, {report['profile']}, keep_bits {bits}:"
+                        f" {format_bytes(report['size'])},"
+                        f" encode {report['encode_s']:.2f} s,"
+                        f" write {report['write_s']:.2f} s"
+                    )
+                    reports.append(report)
+                    out_file.unlink()
+
+    return sorted(reports, key=lambda report: report[sort_by])
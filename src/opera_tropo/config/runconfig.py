@@ -3,14 +3,16 @@ from __future__ import annotations
 import logging
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import (
     BaseModel,
     Field,
+    PositiveInt,
     PrivateAttr,
 )
 
+from opera_tropo.bitinfo import HEIGHT_BANDS
 from opera_tropo.log.loggin_setup import remove_raider_logs
 
 from ._yaml import YamlModel
@@ -34,6 +36,8 @@ __all__ = [
 
 PRODUCT_VERSION = "1.0"
 DEFAULT_ENCODING_OPTIONS = {"zlib": True, "complevel": 5, "shuffle": True}
+Scheduler = Literal["auto", "distributed", "threads", "processes", "synchronous"]
+Auto = Literal["auto"]
 
 
 # Base model
@@ -52,6 +56,26 @@ class InputOptions(BaseModel, extra="forbid"):
         description="Format of dates contained in s3 HRES folder",
     )
 
+    bbox: Optional[tuple[float, float, float, float]] = Field(
+        None,
+        description=(
+            "Bounding box (west, south, east, north) in degrees to process."
+            " Longitudes in [-180, 180] or [0, 360]; use west > east to cross"
+            " the antimeridian. If None, process the global grid."
+        ),
+    )
+
+    check_sample_fraction: Optional[float] = Field(
+        None,
+        gt=0,
+        le=1,
+        description=(
+            "Fraction of the input HDF5 chunks read by a quick input check."
+            " The whole input is only checked and clipped if the sample shows"
+            " NaNs or out-of-range values. If None, check the whole input."
+        ),
+    )
+
 
 class OutputOptions(BaseModel, extra="forbid"):
     """Options specifying input datasets for workflow."""
@@ -73,6 +97,11 @@ class OutputOptions(BaseModel, extra="forbid"):
         description="Clip heights above specified maximum height.",
     )
 
+    min_height: Optional[int] = Field(
+        None,
+        description="Clip heights below specified minimum height.",
+    )
+
     output_heights: Optional[List[float]] = Field(
         default=list(reversed(LEVELS_137_HEIGHTS)),
         description=(
@@ -86,9 +115,29 @@ class OutputOptions(BaseModel, extra="forbid"):
         description="Ouput chunks (time, height, lat, lon).",
     )
 
-    compression_kwargs: Optional[Dict[str, Any]] = Field(
+    compression_kwargs: Optional[Dict[str, Any] | str] = Field(
         default_factory=lambda: DEFAULT_ENCODING_OPTIONS,
-        description="Product output compression options for netcdf",
+        description=(
+            "Product output compression options for netcdf, or a compression"
+            " profile: zlib, zstd, blosc-lz4 or blosc-zstd. A 'profile' key"
+            " selects the profile the other options override."
+        ),
+    )
+
+    keep_bits_max_error: Optional[float] = Field(
+        None,
+        gt=0,
+        description=(
+            "Largest rounding error of the delays in meters. If set, the mantissa"
+            " bits kept per height band are chosen from the bitwise real"
+            " information of a sample of the delays and recorded in the variable"
+            " attributes, instead of the fixed bits of each variable."
+        ),
+    )
+
+    keep_bits_height_edges: List[float] = Field(
+        default_factory=lambda: list(HEIGHT_BANDS),
+        description="Edges in meters between the height bands of keep_bits.",
     )
 
     product_version: str = Field(
@@ -96,6 +145,19 @@ class OutputOptions(BaseModel, extra="forbid"):
         description="OPERA TROPO product version",
     )
 
+    output_format: Literal["netcdf", "zarr"] = Field(
+        "netcdf",
+        description=(
+            "Product format: NetCDF4 file, or Zarr store with consolidated"
+            " metadata and the same chunks and compression level."
+        ),
+    )
+
+    zarr_format: Literal[2, 3] = Field(
+        2,
+        description="Zarr format version of Zarr products.",
+    )
+
     def get_output_filename(self, date: str | datetime, hour: str | int):
         """Get product output filename convention."""
         # Ensure date is a string in the expected format
@@ -113,33 +175,71 @@ class OutputOptions(BaseModel, extra="forbid"):
         proc_datetime = self.creation_time.strftime(self.date_fmt)
 
         datetime_str = f"{date_time_str}Z_{proc_datetime}Z"
-        return f"OPERA_L4_TROPO-ZENITH_{datetime_str}_HRES_v{self.product_version}.nc"
+        suffix = ".zarr" if self.output_format == "zarr" else ".nc"
+        return (
+            f"OPERA_L4_TROPO-ZENITH_{datetime_str}_HRES_v{self.product_version}{suffix}"
+        )
 
 
 class WorkerSettings(BaseModel, extra="forbid"):
     """Settings for controlling CPU settings and parallelism."""
 
-    n_workers: int = Field(
+    n_workers: PositiveInt | Auto = Field(
         4,
-        ge=1,
-        description="Number of workers to use in dask.Client.",
+        description=(
+            "Number of workers to use in dask.Client. 'auto' uses the"
+            " container CPU limit."
+        ),
     )
-    threads_per_worker: int = Field(
+    threads_per_worker: PositiveInt | Auto = Field(
         2,
-        ge=1,
-        description="Number of threads to use per worker in dask.Client.",
+        description="Number of threads to use per worker in dask.Client, or 'auto'.",
     )
     max_memory: int | str = Field(
         default="6GB",
-        description="Workers are given a target memory limit in dask.Client.",
+        description=(
+            "Workers are given a target memory limit in dask.Client. 'auto'"
+            " splits the container memory limit between the workers."
+        ),
     )
     dask_temp_dir: str | Path = Field(
         default="tmp",
         description=("Dask local spill directory within work directory."),
     )
-    block_shape: tuple[int, int] = Field(
+    block_shape: tuple[int, int] | Auto = Field(
         (128, 128),
-        description="Size (rows, columns) of blocks of data to load at a time.",
+        description=(
+            "Size (rows, columns) of blocks of data to load at a time. 'auto'"
+            " sizes blocks from the estimated memory per block."
+        ),
+    )
+    column_batch: Optional[int] = Field(
+        None,
+        ge=1,
+        description=(
+            "Maximum number of grid columns per processing block. If set,"
+            " overrides `block_shape` with blocks of whole longitude rows."
+        ),
+    )
+    engine: Literal["raider", "native"] = Field(
+        "raider",
+        description=(
+            "ZTD engine: RAiDER HRES model or the in-package vectorized engine."
+        ),
+    )
+    checkpoint: bool = Field(
+        False,
+        description=(
+            "Save finished output blocks under `dask_temp_dir`, so that a rerun"
+            " with the same input and options only computes the missing blocks."
+        ),
+    )
+    scheduler: Scheduler = Field(
+        "auto",
+        description=(
+            "Dask scheduler. 'auto' runs small inputs on local threads and"
+            " starts a distributed cluster for large ones."
+        ),
     )
 
 
@@ -1,17 +1,94 @@
 import logging
-from typing import Optional
+import time
+from typing import Optional, Sequence
 
 import numpy as np
 import xarray as xr
 from RAiDER.models import HRES
 
-from opera_tropo._pack import pack_ztd
+from opera_tropo._interp import get_height_weights, interpolate_heights
+from opera_tropo._pack import pack_delays, pack_ztd
+from opera_tropo._ztd import compute_ztd, get_zero_mask
+from opera_tropo.bitinfo import HEIGHT_BANDS, MAX_ERROR, BandKeepBits, plan_keep_bits
+from opera_tropo.checks import clip_valid_data, clip_valid_range
 from opera_tropo.log.loggin_setup import log_runtime, remove_raider_logs
+from opera_tropo.product_info import TROPO_PRODUCTS
+from opera_tropo.utils import get_height_mask
 
 logger = logging.getLogger(__name__)
 remove_raider_logs()
 
 
+ENGINES = ("raider", "native")
+# Latitude rows of the input sampled to choose the keep_bits
+KEEP_BITS_SAMPLE_ROWS = 16
+
+
+def _ztd_raider(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    z: np.ndarray,
+    lnsp: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute ZTD (lat, lon, height) by driving a RAiDER HRES model."""
+    # Initialize HRES model
+    hres_model = HRES()
+
+    # Assign temperature and specific humidity
+    hres_model._t = temperature
+    hres_model._q = humidity
+
+    # Compute pressure and geopotential height from geopotential and log pressure
+    hres_model._p, hgt = hres_model._calculategeoh(z, lnsp)[1:]
+
+    # Create latitude and longitude grid
+    hres_model._lons, hres_model._lats = np.meshgrid(lon, lat)
+
+    # Compute altitudes
+    hres_model._get_heights(hres_model._lats, hgt.transpose(1, 2, 0))
+    del hgt  # Free memory
+
+    # Reorder dimensions from (height, lat, lon) to (lon, lat, height)
+    hres_model._p = np.flip(hres_model._p.transpose(1, 2, 0), axis=2)
+    hres_model._t = np.flip(hres_model._t.transpose(1, 2, 0), axis=2)
+    hres_model._q = np.flip(hres_model._q.transpose(1, 2, 0), axis=2)
+    hres_model._zs = np.flip(hres_model._zs, axis=2)
+
+    # Perform RAiDER computations
+    hres_model._find_e()  # Compute partial pressure of water vapor
+    hres_model._uniform_in_z(_zlevels=None)  # Interpolate to common heights
+    hres_model._checkForNans()  # Handle NaNs at boundaries
+    hres_model._get_wet_refractivity()
+    hres_model._get_hydro_refractivity()
+    hres_model._adjust_grid(hres_model.get_latlon_bounds())
+
+    # Compute Zenith Total Delay (ZTD)
+    hres_model._getZTD()
+
+    return hres_model._wet_ztd, hres_model._hydrostatic_ztd, hres_model._zs
+
+
+def _ztd_native(
+    lat: np.ndarray,
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    z: np.ndarray,
+    lnsp: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute ZTD (lat, lon, height) with the in-package vectorized engine."""
+    wet_ztd, hydrostatic_ztd, zs = compute_ztd(
+        lat=lat,
+        temperature=temperature,
+        humidity=humidity,
+        z=z,
+        lnsp=lnsp,
+    )
+    # Reorder dimensions from (height, lat, lon) to (lat, lon, height)
+    return wet_ztd.transpose(1, 2, 0), hydrostatic_ztd.transpose(1, 2, 0), zs
+
+
 def get_ztd(
     lat: np.ndarray,
     lon: np.ndarray,
@@ -19,6 +96,7 @@ def get_ztd(
     humidity: np.ndarray,
     z: np.ndarray,
     lnsp: np.ndarray,
+    engine: str = "raider",
 ) -> xr.Dataset:
     """Compute Zenith Total Delay (ZTD) using the HRES weather model.
 
@@ -40,6 +118,10 @@ def get_ztd(
     lnsp : np.ndarray
         2D array of the natural logarithm of surface pressure (Pa) with
         dimensions (latitude, longitude).
+    engine : str, optional
+        ZTD engine, either "raider" to use the RAiDER HRES model or
+        "native" for the in-package vectorized implementation.
+        Default is "raider".
 
     Returns
     -------
@@ -52,57 +134,60 @@ def get_ztd(
     Notes
     -----
     - Uses the HRES weather model for atmospheric profiling.
-    - Applies RAiDER processing for delay computations.
+    - Both engines follow the RAiDER processing for delay computations.
 
     """
-    # Initialize HRES model
-    hres_model = HRES()
-
-    # Assign temperature and specific humidity
-    hres_model._t = temperature
-    hres_model._q = humidity
-
-    # Compute pressure and geopotential height from geopotential and log pressure
-    hres_model._p, hgt = hres_model._calculategeoh(z, lnsp)[1:]
-
-    # Create latitude and longitude grid
-    hres_model._lons, hres_model._lats = np.meshgrid(lon, lat)
+    wet_ztd, hydrostatic_ztd, zs = _get_ztd_arrays(
+        lat, lon, temperature, humidity, z, lnsp, engine
+    )
 
-    # Compute altitudes
-    hres_model._get_heights(hres_model._lats, hgt.transpose(1, 2, 0))
-    del hgt  # Free memory
+    # Construct output dataset
+    dims = ["latitude", "longitude", "height"]
+    out_ds = xr.Dataset(
+        data_vars={
+            "wet_ztd": (dims, wet_ztd),
+            "hydrostatic_ztd": (dims, hydrostatic_ztd),
+        },
+        coords={
+            "height": ("height", zs),
+            "latitude": ("latitude", lat),
+            "longitude": ("longitude", lon),
+        },
+    )
 
-    # Reorder dimensions from (height, lat, lon) to (lon, lat, height)
-    hres_model._p = np.flip(hres_model._p.transpose(1, 2, 0), axis=2)
-    hres_model._t = np.flip(hres_model._t.transpose(1, 2, 0), axis=2)
-    hres_model._q = np.flip(hres_model._q.transpose(1, 2, 0), axis=2)
-    hres_model._zs = np.flip(hres_model._zs, axis=2)
+    return out_ds
 
-    # Perform RAiDER computations
-    hres_model._find_e()  # Compute partial pressure of water vapor
-    hres_model._uniform_in_z(_zlevels=None)  # Interpolate to common heights
-    hres_model._checkForNans()  # Handle NaNs at boundaries
-    hres_model._get_wet_refractivity()
-    hres_model._get_hydro_refractivity()
-    hres_model._adjust_grid(hres_model.get_latlon_bounds())
 
-    # Compute Zenith Total Delay (ZTD)
-    hres_model._getZTD()
+def _get_ztd_arrays(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    z: np.ndarray,
+    lnsp: np.ndarray,
+    engine: str = "raider",
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the (lat, lon, height) ZTD arrays of `get_ztd`."""
+    if engine == "raider":
+        wet_ztd, hydrostatic_ztd, zs = _ztd_raider(
+            lat, lon, temperature, humidity, z, lnsp
+        )
+    elif engine == "native":
+        wet_ztd, hydrostatic_ztd, zs = _ztd_native(lat, temperature, humidity, z, lnsp)
+    else:
+        raise ValueError(f"Unknown ZTD engine: {engine}. Choose from {ENGINES}.")
 
     # Mask zero values at specific height levels (often caused by remaining NaNs)
-    # Skip heights above 45km altitude where zeros might occur, especially at the top
-    zero_mask = (hres_model._hydrostatic_ztd[:, :, :-15] == 0) | (
-        hres_model._wet_ztd[:, :, :-15] == 0
-    )
+    zero_mask = get_zero_mask(wet_ztd, hydrostatic_ztd)
 
     if np.any(zero_mask):
         zero_count = np.sum(zero_mask)
         zero_indices = np.where(zero_mask)
 
         # Get coordinate values
-        zero_lats = hres_model._lats[zero_indices[0], 0]
-        zero_lons = hres_model._lons[0, zero_indices[1]]
-        zero_heights = hres_model._zs[zero_indices[2]]
+        zero_lats = lat[zero_indices[0]]
+        zero_lons = lon[zero_indices[1]]
+        zero_heights = zs[zero_indices[2]]
 
         logger.warning(
             f"Found {zero_count} zero values between [min, max]:"
@@ -111,28 +196,72 @@ def get_ztd(
             f"heights=[{zero_heights.min():.0f}, {zero_heights.max():.0f}]m"
         )
 
-        hres_model._hydrostatic_ztd[:, :, :-15] = np.where(
-            zero_mask, np.nan, hres_model._hydrostatic_ztd[:, :, :-15]
-        )
-        hres_model._wet_ztd[:, :, :-15] = np.where(
-            zero_mask, np.nan, hres_model._wet_ztd[:, :, :-15]
-        )
+        hydrostatic_ztd[zero_mask] = np.nan
+        wet_ztd[zero_mask] = np.nan
 
-    # Construct output dataset
-    dims = ["latitude", "longitude", "height"]
-    out_ds = xr.Dataset(
-        data_vars={
-            "wet_ztd": (dims, hres_model._wet_ztd),
-            "hydrostatic_ztd": (dims, hres_model._hydrostatic_ztd),
-        },
-        coords={
-            "height": ("height", hres_model._zs),
-            "latitude": ("latitude", hres_model._lats[:, 0]),
-            "longitude": ("longitude", hres_model._lons[0, :]),
-        },
-    )
+    return wet_ztd, hydrostatic_ztd, zs
 
-    return out_ds
+
+def _compute_delays(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    z: np.ndarray,
+    lnsp: np.ndarray,
+    out_heights: Optional[list] = None,
+    engine: str = "raider",
+    interp_weights: Optional[np.ndarray] = None,
+    max_height: Optional[float] = None,
+    min_height: Optional[float] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the (time, lat, lon, height) delays of input arrays.
+
+    The input variables have dimensions (time, level, latitude, longitude),
+    except `z` and `lnsp` which have dimensions (time, latitude, longitude).
+    """
+    # Compute each model time with the same column kernel
+    wet_steps, hydrostatic_steps = [], []
+    for itime in range(temperature.shape[0]):
+        wet_ztd, hydrostatic_ztd, zs = _get_ztd_arrays(
+            lat=lat,
+            lon=lon,
+            temperature=temperature[itime],
+            humidity=humidity[itime],
+            z=z[itime],
+            lnsp=lnsp[itime],
+            engine=engine,
+        )
+        wet_steps.append(wet_ztd)
+        hydrostatic_steps.append(hydrostatic_ztd)
+
+    # Stack to (time, latitude, longitude, height), no copy for a single time
+    if len(wet_steps) == 1:
+        wet_ztd = wet_steps[0][np.newaxis]
+        hydrostatic_ztd = hydrostatic_steps[0][np.newaxis]
+    else:
+        wet_ztd = np.stack(wet_steps)
+        hydrostatic_ztd = np.stack(hydrostatic_steps)
+    del wet_steps, hydrostatic_steps
+
+    # Interpolate to specified output heights if provided,
+    # skipping the heights outside of the output range
+    if out_heights is not None:
+        out_heights = np.asarray(out_heights)
+        if interp_weights is None:
+            interp_weights = get_height_weights(zs, out_heights)
+        elif interp_weights.shape != (out_heights.size, zs.size):
+            raise ValueError(
+                f"interp_weights with shape {interp_weights.shape} do not map the"
+                f" {zs.size} {engine} model heights to {out_heights.size} heights."
+            )
+        height_mask = get_height_mask(out_heights, min_height, max_height)
+        interp_weights = interp_weights[height_mask]
+        wet_ztd = interpolate_heights(wet_ztd, interp_weights)
+        hydrostatic_ztd = interpolate_heights(hydrostatic_ztd, interp_weights)
+        zs = out_heights[height_mask]
+
+    return wet_ztd, hydrostatic_ztd, zs
 
 
 @log_runtime
@@ -140,7 +269,12 @@ def calculate_ztd(
     ds: xr.Dataset,
     out_heights: Optional[list] = None,
     chunk_size: Optional[list] = None,
-    keep_bits: bool = True,
+    keep_bits: bool | BandKeepBits = True,
+    engine: str = "raider",
+    interp_weights: Optional[np.ndarray] = None,
+    max_height: Optional[float] = None,
+    min_height: Optional[float] = None,
+    clip_input: bool = False,
 ) -> xr.Dataset:
     """Compute the Zenith Total Delay (ZTD) from an input weather model dataset.
 
@@ -158,7 +292,7 @@ def calculate_ztd(
           (time, level, latitude, longitude).
         - 'lnsp': 3D array of log surface pressure (Pa) with dimensions
           (time, latitude, longitude).
-        - 'time': 1D array of timestamps.
+        - 'time': 1D array of timestamps. Every time step is processed.
 
     out_heights : Optional[list], default=None
         List of desired output height levels for interpolation (meters).
@@ -166,8 +300,28 @@ def calculate_ztd(
     chunk_size : Optional[list], default=None
         List specifying the chunk size for output dataset processing.
 
-    keep_bits : bool, default=True
-        Do mantissa rounding with bit range defind in product_info.
+    keep_bits : bool | BandKeepBits, default=True
+        Do mantissa rounding with bit range defind in product_info,
+        or per height band, see `opera_tropo.bitinfo.plan_keep_bits`.
+
+    engine : str, default="raider"
+        ZTD engine, "raider" or "native". See `get_ztd`.
+
+    interp_weights : Optional[np.ndarray], default=None
+        Precomputed weights from `get_height_weights` mapping the model
+        heights to `out_heights`. Built on the fly if not provided.
+
+    max_height : Optional[float], default=None
+        Maximum output height (meters). Higher levels are neither
+        interpolated nor packed.
+
+    min_height : Optional[float], default=None
+        Minimum output height (meters). Lower levels are neither
+        interpolated nor packed.
+
+    clip_input : bool, default=False
+        Clip the input variables to their valid range before processing,
+        see `opera_tropo.checks.clip_valid_range`.
 
     Returns
     -------
@@ -178,30 +332,207 @@ def calculate_ztd(
         - Coordinates: 'latitude', 'longitude', 'height'.
 
     """
-    ztd_ds = get_ztd(
+    if clip_input:
+        ds = clip_valid_range(ds)
+
+    wet_ztd, hydrostatic_ztd, zs = _compute_delays(
         lat=ds.latitude.values,
         lon=ds.longitude.values,
-        temperature=ds.t.isel(time=0).values,
-        humidity=ds.q.isel(time=0).values,
-        z=ds.z.isel(time=0, level=0).values,
-        lnsp=ds.lnsp.isel(time=0, level=0).values,
+        temperature=ds.t.values,
+        humidity=ds.q.values,
+        z=ds.z.isel(level=0).values,
+        lnsp=ds.lnsp.isel(level=0).values,
+        out_heights=out_heights,
+        engine=engine,
+        interp_weights=interp_weights,
+        max_height=max_height,
+        min_height=min_height,
     )
 
-    # Interpolate to specified output heights if provided
-    if out_heights is not None:
-        ztd_ds = ztd_ds.interp(height=out_heights, method="cubic")
-
     # Package and round results using `pack_ztd` using
     # product_info.TropoProducts
     ztd_ds = pack_ztd(
-        wet_ztd=ztd_ds.wet_ztd.values,
-        hydrostatic_ztd=ztd_ds.hydrostatic_ztd.values,
-        lons=ztd_ds.longitude,
-        lats=ztd_ds.latitude,
-        zs=ztd_ds.height,
+        wet_ztd=wet_ztd,
+        hydrostatic_ztd=hydrostatic_ztd,
+        lons=ds.longitude.values,
+        lats=ds.latitude.values,
+        zs=zs,
         model_time=ds.time.data,
         chunk_size=chunk_size,
         keep_bits=keep_bits,
+        max_height=max_height,
+        min_height=min_height,
     )
 
     return ztd_ds
+
+
+@log_runtime
+def calculate_ztd_block(
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    z: np.ndarray,
+    lnsp: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    out_heights: Optional[list] = None,
+    keep_bits: bool | BandKeepBits = True,
+    engine: str = "raider",
+    interp_weights: Optional[np.ndarray] = None,
+    max_height: Optional[float] = None,
+    min_height: Optional[float] = None,
+    clip_input: bool = False,
+) -> np.ndarray:
+    """Compute the packed delays of a block of input arrays.
+
+    Array version of `calculate_ztd` for `dask.array.blockwise`, without
+    building the product dataset of each block: the product metadata is
+    attached once to the assembled Dask arrays.
+
+    Parameters
+    ----------
+    temperature, humidity, z, lnsp : np.ndarray
+        Input variables with dimensions (time, level, latitude, longitude).
+    lat : np.ndarray
+        1D array of latitude values (degrees).
+    lon : np.ndarray
+        1D array of longitude values (degrees).
+    out_heights, keep_bits, engine, interp_weights, max_height, min_height, \
+    clip_input
+        See `calculate_ztd`.
+
+    Returns
+    -------
+    np.ndarray
+        Stacked wet and hydrostatic delays with dimensions
+        (2, time, height, latitude, longitude), as in the product.
+
+    """
+    if clip_input:
+        temperature = clip_valid_data("t", temperature)
+        humidity = clip_valid_data("q", humidity)
+        z = clip_valid_data("z", z)
+        lnsp = clip_valid_data("lnsp", lnsp)
+
+    wet_ztd, hydrostatic_ztd, zs = _compute_delays(
+        lat=lat,
+        lon=lon,
+        temperature=temperature,
+        humidity=humidity,
+        z=z[:, 0],
+        lnsp=lnsp[:, 0],
+        out_heights=out_heights,
+        engine=engine,
+        interp_weights=interp_weights,
+        max_height=max_height,
+        min_height=min_height,
+    )
+    # Pack both delays straight into the stacked output
+    n_times, n_lat, n_lon = wet_ztd.shape[:3]
+    n_heights = get_height_mask(zs, min_height, max_height).sum()
+    dtype = np.result_type(
+        TROPO_PRODUCTS.wet_delay.dtype, TROPO_PRODUCTS.hydrostatic_delay.dtype
+    )
+    out = np.empty((2, n_times, n_heights, n_lat, n_lon), dtype=dtype)
+    pack_delays(
+        wet_ztd, hydrostatic_ztd, zs, keep_bits, max_height, min_height, out=out
+    )
+    return out
+
+
+def plan_ztd_keep_bits(
+    ds: xr.Dataset,
+    max_error: float = MAX_ERROR,
+    height_edges: Sequence[float] = HEIGHT_BANDS,
+    n_rows: int = KEEP_BITS_SAMPLE_ROWS,
+    out_heights: Optional[list] = None,
+    engine: str = "raider",
+    interp_weights: Optional[np.ndarray] = None,
+    max_height: Optional[float] = None,
+    min_height: Optional[float] = None,
+    clip_input: bool = False,
+) -> BandKeepBits:
+    """Choose the keep_bits per height band from a sample of the delays.
+
+    The delays are computed on `n_rows` latitude rows spread over the
+    input, whole in longitude so the bit information is measured between
+    neighbouring columns, see `opera_tropo.bitinfo.plan_keep_bits`. Only
+    the output heights within [`min_height`, `max_height`] are sampled.
+
+    The sample is read and computed eagerly, before the product graph is
+    built: the disk chunks holding the sampled rows are read twice, once
+    here and once for the product.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Input dataset, as for `calculate_ztd`, already subset to the
+        processed region.
+    max_error : float, optional
+        Largest rounding error of the delays (m). Default is 0.25 mm.
+    height_edges : Sequence[float], optional
+        Edges (m) between the height bands.
+        Default is `opera_tropo.bitinfo.HEIGHT_BANDS`.
+    n_rows : int, optional
+        Number of sampled latitude rows. Default is 16.
+    out_heights, engine, interp_weights, max_height, min_height, clip_input
+        See `calculate_ztd`.
+
+    Returns
+    -------
+    BandKeepBits
+        keep_bits of the product variables, at most those of
+        `TROPO_PRODUCTS`, unless needed to stay within `max_error`.
+
+    """
+    t_start = time.perf_counter()
+    rows = np.linspace(0, ds.sizes["latitude"] - 1, min(n_rows, ds.sizes["latitude"]))
+    sample = ds.isel(latitude=np.unique(rows.round().astype(int))).compute()
+    if clip_input:
+        sample = clip_valid_range(sample)
+
+    wet_ztd, hydrostatic_ztd, zs = _compute_delays(
+        lat=sample.latitude.values,
+        lon=sample.longitude.values,
+        temperature=sample.t.values,
+        humidity=sample.q.values,
+        z=sample.z.isel(level=0).values,
+        lnsp=sample.lnsp.isel(level=0).values,
+        out_heights=out_heights,
+        engine=engine,
+        interp_weights=interp_weights,
+        max_height=max_height,
+        min_height=min_height,
+    )
+    height_mask = get_height_mask(zs, min_height, max_height)
+    if not height_mask.any():
+        raise ValueError(
+            f"No output heights within [{min_height}, {max_height}] m to sample."
+        )
+    products = [TROPO_PRODUCTS.wet_delay, TROPO_PRODUCTS.hydrostatic_delay]
+    keep_bits = plan_keep_bits(
+        {
+            "wet_delay": wet_ztd[..., height_mask],
+            "hydrostatic_delay": hydrostatic_ztd[..., height_mask],
+        },
+        zs[height_mask],
+        max_bits={product.name: product.keep_bits for product in products},
+        height_edges=height_edges,
+        max_error=max_error,
+        dtype=TROPO_PRODUCTS.wet_delay.dtype,
+    )
+    logger.info(
+        f"keep_bits in height bands split at {list(keep_bits.height_edges)} m"
+        f" (max error {max_error} m): "
+        + ", ".join(
+            f"{name} {list(bits)}" for name, bits in keep_bits.keep_bits.items()
+        )
+    )
+    sample_heights = zs[height_mask]
+    logger.info(
+        f"Planned keep_bits in {time.perf_counter() - t_start:.1f} s from"
+        f" {sample.sizes['latitude']} latitude rows in"
+        f" [{sample.latitude.values.min():.2f}, {sample.latitude.values.max():.2f}]°"
+        f" and heights in [{sample_heights.min():.0f}, {sample_heights.max():.0f}] m"
+    )
+    return keep_bits
@@ -6,6 +6,7 @@ from pathlib import Path
 from RAiDER import __version__ as raider_version
 
 from opera_tropo import __version__
+from opera_tropo.batch import tropo_many
 from opera_tropo.browse_image import make_browse_image_from_nc
 from opera_tropo.config import pge_runconfig, runconfig
 from opera_tropo.log.loggin_setup import log_runtime, remove_raider_logs, setup_logging
@@ -17,6 +18,26 @@ logger = logging.getLogger(__name__)
 remove_raider_logs()
 
 
+def _get_product_options(cfg: runconfig.TropoWorkflow) -> dict:
+    """Get the `tropo` product options of a workflow."""
+    return {
+        "max_height": cfg.output_options.max_height,
+        "min_height": cfg.output_options.min_height,
+        "out_heights": cfg.output_options.output_heights,
+        "bbox": cfg.input_options.bbox,
+        "check_sample_fraction": cfg.input_options.check_sample_fraction,
+        "out_chunk_size": cfg.output_options.chunk_size,
+        "block_size": cfg.worker_settings.block_shape,
+        "column_batch": cfg.worker_settings.column_batch,
+        "compression_options": cfg.output_options.compression_kwargs,
+        "engine": cfg.worker_settings.engine,
+        "keep_bits_max_error": cfg.output_options.keep_bits_max_error,
+        "keep_bits_height_edges": cfg.output_options.keep_bits_height_edges,
+        "output_format": cfg.output_options.output_format,
+        "zarr_format": cfg.output_options.zarr_format,
+    }
+
+
 @log_runtime
 def run(
     cfg: runconfig.TropoWorkflow,
@@ -55,15 +76,13 @@ def run(
     tropo(
         file_path=cfg.input_options.input_file_path,  # type: ignore
         output_file=Path(cfg.output_directory) / output_filename,  # type: ignore
-        max_height=cfg.output_options.max_height,
-        out_heights=cfg.output_options.output_heights,  # type: ignore
-        out_chunk_size=cfg.output_options.chunk_size,  # type: ignore
-        block_size=cfg.worker_settings.block_shape,  # type: ignore
         num_workers=cfg.worker_settings.n_workers,
         num_threads=cfg.worker_settings.threads_per_worker,
         max_memory=cfg.worker_settings.max_memory,
-        compression_options=cfg.output_options.compression_kwargs,  # type: ignore
         temp_dir=cfg.worker_settings.dask_temp_dir,  # type: ignore
+        scheduler=cfg.worker_settings.scheduler,
+        checkpoint=cfg.worker_settings.checkpoint,
+        **_get_product_options(cfg),
     )
 
     # Generate output browse image
@@ -79,3 +98,70 @@ def run(
     logger.info(f"Maximum memory usage: {max_mem:.2f} GB")
     logger.info(f"RAIDER version: {raider_version}")
     logger.info(f"Current running opera_tropo version: {__version__}")
+
+
+@log_runtime
+def run_batch(
+    cfg: runconfig.TropoWorkflow,
+    file_paths: list[Path],
+    max_in_flight: int = 2,
+    debug: bool = False,
+) -> list[dict]:
+    """Run the troposphere ZTD on many HRES files with one Dask cluster.
+
+    Parameters
+    ----------
+    cfg : TropoWorkflow
+        `TropoWorkflow` object for controlling the workflow. The input
+        file of the workflow is replaced by `file_paths`.
+    file_paths : list[Path]
+        Paths to the input HRES files.
+    max_in_flight : int, optional
+        Maximum number of products computed at the same time.
+        Default is 2.
+    debug : bool, optional
+        Enable debug logging.
+        Default is False.
+
+    Returns
+    -------
+    list[dict]
+        Per-file processing report, see `opera_tropo.batch.tropo_many`.
+        Browse images are only made for the succeeded files.
+
+    """
+    setup_logging(
+        logger_name="opera_tropo", debug=debug, filename=str(cfg.log_file)
+    )  # type: ignore
+    cfg.output_directory.mkdir(exist_ok=True, parents=True)
+
+    # Get output filenames
+    output_files = []
+    for file_path in file_paths:
+        hres_date, hres_hour = get_hres_datetime(Path(file_path))
+        output_filename = cfg.output_options.get_output_filename(hres_date, hres_hour)
+        output_files.append(Path(cfg.output_directory) / output_filename)
+
+    reports = tropo_many(
+        file_paths,
+        output_files,
+        max_in_flight=max_in_flight,
+        num_workers=cfg.worker_settings.n_workers,
+        num_threads=cfg.worker_settings.threads_per_worker,
+        max_memory=cfg.worker_settings.max_memory,
+        temp_dir=cfg.worker_settings.dask_temp_dir,  # type: ignore
+        scheduler=cfg.worker_settings.scheduler,
+        checkpoint=cfg.worker_settings.checkpoint,
+        **_get_product_options(cfg),
+    )
+
+    # Generate output browse images of the written products
+    for report in reports:
+        if report["status"] == "succeeded":
+            output_file = Path(report["output"])
+            make_browse_image_from_nc(output_file.with_suffix(".png"), output_file)
+
+    max_mem = get_max_memory_usage(units="GB")
+    logger.info(f"Maximum memory usage: {max_mem:.2f} GB")
+    logger.info(f"Current running opera_tropo version: {__version__}")
+    return reports
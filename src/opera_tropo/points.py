@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+from opera_tropo._interp import get_height_weights
+from opera_tropo._ztd import get_output_heights, get_zero_mask, ztd_columns
+from opera_tropo.checks import clip_valid_data
+from opera_tropo.product_info import TROPO_PRODUCTS
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["compute_point_delays"]
+
+
+def _get_lat_nodes(lats: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Get the bracketing latitude indices (N, 2) and bilinear weights (N, 2)."""
+    ascending = lats[0] < lats[-1]
+    grid = lats if ascending else lats[::-1]
+    if np.any((lat < grid[0]) | (lat > grid[-1])):
+        raise ValueError("Point latitudes are outside of the model grid.")
+
+    i0 = np.clip(np.searchsorted(grid, lat, side="right") - 1, 0, grid.size - 2)
+    frac = (lat - grid[i0]) / (grid[i0 + 1] - grid[i0])
+    idx = np.stack([i0, i0 + 1], axis=-1)
+    if not ascending:
+        idx = grid.size - 1 - idx
+    return idx, np.stack([1 - frac, frac], axis=-1)
+
+
+def _get_lon_nodes(lons: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Get the bracketing longitude indices (N, 2) and bilinear weights (N, 2).
+
+    Longitudes are compared modulo 360, points past the last longitude are
+    only wrapped around to the first one if the grid covers the full circle.
+    """
+    spacing = np.diff(lons)
+    if np.any(spacing <= 0):
+        raise ValueError("Model longitudes must be increasing.")
+    is_global = np.isclose(lons[-1] - lons[0] + np.median(spacing), 360)
+    grid = np.append(lons, lons[0] + 360) if is_global else lons
+
+    # Longitudes in [lons[0], lons[0] + 360)
+    lon = lons[0] + (lon - lons[0]) % 360
+    if np.any(lon > grid[-1]):
+        raise ValueError("Point longitudes are outside of the model grid.")
+
+    i0 = np.clip(np.searchsorted(grid, lon, side="right") - 1, 0, grid.size - 2)
+    frac = (lon - grid[i0]) / (grid[i0 + 1] - grid[i0])
+    idx = np.stack([i0, (i0 + 1) % lons.size], axis=-1)
+    return idx, np.stack([1 - frac, frac], axis=-1)
+
+
+def _read_columns(
+    ds: xr.Dataset, lat_idx: np.ndarray, lon_idx: np.ndarray
+) -> dict[str, np.ndarray]:
+    """Read the model columns at the (lat_idx, lon_idx) grid nodes, at all times.
+
+    Only the needed columns are read, one latitude row at a time. The
+    columns of "t" and "q" have shape (time, level, N), those of "z" and
+    "lnsp" (time, N).
+    """
+    n_time, n_level = ds.sizes["time"], ds.sizes["level"]
+    columns = {
+        "t": np.empty((n_time, n_level, lat_idx.size), dtype=ds.t.dtype),
+        "q": np.empty((n_time, n_level, lat_idx.size), dtype=ds.q.dtype),
+        "z": np.empty((n_time, lat_idx.size), dtype=ds.z.dtype),
+        "lnsp": np.empty((n_time, lat_idx.size), dtype=ds.lnsp.dtype),
+    }
+    dims = ("time", "level", "longitude")
+    for row in np.unique(lat_idx):
+        in_row = np.nonzero(lat_idx == row)[0]
+        lon_sel = lon_idx[in_row]
+        # Sorted indices to read the row in a single selection
+        order = np.argsort(lon_sel)
+        in_row, lon_sel = in_row[order], lon_sel[order]
+        row_ds = ds.isel(latitude=row, longitude=lon_sel).transpose(*dims)
+        columns["t"][..., in_row] = row_ds.t.values
+        columns["q"][..., in_row] = row_ds.q.values
+        columns["z"][:, in_row] = row_ds.z.isel(level=0).values
+        columns["lnsp"][:, in_row] = row_ds.lnsp.isel(level=0).values
+    return columns
+
+
+def _get_column_delays(
+    lat: np.ndarray, columns: dict[str, np.ndarray], itime: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Compute the (height, N) delays of the columns at a model time.
+
+    The delays are at the heights of `opera_tropo._ztd.get_output_heights`.
+    The input is cleaned, and zero delays masked, as for the gridded
+    product, see `opera_tropo.core.get_ztd`.
+    """
+    inputs = {
+        var: clip_valid_data(var, values[itime]) for var, values in columns.items()
+    }
+    wet_ztd, hydrostatic_ztd, _ = ztd_columns(
+        lat=lat,
+        temperature=inputs["t"],
+        humidity=inputs["q"],
+        z=inputs["z"],
+        lnsp=inputs["lnsp"],
+    )
+    zero_mask = get_zero_mask(wet_ztd.T, hydrostatic_ztd.T).T
+    if np.any(zero_mask):
+        logger.warning(f"Found {zero_mask.sum()} zero values in the point columns")
+        wet_ztd[zero_mask] = np.nan
+        hydrostatic_ztd[zero_mask] = np.nan
+    return wet_ztd, hydrostatic_ztd
+
+
+def _get_attrs(name: str) -> dict:
+    """Get the output attributes of a delay variable."""
+    info = getattr(TROPO_PRODUCTS, name)
+    return {"long_name": info.long_name, "units": info.attrs["units"]}
+
+
+def compute_point_delays(
+    hres_file: str | Path,
+    points: np.ndarray,
+) -> xr.Dataset:
+    """Compute wet and hydrostatic zenith delays at scattered points.
+
+    Only the model columns surrounding each point are read and processed
+    with the native ZTD engine, so the cost scales with the number of
+    points instead of the grid size. Delays are interpolated vertically
+    with the cubic interpolation used for the gridded product, and
+    bilinearly in latitude and longitude. The input is cleaned and the
+    zero delays are masked as for the gridded product, at every model time
+    of the file.
+
+    Parameters
+    ----------
+    hres_file : str | Path
+        Path to the HRES model file.
+    points : np.ndarray
+        Point coordinates with shape (N, 3): latitude (degrees),
+        longitude (degrees, [-180, 180] or [0, 360]) and height (m).
+
+    Returns
+    -------
+    xr.Dataset
+        Dataset with 'wet_delay' and 'hydrostatic_delay' (m) with
+        dimensions ('time', 'point'). Points outside of the model height
+        range, or next to a column with masked delays, are NaN.
+
+    Raises
+    ------
+    ValueError
+        If `points` does not have shape (N, 3) or is outside of the grid.
+
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+    if points.ndim != 2 or points.shape[1] != 3:
+        raise ValueError(f"Expected points with shape (N, 3), got {points.shape}")
+    lat, lon, height = points.T
+
+    with xr.open_dataset(hres_file, engine="h5netcdf") as ds:
+        lat_nodes, lat_weights = _get_lat_nodes(ds.latitude.values, lat)
+        lon_nodes, lon_weights = _get_lon_nodes(ds.longitude.values, lon)
+
+        # Four surrounding nodes of each point, (N, 4)
+        node_lat = np.repeat(lat_nodes, 2, axis=1)
+        node_lon = np.tile(lon_nodes, 2)
+        node_weights = np.repeat(lat_weights, 2, axis=1) * np.tile(lon_weights, 2)
+
+        # Process each grid column only once
+        nodes, inverse = np.unique(
+            np.stack([node_lat.ravel(), node_lon.ravel()]), axis=1, return_inverse=True
+        )
+        inverse = inverse.reshape(node_lat.shape)
+        logger.debug(f"Reading {nodes.shape[1]} model columns for {len(points)} points")
+
+        columns = _read_columns(ds, nodes[0], nodes[1])
+        node_lats = ds.latitude.values[nodes[0]]
+        model_times = ds.time.values
+
+    # Vertical interpolation at each point height, then horizontal weighting
+    height_weights = get_height_weights(get_output_heights(), height)
+    delays: dict[str, list] = {"wet_delay": [], "hydrostatic_delay": []}
+    for itime in range(model_times.size):
+        wet_ztd, hydrostatic_ztd = _get_column_delays(node_lats, columns, itime)
+        for name, ztd in [
+            ("wet_delay", wet_ztd),
+            ("hydrostatic_delay", hydrostatic_ztd),
+        ]:
+            profiles = np.einsum("ph,hpk->pk", height_weights, ztd[:, inverse])
+            delays[name].append(np.sum(profiles * node_weights, axis=1))
+
+    out_ds = xr.Dataset(
+        data_vars={
+            name: (("time", "point"), np.stack(values), _get_attrs(name))
+            for name, values in delays.items()
+        },
+        coords={
+            "time": model_times,
+            "latitude": ("point", lat),
+            "longitude": ("point", (lon + 180) % 360 - 180),
+            "height": ("point", height),
+        },
+    )
+    return out_ds
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+from dataclasses import dataclass
+from typing import Literal, Optional
+
+from dask.system import CPU_COUNT
+from dask.utils import format_bytes, parse_bytes
+from distributed.system import MEMORY_LIMIT
+
+from opera_tropo._ztd import COLUMN_CHUNK, N_LEVELS, get_output_heights
+
+try:
+    from threadpoolctl import threadpool_info, threadpool_limits
+except ImportError:
+    threadpool_info = threadpool_limits = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "ResourcePlan",
+    "estimate_column_memory",
+    "get_native_threads",
+    "get_thread_env",
+    "get_thread_limits",
+    "limit_native_threads",
+    "plan_resources",
+]
+
+AUTO = "auto"
+# Number of model heights the delays are computed on
+N_MODEL_HEIGHTS = len(get_output_heights())
+# Fraction of the container memory given to the workers
+MEMORY_HEADROOM = 0.8
+# Blocks held by a worker thread at once: computed block and its output in flight
+BLOCKS_PER_THREAD = 2
+# Target number of blocks per thread, for load balancing
+MIN_BLOCKS_PER_THREAD = 4
+MIN_BLOCK_SIDE = 8
+MAX_BLOCK_SIDE = 512
+# Thread pool sizes of the native libraries, read when they are loaded
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# Native thread pool size last applied by each task thread
+_thread_state = threading.local()
+
+
+@dataclass
+class ResourcePlan:
+    """Resolved worker and block settings of a run."""
+
+    n_workers: int
+    threads_per_worker: int
+    max_memory: int | str
+    block_shape: list[int]
+    block_memory: int
+
+    def __str__(self) -> str:
+        """Describe the plan in one line."""
+        memory = self.max_memory
+        if not isinstance(memory, str):
+            memory = format_bytes(memory)
+        return (
+            f"{self.n_workers} workers x {self.threads_per_worker} threads,"
+            f" {memory} per worker, blocks {self.block_shape}"
+            f" (~{format_bytes(self.block_memory)} peak per block)"
+        )
+
+
+def estimate_column_memory(
+    n_out_heights: int = N_MODEL_HEIGHTS,
+    engine: str = "raider",
+    n_levels: int = N_LEVELS,
+) -> int:
+    """Estimate the peak memory in bytes used per grid column of a block.
+
+    Parameters
+    ----------
+    n_out_heights : int, optional
+        Number of output heights. Default is the model heights.
+    engine : str, optional
+        ZTD engine, "raider" or "native". Default is "raider".
+    n_levels : int, optional
+        Number of model levels of the input. Default is 137.
+
+    Returns
+    -------
+    int
+        Estimated bytes per grid column.
+
+    """
+    # t, q, z and lnsp as float32 with a level dimension
+    input_bytes = 4 * n_levels * 4
+    if engine == "native":
+        # Only the two float64 delay profiles span the whole block,
+        # the intermediates are bounded by the column chunk
+        work_bytes = 2 * N_MODEL_HEIGHTS * 8
+    else:
+        # RAiDER keeps ~16 float64 (lat, lon, height) cubes on the model
+        work_bytes = 16 * N_MODEL_HEIGHTS * 8
+    # Interpolated float64 delays and their float32 packed copies
+    output_bytes = 2 * n_out_heights * (8 + 4)
+    return input_bytes + work_bytes + output_bytes
+
+
+def _get_block_overhead(engine: str, n_levels: int = N_LEVELS) -> int:
+    """Get the per-block memory that does not scale with the block size."""
+    if engine == "native":
+        # ~12 float64 (level, column) intermediates of a column chunk
+        return 12 * n_levels * 8 * COLUMN_CHUNK
+    return 0
+
+
+def plan_resources(
+    grid_shape: tuple[int, int],
+    n_out_heights: int = N_MODEL_HEIGHTS,
+    engine: str = "raider",
+    n_workers: int | Literal["auto"] = AUTO,
+    threads_per_worker: int | Literal["auto"] = AUTO,
+    max_memory: int | str = AUTO,
+    block_shape: list[int] | tuple[int, int] | Literal["auto"] = AUTO,
+    n_times: int = 1,
+    cpu_count: Optional[int] = None,
+    memory_limit: Optional[int] = None,
+) -> ResourcePlan:
+    """Resolve "auto" worker and block settings for the available resources.
+
+    CPU and memory limits default to the cgroup-aware values of the
+    container reported by Dask. Workers get the container memory split
+    evenly, and blocks are sized so that every worker thread can hold
+    `BLOCKS_PER_THREAD` blocks within the worker memory, while keeping
+    enough blocks to balance the load across threads.
+
+    Parameters
+    ----------
+    grid_shape : tuple[int, int]
+        Size of the (latitude, longitude) grid to process.
+    n_out_heights : int, optional
+        Number of output heights. Default is the model heights.
+    engine : str, optional
+        ZTD engine, "raider" or "native". Default is "raider".
+    n_workers : int or "auto", optional
+        Number of workers. Default is "auto".
+    threads_per_worker : int or "auto", optional
+        Number of threads per worker. Default is "auto".
+    max_memory : int, str or "auto", optional
+        Memory limit per worker. Default is "auto".
+    block_shape : list[int] or "auto", optional
+        Block size (lat, lon). Default is "auto".
+    n_times : int, optional
+        Number of model times to process. Default is 1.
+    cpu_count : int, optional
+        Number of available CPUs. Default is the container limit.
+    memory_limit : int, optional
+        Available memory in bytes. Default is the container limit.
+
+    Returns
+    -------
+    ResourcePlan
+        Resolved settings.
+
+    """
+    cpu_count = cpu_count or CPU_COUNT
+    memory_limit = memory_limit or MEMORY_LIMIT
+    n_lat, n_lon = grid_shape
+
+    if threads_per_worker == AUTO:
+        # The kernels release the GIL in NumPy, two threads share a worker well
+        threads_per_worker = min(2, cpu_count)
+    if n_workers == AUTO:
+        n_workers = max(1, cpu_count // threads_per_worker)
+    if max_memory == AUTO:
+        max_memory = int(MEMORY_HEADROOM * memory_limit / n_workers)
+    worker_memory = parse_bytes(max_memory)
+
+    column_memory = estimate_column_memory(n_out_heights, engine)
+    overhead = _get_block_overhead(engine)
+    if block_shape == AUTO:
+        # Largest block fitting in the worker memory ...
+        block_budget = worker_memory / (threads_per_worker * BLOCKS_PER_THREAD)
+        max_columns = max(1, (block_budget - overhead) // column_memory)
+        # ... but with enough blocks to keep all threads busy
+        n_threads = n_workers * threads_per_worker
+        balanced_columns = n_times * n_lat * n_lon / (MIN_BLOCKS_PER_THREAD * n_threads)
+        n_columns = max(1, min(max_columns, balanced_columns))
+
+        side = int(math.sqrt(n_columns))
+        side = max(MIN_BLOCK_SIDE, min(MAX_BLOCK_SIDE, side))
+        block_shape = [min(side, n_lat), min(side, n_lon)]
+    block_shape = list(block_shape)
+
+    block_memory = block_shape[0] * block_shape[1] * column_memory + overhead
+    if block_memory * threads_per_worker > worker_memory:
+        logger.warning(
+            f"Estimated block memory {format_bytes(block_memory)} x"
+            f" {threads_per_worker} threads exceeds the worker memory"
+            f" {format_bytes(worker_memory)}."
+        )
+    return ResourcePlan(
+        n_workers=int(n_workers),
+        threads_per_worker=int(threads_per_worker),
+        max_memory=max_memory,
+        block_shape=block_shape,
+        block_memory=int(block_memory),
+    )
+
+
+def get_native_threads(n_task_threads: int, cpu_count: Optional[int] = None) -> int:
+    """Get the native thread pool size of tasks sharing the CPUs of a machine.
+
+    Dask already runs one task per thread, so the BLAS/OpenMP pools only
+    get the CPUs left over by the `n_task_threads` task threads running on
+    the machine: 1 on a fully used machine.
+
+    Parameters
+    ----------
+    n_task_threads : int
+        Number of task threads running on the machine.
+    cpu_count : int, optional
+        Number of CPUs. Default is the cgroup-aware count of Dask.
+
+    Returns
+    -------
+    int
+        Number of threads of each native thread pool.
+
+    """
+    cpu_count = CPU_COUNT if cpu_count is None else cpu_count
+    return max(1, cpu_count // max(1, n_task_threads))
+
+
+def limit_native_threads(n_threads: Optional[int]) -> None:
+    """Limit the BLAS/OpenMP thread pools used by tasks with threadpoolctl.
+
+    The OpenBLAS and MKL limits are process-wide, shared by all the task
+    threads of a process, while OpenMP limits only apply to the thread
+    setting them. The limits are therefore applied from within the tasks,
+    once per task thread, with the same `n_threads` in all threads of a
+    process. Without threadpoolctl the limits rely on the `THREAD_ENV_VARS`
+    in the environment of the worker processes, see `get_thread_env`.
+    """
+    if n_threads is None or threadpool_limits is None:
+        return
+    if getattr(_thread_state, "native_threads", None) == n_threads:
+        return
+    threadpool_limits(limits=n_threads)
+    _thread_state.native_threads = n_threads
+
+
+def get_thread_env(n_threads: int) -> dict[str, int]:
+    """Get the environment variables limiting the native thread pools."""
+    return dict.fromkeys(THREAD_ENV_VARS, n_threads)
+
+
+def get_thread_limits() -> dict[str, int]:
+    """Get the effective native thread pool sizes of the current process.
+
+    Returns
+    -------
+    dict[str, int]
+        Number of threads per loaded library (e.g. "openblas", "openmp")
+        from threadpoolctl, or the `THREAD_ENV_VARS` set in the
+        environment if threadpoolctl is not installed.
+
+    """
+    if threadpool_info is not None:
+        return {info["internal_api"]: info["num_threads"] for info in threadpool_info()}
+    return {var: int(os.environ[var]) for var in THREAD_ENV_VARS if var in os.environ}
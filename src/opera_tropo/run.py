@@ -2,18 +2,50 @@ from __future__ import annotations
 
 import logging
 import shutil
+import tempfile
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Sequence
 
+import dask
 import dask.array as da
 import numpy as np
 import xarray as xr
 from dask.distributed import Client
 
+from opera_tropo._checkpoint import get_block_name, open_checkpoint, run_checkpointed
+from opera_tropo._interp import get_height_weights
 from opera_tropo._pack import pack_ztd
-from opera_tropo.checks import validate_input
-from opera_tropo.core import calculate_ztd
+from opera_tropo._writer import write_netcdf, write_zarr
+from opera_tropo._ztd import get_output_heights
+from opera_tropo.bitinfo import HEIGHT_BANDS
+from opera_tropo.checks import (
+    ValidationError,
+    check_coords_and_variables,
+    get_validation_stats,
+    report_validation,
+    sample_check,
+)
+from opera_tropo.compression import get_compression_options
+from opera_tropo.core import calculate_ztd_block, plan_ztd_keep_bits
 from opera_tropo.log.loggin_setup import remove_raider_logs
+from opera_tropo.resources import (
+    AUTO,
+    N_MODEL_HEIGHTS,
+    ResourcePlan,
+    get_native_threads,
+    get_thread_limits,
+    limit_native_threads,
+    plan_resources,
+)
+from opera_tropo.utils import (
+    align_block_size,
+    get_aligned_chunks,
+    get_disk_chunks,
+    get_longitude_runs,
+    get_read_amplification,
+    subset_bbox,
+)
 
 try:
     from RAiDER.models.model_levels import A_137_HRES, LEVELS_137_HEIGHTS
@@ -25,86 +57,403 @@ except ImportError as e:
 logger = logging.getLogger(__name__)
 
 BLOCK_SIZE = [128, 256]  # lat, lon
-DEFAULT_COMPRESSION = {"zlib": True, "complevel": 4, "shuffle": True}
+DEFAULT_COMPRESSION = "zlib"
 OUTPUT_CHUNKS = [1, 8, 512, 512]  # time, height, lat, lon
 
+OUTPUT_FORMATS = ("netcdf", "zarr")
+SCHEDULERS = ("auto", "distributed", "threads", "processes", "synchronous")
+# Peak memory of a block relative to its input size (float64 intermediates)
+BLOCK_MEMORY_FACTOR = 8
+# Largest estimated peak memory processed without a distributed cluster in auto mode
+LOCAL_SCHEDULER_MAX_BYTES = 2 * 2**30
 
-def tropo(
-    file_path: str,
-    output_file: str,
-    *,
-    max_height: int = 81000,
-    out_heights: Optional[list[float] | np.ndarray] = None,
-    block_size: list[int] = BLOCK_SIZE,
-    out_chunk_size: list[int] = OUTPUT_CHUNKS,
+
+def get_column_block_size(n_columns: int, grid_shape: tuple[int, int]) -> list[int]:
+    """Get a (lat, lon) block size holding at most `n_columns` grid columns.
+
+    Blocks span as many whole longitude rows as fit in `n_columns`, or
+    `n_columns` longitudes of a single row when the batch is smaller than
+    a row. This bounds the columns, and so the memory, of each task, but
+    does not make the blocks equal: a full block holds between half of
+    `n_columns` and `n_columns` columns, and the last block along each
+    dimension holds the remaining rows or longitudes.
+
+    Parameters
+    ----------
+    n_columns : int
+        Maximum number of grid columns per block.
+    grid_shape : tuple[int, int]
+        Size of the (latitude, longitude) grid.
+
+    Returns
+    -------
+    list[int]
+        Block size [lat, lon].
+
+    """
+    if n_columns < 1:
+        raise ValueError(f"Column batch must be >= 1, got {n_columns}")
+    n_lat, n_lon = grid_shape
+    if n_columns >= n_lon:
+        return [min(n_lat, n_columns // n_lon), n_lon]
+    return [1, n_columns]
+
+
+def inspect_input(
+    file_path: str, bbox: Optional[tuple[float, float, float, float]] = None
+) -> tuple[dict[str, int], int]:
+    """Get the dimension sizes and size in bytes of the input to process."""
+    with xr.open_dataset(file_path, chunks={}, engine="h5netcdf") as ds:
+        if bbox is not None:
+            ds = subset_bbox(ds, bbox)
+        return dict(ds.sizes), int(ds.nbytes)
+
+
+def resolve_resources(
+    sizes: dict[str, int],
+    out_heights: Optional[list[float] | np.ndarray],
+    engine: str,
+    num_workers: int | str,
+    num_threads: int | str,
+    max_memory: int | str,
+    block_size: list[int] | str,
+    client: Optional[Client] = None,
+) -> ResourcePlan:
+    """Resolve "auto" worker and block settings for an input.
+
+    With a `client`, the workers are taken from the client and only
+    the block size is planned.
+    """
+    if client is not None:
+        workers = client.scheduler_info()["workers"].values()
+        num_workers = len(workers)
+        num_threads = max(w["nthreads"] for w in workers)
+        # A memory limit of 0 means no limit, plan with the container memory
+        max_memory = min(w["memory_limit"] for w in workers) or AUTO
+
+    plan = plan_resources(
+        (sizes["latitude"], sizes["longitude"]),
+        n_out_heights=N_MODEL_HEIGHTS if out_heights is None else len(out_heights),
+        engine=engine,
+        n_workers=num_workers,
+        threads_per_worker=num_threads,
+        max_memory=max_memory,
+        block_shape=block_size,
+        n_times=sizes["time"],
+    )
+    logger.info(f"Resource plan: {plan}")
+    return plan
+
+
+def select_scheduler(
+    scheduler: str,
+    input_nbytes: int,
+    max_memory: int | str = "16GB",
+) -> str:
+    """Resolve the Dask scheduler to run on.
+
+    In "auto" mode, jobs whose estimated peak memory fits in one worker
+    and below `LOCAL_SCHEDULER_MAX_BYTES` run on the local threaded
+    scheduler, skipping the start-up of a distributed cluster.
+    Larger jobs use "distributed".
+
+    Parameters
+    ----------
+    scheduler : str
+        One of "auto", "distributed", "threads", "processes" or "synchronous".
+    input_nbytes : int
+        Size in bytes of the input to process.
+    max_memory : int or str, optional
+        Memory limit of a worker. Default is '16GB'.
+
+    Returns
+    -------
+    str
+        Selected scheduler, never "auto".
+
+    Raises
+    ------
+    ValueError
+        If `scheduler` is unknown.
+
+    """
+    if scheduler not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler: {scheduler}. Choose from {SCHEDULERS}.")
+    if scheduler != "auto":
+        return scheduler
+
+    peak_memory = BLOCK_MEMORY_FACTOR * input_nbytes
+    local_max = min(LOCAL_SCHEDULER_MAX_BYTES, dask.utils.parse_bytes(max_memory))
+    selected = "threads" if peak_memory <= local_max else "distributed"
+    logger.info(
+        f"Selected {selected!r} scheduler for {input_nbytes / 2**20:.1f} MB of input"
+        f" (estimated peak memory {peak_memory / 2**20:.1f} MB)."
+    )
+    return selected
+
+
+def start_client(
     num_workers: int = 4,
     num_threads: int = 2,
     max_memory: int | str = "16GB",
-    compression_options: dict = DEFAULT_COMPRESSION,
     temp_dir: Optional[str] = None,
-    pre_check: bool = True,
-) -> None:
-    """Run troposphere workflow.
+) -> Client:
+    """Start a local Dask cluster and connect a client to it.
 
     Parameters
     ----------
-    file_path : str
-        Path to the input dataset file.
-    output_file : str
-        Path to the output NetCDF file.
-    max_height : int, optional
-        Maximum height in meters. Default is 81,000.
-    out_heights : list of int, optional
-        List of output heights. Default is None (using model heights).
-    block_size : list of int, optional
-        Block size for processing. Default is [128, 128].
-    out_chunk_size : list of int, optional
-        Chunk size for output data. Default is [1, 8, 512, 512].
     num_workers : int, optional
         Number of parallel workers. Default is 4.
     num_threads : int, optional
         Number of threads per worker. Default is 2.
     max_memory : int or str, optional
-        Maximum memory allocation. Default is '16GB'.
-    compression_options : dict, optional
-        Compression options for the output NetCDF file. Default is None.
+        Maximum memory allocation per worker. Default is '16GB'.
     temp_dir : str, optional
-        Directory for temporary files. Default is None.
-    pre_check : bool, optional
-        Whether to perform pre-check of input data. Default is True.
+        Directory for temporary (spill) files. Default is None.
 
     Returns
     -------
-    None
-
-    Raises
-    ------
-    ValueError
-        If the input dataset file cannot be opened or processed.
+    Client
+        Connected Dask client.
 
     """
-    logger.info("Calculating TROPO delay")
-    # Set default compression options if not provided
-    encoding_defaults = {
-        "zlib": True,
-        "complevel": 4,
-        "shuffle": True,
-        "chunksizes": out_chunk_size,
-    }
-    encoding = {**encoding_defaults, **compression_options}
-
-    # Setup Dask Client and temp. directory
     if temp_dir:
         Path(temp_dir).mkdir(parents=True, exist_ok=True)
 
+    # Workers keep the Dask default of one thread per BLAS/OpenMP pool, set
+    # by `distributed.nanny.pre-spawn-environ`, so that each worker uses its
+    # `num_threads` CPUs. The tasks apply the same limit with threadpoolctl,
+    # see `get_task_native_threads`
     client = Client(
         n_workers=num_workers,
         threads_per_worker=num_threads,
         memory_limit=max_memory,
         local_directory=temp_dir,
     )
+    worker_limits = client.run(get_thread_limits).values()
+    for limits in {str(limits) for limits in worker_limits}:
+        logger.info(
+            f"Native thread pool limits of each of the {num_workers} workers"
+            f" ({num_threads} task threads): {limits}"
+        )
     logger.debug(f"Dask server link: {client.dashboard_link}")
+    return client
+
 
+def get_local_scheduler(scheduler: str, num_workers: int, num_threads: int):
+    """Get the configuration context running on a local Dask scheduler.
+
+    "threads" runs `num_workers` * `num_threads` threads, "processes"
+    `num_workers` processes.
+    """
+    n_local = num_workers * num_threads if scheduler == "threads" else num_workers
+    logger.debug(f"Using local {scheduler!r} scheduler")
+    return dask.config.set(scheduler=scheduler, num_workers=n_local)
+
+
+def get_task_threads(
+    scheduler: str,
+    num_workers: int,
+    num_threads: int,
+    client: Optional[Client] = None,
+) -> int:
+    """Get the number of threads running tasks at the same time.
+
+    Parameters
+    ----------
+    scheduler : str
+        Selected scheduler, see `select_scheduler`. Ignored if `client`
+        is given.
+    num_workers : int
+        Number of workers, or processes of the "processes" scheduler.
+    num_threads : int
+        Number of threads per worker.
+    client : Client, optional
+        Client of the cluster running the tasks. Default is None.
+
+    Returns
+    -------
+    int
+        Number of task threads of all workers.
+
+    """
+    if client is not None:
+        return sum(client.nthreads().values())
+    if scheduler == "synchronous":
+        return 1
+    if scheduler == "processes":
+        return num_workers
+    return num_workers * num_threads
+
+
+def get_task_native_threads(
+    scheduler: str,
+    num_workers: int,
+    num_threads: int,
+    client: Optional[Client] = None,
+) -> int:
+    """Get the BLAS/OpenMP thread pool size of the tasks.
+
+    Tasks on a Dask distributed cluster use one native thread, the default
+    of the workers, as the task threads of the workers can fill the CPUs.
+    Local schedulers share the CPUs left over by their task threads, see
+    `opera_tropo.resources.get_native_threads`.
+
+    Parameters
+    ----------
+    scheduler : str
+        Selected scheduler, see `select_scheduler`.
+    num_workers : int
+        Number of workers, or processes of the "processes" scheduler.
+    num_threads : int
+        Number of threads per worker.
+    client : Client, optional
+        Client of the cluster running the tasks. Default is None.
+
+    Returns
+    -------
+    int
+        Number of threads of each native thread pool.
+
+    """
+    if client is not None or scheduler == "distributed":
+        native_threads = 1
+    else:
+        task_threads = get_task_threads(scheduler, num_workers, num_threads)
+        native_threads = get_native_threads(task_threads)
+    logger.info(f"Native thread pools limited to {native_threads} threads per task")
+    return native_threads
+
+
+def stop_client(client: Client, temp_dir: Optional[str] = None) -> None:
+    """Close a client started with `start_client` and remove its temp. directory."""
+    logger.debug(f"Closing dask server: {client.dashboard_link.split('/')[2]}.")
+    client.close()
+    if temp_dir:
+        logger.debug(f"Removing dask tmp dir: {temp_dir}")
+        shutil.rmtree(str(temp_dir))
+
+
+def _run_ztd_block(
+    temperature: np.ndarray,
+    humidity: np.ndarray,
+    z: np.ndarray,
+    lnsp: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    times: np.ndarray,
+    native_threads: Optional[int] = None,
+    checkpoint_dir: Optional[str] = None,
+    **kwargs,
+) -> np.ndarray:
+    """Run `calculate_ztd_block` in a task with limited native thread pools.
+
+    With `checkpoint_dir`, the block saved by a previous run is loaded
+    instead, and the computed block is saved there.
+    """
+    limit_native_threads(native_threads)
+    args = (temperature, humidity, z, lnsp, lat, lon)
+    if checkpoint_dir is None:
+        return calculate_ztd_block(*args, **kwargs)
+    block_name = get_block_name(times, lat, lon)
+    return run_checkpointed(
+        calculate_ztd_block, checkpoint_dir, block_name, *args, **kwargs
+    )
+
+
+def _map_ztd_blocks(
+    ds: xr.Dataset,
+    template: xr.Dataset,
+    ztd_kwargs: dict,
+    checkpoint_dir: Optional[str | Path] = None,
+    native_threads: Optional[int] = None,
+) -> xr.Dataset:
+    """Compute the delays of each block with `calculate_ztd_block`.
+
+    With `checkpoint_dir`, blocks saved there are loaded instead of
+    computed, and the computed blocks are saved there. The height
+    interpolation weights are stored once in the graph, not in every task.
+    """
+    ztd_kwargs = dict(ztd_kwargs)
+    if ztd_kwargs.get("interp_weights") is not None:
+        ztd_kwargs["interp_weights"] = dask.delayed(
+            ztd_kwargs["interp_weights"], pure=True
+        )
+    dims = ("time", "level", "latitude", "longitude")
+    inputs = [ds[var].transpose(*dims).data for var in ("t", "q", "z", "lnsp")]
+    lats = da.from_array(ds.latitude.values, chunks=(ds.chunksizes["latitude"],))
+    lons = da.from_array(ds.longitude.values, chunks=(ds.chunksizes["longitude"],))
+    times = da.from_array(ds.time.values, chunks=(ds.chunksizes["time"],))
+    if checkpoint_dir is not None:
+        checkpoint_dir = str(checkpoint_dir)
+    delays = da.blockwise(
+        _run_ztd_block,
+        "vthyx",
+        *[arg for data in inputs for arg in (data, "tlyx")],
+        lats,
+        "y",
+        lons,
+        "x",
+        times,
+        "t",
+        new_axes={"v": 2, "h": template.sizes["height"]},
+        concatenate=True,
+        meta=np.empty((0,) * 5, dtype=template.wet_delay.dtype),
+        native_threads=native_threads,
+        checkpoint_dir=checkpoint_dir,
+        **ztd_kwargs,
+    )
+    return template.copy(data={"wet_delay": delays[0], "hydrostatic_delay": delays[1]})
+
+
+def build_tropo(
+    file_path: str,
+    *,
+    max_height: int = 81000,
+    min_height: Optional[int] = None,
+    out_heights: Optional[list[float] | np.ndarray] = None,
+    bbox: Optional[tuple[float, float, float, float]] = None,
+    block_size: list[int] = BLOCK_SIZE,
+    column_batch: Optional[int] = None,
+    out_chunk_size: list[int] = OUTPUT_CHUNKS,
+    compression_options: dict | str = DEFAULT_COMPRESSION,
+    output_format: str = "netcdf",
+    pre_check: bool = True,
+    check_sample_fraction: Optional[float] = None,
+    engine: str = "raider",
+    keep_bits_max_error: Optional[float] = None,
+    keep_bits_height_edges: Sequence[float] = HEIGHT_BANDS,
+    checkpoint_dir: Optional[str | Path] = None,
+    native_threads: Optional[int] = None,
+) -> tuple[xr.Dataset, dict, Optional[dict]]:
+    """Build the lazy troposphere product of an HRES file.
+
+    See `tropo` for the description of the parameters. With `pre_check`,
+    coordinates and variables are checked immediately, while the input
+    statistics are returned lazily, to compute together with the product,
+    and out-of-range input values are clipped within each block.
+    With `check_sample_fraction`, a sample of the input chunks is checked
+    first, and the in-pass statistics and clipping are skipped (None is
+    returned for the statistics) if the sample is clean. Blocks saved
+    in `checkpoint_dir` are loaded instead of computed, and the computed
+    blocks are saved there. The tasks limit their native thread pools to
+    `native_threads`, see `opera_tropo.resources.get_native_threads`.
+    The netCDF4 filter plugins of the compression are only required for
+    the "netcdf" `output_format`.
+
+    Returns
+    -------
+    tuple[xr.Dataset, dict, dict or None]
+        Lazy output dataset, its NetCDF encoding, and the lazy input
+        statistics to pass to `opera_tropo.checks.report_validation`
+        (None without `pre_check`).
+
+    Raises
+    ------
+    ValueError
+        If the input dataset file cannot be opened.
+
+    """
     # Open the dataset
     try:
         ds = xr.open_dataset(file_path, chunks={"level": -1}, engine="h5netcdf")
@@ -115,20 +464,79 @@ def tropo(
             "Original error: {e}"
         )
 
-    # Validate input, check valid range,
-    #  nan values and exp. var and coords
+    # Keep the file layout to align the blocks to the disk chunks
+    file_indexes = ds.indexes
+    disk_chunks = get_disk_chunks(ds["t"])
+
+    # Subset to the region of interest before any processing
+    if bbox is not None:
+        ds = subset_bbox(ds, bbox)
+        logger.info(
+            f"Processing bbox {bbox}: {ds.sizes['latitude']} x"
+            f" {ds.sizes['longitude']} (lat, lon) grid points."
+        )
+
+    # Check the expected variables and coordinates, the valid range and
+    # NaNs are checked in the same pass over the data as the processing
+    full_check = pre_check
     if pre_check:
-        ds = validate_input(ds)
+        logger.info("Checking coordinate ranges and data variables.")
+        check_coords_and_variables(ds)
+        # The input is still chunked as on disk, the sample reads whole chunks
+        if check_sample_fraction is not None:
+            full_check = not sample_check(ds, check_sample_fraction)
 
     # Rechunk for parallel processing
-    logger.debug(f"Rechunking {file_path}")
-    chunks = {
-        "longitude": block_size[1],
-        "latitude": block_size[0],
-        "time": 1,
-        "level": len(A_137_HRES) - 1,
-    }
-    ds = ds.chunk(chunks)
+    if column_batch is not None:
+        block_size = get_column_block_size(
+            column_batch, (ds.sizes["latitude"], ds.sizes["longitude"])
+        )
+        logger.debug(f"Using up to {column_batch} columns per block: {block_size}")
+    # Blocks made of whole disk chunks, with edges on the disk chunk
+    # boundaries, so that rechunking only merges the chunks read
+    block_size = align_block_size(
+        block_size,
+        [disk_chunks["latitude"], disk_chunks["longitude"]],
+        [ds.sizes["latitude"], ds.sizes["longitude"]],
+    )
+    logger.debug(f"Rechunking {file_path} to blocks of {block_size}")
+
+    def _get_chunks(ds_part: xr.Dataset) -> dict:
+        positions = {
+            dim: file_indexes[dim].get_indexer(ds_part[dim].values)
+            for dim in ("latitude", "longitude")
+        }
+        return {
+            "longitude": get_aligned_chunks(positions["longitude"], block_size[1]),
+            "latitude": get_aligned_chunks(positions["latitude"], block_size[0]),
+            "time": 1,
+            "level": len(A_137_HRES) - 1,
+        }
+
+    # Lay out the blocks in the output [-180, 180] longitude order, split
+    # at 180° so that no block is reordered after processing
+    lon_runs = get_longitude_runs(ds.longitude.values)
+    if lon_runs is None or len(lon_runs) == 1:
+        ds = ds.chunk(_get_chunks(ds))
+    else:
+        parts = [ds.isel(longitude=run) for run in lon_runs]
+        ds = xr.concat(
+            [part.chunk(_get_chunks(part)) for part in parts],
+            dim="longitude",
+            data_vars="minimal",
+            coords="minimal",
+        )
+    amplification = get_read_amplification(
+        {dim: file_indexes[dim].get_indexer(ds[dim].values) for dim in disk_chunks},
+        {dim: ds.chunksizes[dim] for dim in disk_chunks},
+        disk_chunks,
+    )
+    logger.info(
+        f"Input read amplification: {amplification:.2f} (disk chunks"
+        f" {tuple(disk_chunks.values())}, blocks {block_size})"
+    )
+
+    validation_stats = get_validation_stats(ds) if full_check else None
 
     chunksizes = {key: value[0] for key, value in ds.chunksizes.items()}
     logger.debug(f"Chunk sizes: {chunksizes}")
@@ -140,14 +548,20 @@ def tropo(
     if out_heights is not None and len(out_heights) > 0:
         zlevels = np.array(out_heights)
     else:
+        out_heights = None
         zlevels = np.flipud(LEVELS_137_HEIGHTS)
 
-    out_size = da.empty((cols, rows, len(zlevels)), dtype=np.float32)
+    out_size = da.empty((ds.sizes["time"], cols, rows, len(zlevels)), dtype=np.float32)
 
     # To skip interpolation if out_heights are same as default
     if np.array_equal(out_heights, np.flipud(LEVELS_137_HEIGHTS)):
         out_heights = None
 
+    # Build the vertical interpolation weights once for all blocks
+    interp_weights = None
+    if out_heights is not None:
+        interp_weights = get_height_weights(get_output_heights(), zlevels)
+
     # Get output template
     template = pack_ztd(
         wet_ztd=out_size,
@@ -157,39 +571,329 @@ def tropo(
         zs=zlevels,
         model_time=ds.time.values,
         chunk_size={
-            "longitude": int(chunksizes["longitude"]),
-            "latitude": int(chunksizes["latitude"]),
+            "longitude": ds.chunksizes["longitude"],
+            "latitude": ds.chunksizes["latitude"],
             "height": -1,
             "time": 1,
         },
         keep_bits=False,
+        max_height=max_height,
+        min_height=min_height,
     )
+    logger.debug(f"Output heights: {template.sizes['height']}")
 
     # Calculate ZTD
-    model_time_str = ds.time.dt.strftime("%Y%m%dT%H").values[0]
+    model_time_str = ", ".join(ds.time.dt.strftime("%Y%m%dT%H").values)
     logger.info(f"Estimating ZTD delay for {model_time_str}.")
 
-    out_ds = ds.map_blocks(
-        calculate_ztd, kwargs={"out_heights": out_heights}, template=template
-    )
+    ztd_kwargs = {
+        "out_heights": out_heights,
+        "engine": engine,
+        "interp_weights": interp_weights,
+        "max_height": max_height,
+        "min_height": min_height,
+        "clip_input": full_check,
+    }
+    if keep_bits_max_error is not None:
+        keep_bits = plan_ztd_keep_bits(
+            ds, keep_bits_max_error, keep_bits_height_edges, **ztd_kwargs
+        )
+        ztd_kwargs["keep_bits"] = keep_bits
+        for name in ("wet_delay", "hydrostatic_delay"):
+            template[name].attrs.update(keep_bits.to_attrs(name))
 
-    # Define output encoding: compression and chunk size
+    # Blocks compute bare arrays, the product metadata is the template's
+    out_ds = _map_ztd_blocks(ds, template, ztd_kwargs, checkpoint_dir, native_threads)
+
+    # Define output encoding: compression and chunk size,
+    # chunks can not exceed the (trimmed) output dimensions
+    out_chunk_size = [
+        min(chunk, size)
+        for chunk, size in zip(out_chunk_size, template.wet_delay.shape)
+    ]
+    encoding = {
+        **get_compression_options(
+            compression_options, check_plugin=output_format == "netcdf"
+        ),
+        "chunksizes": out_chunk_size,
+    }
     encoding = dict.fromkeys(out_ds.data_vars, encoding)
 
-    # Reorder longitude indexes to adjust for 0-360  transform to -180-180
-    out_ds = out_ds.sortby("longitude")
-    logger.debug(f"Output file: {output_file}")
+    # Irregular grids can not be split at 180°, reorder after processing
+    if lon_runs is None:
+        out_ds = out_ds.sortby("longitude")
     logger.debug(
         f"Output chunksize (time, height, latitude, longitude): {out_chunk_size}"
     )
 
-    # Save output to local file
-    out_ds.sel(height=slice(None, max_height)).to_netcdf(
-        output_file, encoding=encoding, mode="w"
+    return out_ds, encoding, validation_stats
+
+
+def write_product(
+    out_ds: xr.Dataset,
+    output_file: str | Path,
+    encoding: dict,
+    validation_stats: Optional[dict] = None,
+    *,
+    output_format: str = "netcdf",
+    zarr_format: int = 2,
+    scheduler: Optional[str] = None,
+) -> Optional[dict]:
+    """Compute and write a product of `build_tropo`.
+
+    The input statistics are computed from the same input blocks as the
+    product. With the local "processes" scheduler, the blocks are computed
+    in the processes and written from this process, as NetCDF write locks
+    can not be shared with a process pool.
+
+    Returns
+    -------
+    dict or None
+        Computed input statistics (None if `validation_stats` is None).
+
+    """
+    if scheduler == "processes":
+        out_ds, validation_stats = dask.compute(out_ds, validation_stats)
+
+    logger.debug(f"Output file: {output_file}")
+    if output_format == "zarr":
+        return write_zarr(
+            out_ds,
+            output_file,
+            encoding=encoding,
+            zarr_format=zarr_format,
+            compute_with=validation_stats,
+        )
+    return write_netcdf(
+        out_ds, output_file, encoding=encoding, compute_with=validation_stats
+    )
+
+
+def report_product_validation(validation_stats: dict, output_file: str | Path) -> None:
+    """Report the input checkup computed while writing `output_file`.
+
+    The checkup runs in the same pass over the input as the product, so a
+    failing input is only detected once the product is written. The
+    product is then removed before raising.
+
+    Raises
+    ------
+    ValidationError
+        If the input fails the checks of `opera_tropo.checks.report_validation`.
+
+    """
+    try:
+        report_validation(validation_stats)
+    except ValidationError:
+        logger.error(f"Removing {output_file}, computed from invalid input.")
+        output_path = Path(output_file)
+        if output_path.is_dir():
+            shutil.rmtree(output_path)
+        else:
+            output_path.unlink(missing_ok=True)
+        raise
+
+
+def tropo(
+    file_path: str,
+    output_file: str,
+    *,
+    max_height: int = 81000,
+    min_height: Optional[int] = None,
+    out_heights: Optional[list[float] | np.ndarray] = None,
+    bbox: Optional[tuple[float, float, float, float]] = None,
+    block_size: list[int] | str = BLOCK_SIZE,
+    column_batch: Optional[int] = None,
+    out_chunk_size: list[int] = OUTPUT_CHUNKS,
+    num_workers: int | str = 4,
+    num_threads: int | str = 2,
+    max_memory: int | str = "16GB",
+    compression_options: dict | str = DEFAULT_COMPRESSION,
+    temp_dir: Optional[str] = None,
+    pre_check: bool = True,
+    check_sample_fraction: Optional[float] = None,
+    engine: str = "raider",
+    keep_bits_max_error: Optional[float] = None,
+    keep_bits_height_edges: Sequence[float] = HEIGHT_BANDS,
+    scheduler: str = "auto",
+    client: Optional[Client] = None,
+    output_format: str = "netcdf",
+    zarr_format: int = 2,
+    checkpoint: bool = False,
+) -> None:
+    """Run troposphere workflow.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the input dataset file.
+    output_file : str
+        Path to the output NetCDF file or Zarr store.
+    max_height : int, optional
+        Maximum height in meters. Default is 81,000.
+    min_height : int, optional
+        Minimum height in meters. Default is None (no lower limit).
+    out_heights : list of int, optional
+        List of output heights. Default is None (using model heights).
+    bbox : tuple of float, optional
+        Bounding box (west, south, east, north) in degrees to process.
+        Default is None (global grid).
+    block_size : list of int or "auto", optional
+        Block size for processing. Default is [128, 256].
+    column_batch : int, optional
+        Maximum number of grid columns per processing block. If set,
+        overrides `block_size` with blocks of whole longitude rows, see
+        `get_column_block_size`. Default is None.
+    out_chunk_size : list of int, optional
+        Chunk size for output data. Default is [1, 8, 512, 512].
+    num_workers : int or "auto", optional
+        Number of parallel workers. Default is 4.
+    num_threads : int or "auto", optional
+        Number of threads per worker. Default is 2.
+    max_memory : int or str, optional
+        Maximum memory allocation, or "auto". Default is '16GB'.
+        Settings given as "auto" are resolved from the container CPU and
+        memory limits and the input size with
+        `opera_tropo.resources.plan_resources`, and the plan is logged.
+    compression_options : dict or str, optional
+        Compression options for the output NetCDF file, or the name of a
+        profile of `opera_tropo.compression.COMPRESSION_PROFILES` ("zlib",
+        "zstd", "blosc-lz4", "blosc-zstd"), resolved with
+        `opera_tropo.compression.get_compression_options`.
+        Default is zlib level 4 with shuffle.
+    temp_dir : str, optional
+        Directory for temporary files. Default is None.
+    pre_check : bool, optional
+        Whether to perform pre-check of input data. Default is True.
+    check_sample_fraction : float, optional
+        Fraction of the input chunks read by a quick pre-check. The full
+        check and clipping of the input, done while processing, are only
+        kept if the sample shows NaNs or out-of-range values.
+        Default is None (always check the whole input).
+    engine : str, optional
+        ZTD engine, "raider" or "native". Default is "raider".
+    keep_bits_max_error : float, optional
+        Largest rounding error of the delays in meters. If given, the
+        mantissa bits kept in each height band are chosen from the bitwise
+        real information of a sample of the delays, with
+        `opera_tropo.core.plan_ztd_keep_bits`, and recorded in the variable
+        attributes. The sampled latitude rows are read and computed before
+        the product, an extra pass over a fraction of the input.
+        Default is None (fixed keep_bits of each variable).
+    keep_bits_height_edges : Sequence[float], optional
+        Edges (m) between the height bands of `keep_bits_max_error`.
+        Default is `opera_tropo.bitinfo.HEIGHT_BANDS`.
+    scheduler : str, optional
+        Dask scheduler: "distributed" starts a local cluster, "threads",
+        "processes" and "synchronous" use the local Dask schedulers with
+        `num_workers` * `num_threads` threads or `num_workers` processes
+        (the product is then held in memory before writing), and "auto"
+        selects one from the input size. Ignored if `client`
+        is given. Default is "auto".
+    client : Client, optional
+        Existing Dask client to run on, kept open after processing.
+        Default is None (start a local cluster for this run only).
+    output_format : str, optional
+        Output format, "netcdf" or "zarr" (consolidated metadata, with the
+        chunking and compression of `out_chunk_size` and
+        `compression_options`). Default is "netcdf".
+    zarr_format : int, optional
+        Zarr format version, 2 or 3. Default is 2.
+    checkpoint : bool, optional
+        Save the finished output blocks under `temp_dir`, in a directory
+        keyed by the input file fingerprint and the product options. A
+        rerun after a failure then only computes the missing blocks. The
+        saved blocks are removed once the output is written.
+        Default is False.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If the input dataset file cannot be opened or processed.
+    ValidationError
+        If an input variable contains only NaN values. No product is kept.
+
+    """
+    logger.info("Calculating TROPO delay")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unknown output format: {output_format}. Choose from {OUTPUT_FORMATS}."
+        )
+
+    # Resolve "auto" resources from the input and the container limits
+    sizes, input_nbytes = inspect_input(file_path, bbox)
+    resources = (num_workers, num_threads, max_memory, block_size)
+    # A given client sets the workers, then only the blocks are planned
+    if (client is None and AUTO in resources) or block_size == AUTO:
+        plan = resolve_resources(sizes, out_heights, engine, *resources, client=client)
+        num_workers, num_threads = plan.n_workers, plan.threads_per_worker
+        max_memory, block_size = plan.max_memory, plan.block_shape
+
+    # Setup Dask Client and temp. directory, or a local scheduler
+    own_client = False
+    local_scheduler = nullcontext()
+    if client is None:
+        scheduler = select_scheduler(scheduler, input_nbytes, max_memory)
+        if scheduler == "distributed":
+            client = start_client(num_workers, num_threads, max_memory, temp_dir)
+            own_client = True
+        else:
+            local_scheduler = get_local_scheduler(scheduler, num_workers, num_threads)
+
+    product_options = {
+        "max_height": max_height,
+        "min_height": min_height,
+        "out_heights": out_heights,
+        "bbox": bbox,
+        "block_size": block_size,
+        "column_batch": column_batch,
+        "pre_check": pre_check,
+        "check_sample_fraction": check_sample_fraction,
+        "engine": engine,
+        "keep_bits_max_error": keep_bits_max_error,
+        "keep_bits_height_edges": keep_bits_height_edges,
+    }
+    checkpoint_dir = None
+    if checkpoint:
+        checkpoint_root = Path(temp_dir or tempfile.gettempdir()) / "checkpoints"
+        checkpoint_dir = open_checkpoint(checkpoint_root, file_path, product_options)
+
+    native_threads = get_task_native_threads(
+        scheduler, num_workers, num_threads, client
     )
+    with local_scheduler:
+        out_ds, encoding, validation_stats = build_tropo(
+            file_path,
+            out_chunk_size=out_chunk_size,
+            compression_options=compression_options,
+            output_format=output_format,
+            checkpoint_dir=checkpoint_dir,
+            native_threads=native_threads,
+            **product_options,
+        )
+
+        validation_stats = write_product(
+            out_ds,
+            output_file,
+            encoding,
+            validation_stats,
+            output_format=output_format,
+            zarr_format=zarr_format,
+            scheduler=scheduler,
+        )
+
+    if checkpoint_dir is not None:
+        shutil.rmtree(checkpoint_dir)
+
     # Close dask Client and remove dask temp. spill directory
-    logger.debug(f"Closing dask server: {client.dashboard_link.split('/')[2]}.")
-    client.close()
-    if temp_dir:
-        logger.debug(f"Removing dask tmp dir: {temp_dir}")
-        shutil.rmtree(str(temp_dir))
+    if own_client:
+        stop_client(client, temp_dir)
+
+    # Report the input checkup, done during processing
+    if validation_stats is not None:
+        logger.info("Input checkup:")
+        report_product_validation(validation_stats, output_file)
@@ -3,9 +3,11 @@ from __future__ import annotations
 import resource
 import sys
 from pathlib import Path
+from typing import Optional
 
 import numpy as np
 import xarray as xr
+from numpy.typing import DTypeLike
 
 
 # This is obsolete
@@ -123,6 +125,224 @@ def get_hres_datetime(file_path: Path):
         raise ValueError(f"Cannot open file {file_path}: {file_error}")
 
 
+def subset_bbox(ds: xr.Dataset, bbox: tuple[float, float, float, float]) -> xr.Dataset:
+    """Subset a 0-360 longitude dataset to a bounding box.
+
+    Longitudes of the box may be given in either the [-180, 180] or the
+    [0, 360] convention. Boxes crossing the 0/360 seam of the input grid
+    (e.g. west=-10, east=10) are assembled from the two sides of the grid,
+    so the output longitudes are contiguous. Boxes crossing the antimeridian
+    are given with west > east in [-180, 180] (e.g. west=170, east=-170).
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset with 'latitude' and 'longitude' (0-360) coordinates.
+    bbox : tuple[float, float, float, float]
+        Bounding box (west, south, east, north) in degrees.
+
+    Returns
+    -------
+    xr.Dataset
+        Lazily subset dataset.
+
+    Raises
+    ------
+    ValueError
+        If the box is invalid or does not contain any grid point.
+
+    """
+    west, south, east, north = bbox
+    if south > north:
+        raise ValueError(f"Invalid bbox {bbox}: south is greater than north.")
+
+    lats = ds.latitude.values
+    (lat_idx,) = np.nonzero((lats >= south) & (lats <= north))
+
+    lons = ds.longitude.values
+    west, east = west % 360, east % 360
+    if bbox[2] - bbox[0] >= 360:
+        lon_idx = [np.arange(lons.size)]
+    elif west <= east:
+        lon_idx = [np.nonzero((lons >= west) & (lons <= east))[0]]
+    else:
+        # Box wraps around the 0/360 seam of the grid
+        lon_idx = [np.nonzero(lons >= west)[0], np.nonzero(lons <= east)[0]]
+    lon_idx = [idx for idx in lon_idx if idx.size > 0]
+
+    if lat_idx.size == 0 or not lon_idx:
+        raise ValueError(f"Bounding box {bbox} does not contain any grid point.")
+
+    lat_slice = slice(lat_idx[0], lat_idx[-1] + 1)
+    parts = [
+        ds.isel(latitude=lat_slice, longitude=slice(idx[0], idx[-1] + 1))
+        for idx in lon_idx
+    ]
+    if len(parts) == 1:
+        return parts[0]
+    return xr.concat(parts, dim="longitude", data_vars="minimal", coords="minimal")
+
+
+def get_longitude_runs(lons: np.ndarray) -> Optional[list[slice]]:
+    """Get the slices of a longitude grid in [-180, 180] ascending order.
+
+    The grid is split where the longitudes, normalized from [0, 360] to
+    [-180, 180], wrap around (e.g. at 180° for a global 0-360 grid). Taking
+    the runs in the returned order gives sorted output longitudes without
+    reordering single grid points.
+
+    Parameters
+    ----------
+    lons : np.ndarray
+        Longitude values (degrees) of the grid.
+
+    Returns
+    -------
+    list[slice] or None
+        Contiguous slices of the grid in output order, or None if the
+        normalized longitudes can not be sorted by reordering whole runs.
+
+    """
+    wrapped = (np.float64(lons) + 180) % 360 - 180
+    breaks = np.nonzero(np.diff(wrapped) < 0)[0] + 1
+    bounds = [0, *breaks, wrapped.size]
+    runs = [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+    runs.sort(key=lambda run: wrapped[run.start])
+
+    ordered = np.concatenate([wrapped[run] for run in runs])
+    if np.any(np.diff(ordered) <= 0):
+        return None
+    return runs
+
+
+def get_disk_chunks(data: xr.DataArray) -> dict[str, int]:
+    """Get the on-disk (HDF5) chunk shape of a variable opened by xarray.
+
+    Contiguous variables are reported as a single chunk per dimension.
+    """
+    preferred = data.encoding.get("preferred_chunks") or {}
+    return {dim: int(preferred.get(dim, data.sizes[dim])) for dim in data.dims}
+
+
+def align_block_size(
+    block_size: list[int], disk_chunks: list[int], sizes: list[int]
+) -> list[int]:
+    """Round a block size down to whole disk chunks.
+
+    Blocks smaller than a disk chunk are kept, as growing them to the disk
+    chunk could exceed the memory planned for a block, and so are blocks
+    spanning the whole dimension.
+
+    Parameters
+    ----------
+    block_size : list[int]
+        Requested block size along each dimension.
+    disk_chunks : list[int]
+        Disk chunk size along each dimension.
+    sizes : list[int]
+        Size of each dimension.
+
+    Returns
+    -------
+    list[int]
+        Block size, a multiple of the disk chunk where possible.
+
+    """
+    return [
+        block // chunk * chunk if chunk <= block < size else block
+        for block, chunk, size in zip(block_size, disk_chunks, sizes)
+    ]
+
+
+def get_aligned_chunks(positions: np.ndarray, block: int) -> tuple[int, ...]:
+    """Split a dimension into chunks with edges at multiples of `block` in the file.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Index in the file of each element of the (subset) dimension.
+    block : int
+        Block size, in file elements.
+
+    Returns
+    -------
+    tuple[int, ...]
+        Dask chunk sizes of the dimension. Chunks also end where the
+        positions are not contiguous in the file.
+
+    """
+    positions = np.asarray(positions)
+    breaks = (np.diff(positions) != 1) | (positions[1:] % block == 0)
+    bounds = [0, *(np.nonzero(breaks)[0] + 1), positions.size]
+    return tuple(int(size) for size in np.diff(bounds))
+
+
+def get_read_amplification(
+    positions: dict[str, np.ndarray],
+    chunks: dict[str, tuple[int, ...]],
+    disk_chunks: dict[str, int],
+) -> float:
+    """Get the number of blocks reading each disk chunk, on average.
+
+    Parameters
+    ----------
+    positions : dict[str, np.ndarray]
+        Index in the file of each element of the dimensions.
+    chunks : dict[str, tuple[int, ...]]
+        Block (Dask chunk) sizes of the dimensions.
+    disk_chunks : dict[str, int]
+        Disk chunk size of the dimensions.
+
+    Returns
+    -------
+    float
+        Number of disk chunk reads by all blocks, divided by the number
+        of disk chunks read. 1 if every disk chunk is read by one block.
+
+    """
+    amplification = 1.0
+    for dim, sizes in chunks.items():
+        disk_index = np.asarray(positions[dim]) // disk_chunks[dim]
+        bounds = np.cumsum([0, *sizes])
+        n_reads = sum(
+            np.unique(disk_index[start:stop]).size
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        )
+        amplification *= n_reads / np.unique(disk_index).size
+    return amplification
+
+
+def get_height_mask(
+    heights: np.ndarray,
+    min_height: Optional[float] = None,
+    max_height: Optional[float] = None,
+) -> np.ndarray:
+    """Get a mask of the heights within [min_height, max_height].
+
+    Parameters
+    ----------
+    heights : np.ndarray
+        Height values (m).
+    min_height : float, optional
+        Minimum height to keep (inclusive). Default is None (no lower limit).
+    max_height : float, optional
+        Maximum height to keep (inclusive). Default is None (no upper limit).
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask of the heights to keep.
+
+    """
+    heights = np.asarray(heights)
+    mask = np.ones(heights.shape, dtype=bool)
+    if min_height is not None:
+        mask &= heights >= min_height
+    if max_height is not None:
+        mask &= heights <= max_height
+    return mask
+
+
 # Round_mantissa function from
 # https://github.com/isce-framework/dolphin/blob/ee4271fa6e085168587cb96f977b1617a75304e1/src/dolphin/io/_utils.py#L244
 def round_mantissa(z: np.ndarray, keep_bits: int = 10):
@@ -181,6 +401,97 @@ def round_mantissa(z: np.ndarray, keep_bits: int = 10):
     b &= mask
 
 
+# Elements cast and rounded at once by `cast_round_mantissa`, sized for the CPU cache
+ROUND_BLOCK_SIZE = 2**16
+
+
+def _iter_slabs(shape: tuple[int, ...], max_size: int):
+    """Yield the indices of C-order slabs of at most `max_size` elements.
+
+    Slabs hold at least one element of the leading axes, so can be larger
+    than `max_size` if the last axis is.
+    """
+    inner = 1
+    axis = len(shape)
+    while axis > 0 and inner * shape[axis - 1] <= max_size:
+        inner *= shape[axis - 1]
+        axis -= 1
+    if axis == 0:
+        yield ()
+        return
+    step = max(1, max_size // inner)
+    for index in np.ndindex(*shape[: axis - 1]):
+        for start in range(0, shape[axis - 1], step):
+            yield (*index, slice(start, start + step))
+
+
+def cast_round_mantissa(
+    z: np.ndarray,
+    dtype: DTypeLike = np.float32,
+    keep_bits: int = 10,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Cast a float array and round its mantissa in one pass.
+
+    Gives the same bits as `z.astype(dtype)` followed by `round_mantissa`,
+    but processes `ROUND_BLOCK_SIZE` elements at a time with preallocated
+    scratch, instead of making full-size cast and integer temporaries.
+    As with `astype`, values beyond the range of `dtype` become +/-inf,
+    with a numpy "overflow encountered in cast" RuntimeWarning.
+
+    Parameters
+    ----------
+    z : numpy.ndarray
+        Real float array to cast and round.
+    dtype : DTypeLike, optional
+        Float output type. Default is float32.
+    keep_bits : int, optional
+        Number of bits to preserve in the mantissa. Defaults to 10.
+    out : numpy.ndarray, optional
+        Array with the shape of `z` and type `dtype` to write to, which
+        can be a strided view. Default is None (allocate a new array).
+
+    Returns
+    -------
+    numpy.ndarray
+        Cast and rounded array, `out` if given.
+
+    """
+    dtype = np.dtype(dtype)
+    if z.dtype.kind != "f" or dtype.kind != "f" or dtype.itemsize > 8:
+        raise TypeError("Only float arrays (16-64bit) can be bit-rounded")
+    bits = np.finfo(dtype).nmant
+    if keep_bits > bits:
+        raise ValueError("keep_bits too large for given dtype")
+    if out is None:
+        out = np.empty(z.shape, dtype=dtype)
+    elif out.shape != z.shape or out.dtype != dtype:
+        raise ValueError(f"out must have shape {z.shape} and type {dtype}")
+
+    int_dtype = np.dtype(dtype.str.replace("f", "i"))
+    maskbits = bits - keep_bits
+    mask = (np.array(-1, dtype=int_dtype) >> maskbits) << maskbits
+    half_quantum1 = int_dtype.type((1 << (maskbits - 1)) - 1) if maskbits else 0
+    scratch = np.empty(ROUND_BLOCK_SIZE, dtype=int_dtype)
+
+    for index in _iter_slabs(z.shape, ROUND_BLOCK_SIZE):
+        slab = out[index]
+        np.copyto(slab, z[index], casting="same_kind")
+        if not maskbits:
+            continue
+        b = slab.view(int_dtype)
+        if b.size > scratch.size:
+            scratch = np.empty(b.size, dtype=int_dtype)
+        tmp = scratch[: b.size].reshape(b.shape)
+        # b += ((b >> maskbits) & 1) + half_quantum1; b &= mask
+        np.right_shift(b, maskbits, out=tmp)
+        np.bitwise_and(tmp, 1, out=tmp)
+        np.add(tmp, half_quantum1, out=tmp)
+        np.add(b, tmp, out=b)
+        np.bitwise_and(b, mask, out=b)
+    return out
+
+
 def _round_mantissa_xr(data, keep_bits=10):
     """Round the mantissa of a floating-point xarray DataArray.
 
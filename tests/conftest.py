@@ -2,6 +2,7 @@ import pickle
 from pathlib import Path
 
 import numpy as np
+import pandas as pd
 import pytest
 import xarray as xr
 from RAiDER.models import HRES
@@ -66,3 +67,43 @@ def init_raider(load_input_model):
     # Create latitude and longitude grid
     hres_model._lons, hres_model._lats = np.meshgrid(longitude, latitude)
     return hres_model
+
+
+def make_hres_dataset(
+    n_lat: int = 16, n_lon: int = 32, n_time: int = 1, seed: int = 0
+) -> xr.Dataset:
+    """Make a synthetic HRES model-level dataset on a 0.5° grid."""
+    rng = np.random.default_rng(seed)
+    shape = (n_time, 137, n_lat, n_lon)
+    eta = np.arange(1, 138) / 137
+    t = 210 + 80 * eta[:, None, None] ** 1.5 + rng.normal(0, 1, shape)
+    q = 0.015 * np.exp(-(1 - eta[:, None, None]) * 12) * (1 + 0.2 * rng.random(shape))
+    z = np.broadcast_to(rng.uniform(0, 20000, (n_time, 1, n_lat, n_lon)), shape)
+    lnsp = np.broadcast_to(
+        np.log(rng.uniform(80000, 102000, (n_time, 1, n_lat, n_lon))), shape
+    )
+    dims = ("time", "level", "latitude", "longitude")
+    return xr.Dataset(
+        {
+            name: (dims, data.astype(np.float32))
+            for name, data in zip(("t", "q", "z", "lnsp"), (t, q, z, lnsp))
+        },
+        coords={
+            "time": pd.date_range("2024-01-01", periods=n_time, freq="6h"),
+            "level": np.arange(1, 138, dtype=np.int32),
+            "latitude": 40 - 0.5 * np.arange(n_lat),
+            "longitude": 0.5 * np.arange(n_lon),
+        },
+    )
+
+
+@pytest.fixture(scope="session")
+def hres_file(tmp_path_factory) -> Path:
+    """Write a synthetic HRES file, chunked as the ECMWF files on disk."""
+    file_path = tmp_path_factory.mktemp("hres") / "hres.nc"
+    ds = make_hres_dataset()
+    encoding = {
+        name: {"chunksizes": (1, 137, 8, 16), "zlib": True} for name in ds.data_vars
+    }
+    ds.to_netcdf(file_path, engine="h5netcdf", encoding=encoding)
+    return file_path
@@ -0,0 +1,98 @@
+import pytest
+import xarray as xr
+
+from opera_tropo.batch import tropo_many
+from opera_tropo.config.pge_runconfig import RunConfig
+from opera_tropo.config.runconfig import TropoWorkflow
+from opera_tropo.main import _get_product_options, run, run_batch
+from opera_tropo.run import tropo
+
+
+@pytest.fixture
+def workflow(tmp_path) -> TropoWorkflow:
+    return TropoWorkflow(
+        work_directory=tmp_path,
+        output_directory=tmp_path / "output",
+        output_options={"chunk_size": (1, 16, 8, 16)},
+        worker_settings={"engine": "native", "block_shape": (8, 16)},
+    )
+
+
+@pytest.mark.parametrize("scheduler", ["threads", "synchronous", "distributed"])
+def test_tropo_many_scheduler(tmp_path, hres_file, workflow, scheduler):
+    options = _get_product_options(workflow)
+    expected_file = tmp_path / "expected.nc"
+    tropo(str(hres_file), str(expected_file), scheduler="synchronous", **options)
+
+    output_files = [tmp_path / "first.nc", tmp_path / "second.nc"]
+    reports = tropo_many(
+        [hres_file, hres_file],
+        output_files,
+        num_workers=1,
+        num_threads=2,
+        max_memory="1GB",
+        scheduler=scheduler,
+        **options,
+    )
+    assert sorted(report["output"] for report in reports) == list(
+        map(str, output_files)
+    )
+    with xr.open_dataset(expected_file) as expected:
+        for output_file in output_files:
+            with xr.open_dataset(output_file) as out:
+                xr.testing.assert_identical(out.drop_attrs(), expected.drop_attrs())
+
+
+def test_run_batch(tmp_path, hres_file, workflow):
+    workflow.worker_settings.scheduler = "threads"
+    workflow.worker_settings.checkpoint = True
+    workflow.worker_settings.dask_temp_dir = tmp_path / "tmp"
+    reports = run_batch(workflow, [hres_file])
+
+    (output_file,) = (workflow.output_directory).glob("*.nc")
+    assert reports[0]["output"] == str(output_file)
+    assert output_file.with_suffix(".png").exists()
+    # Saved blocks are removed once the product is written
+    assert not any((tmp_path / "tmp" / "checkpoints").iterdir())
+
+
+def test_run_min_height(hres_file, workflow):
+    # Heights from 500 m, without the 0 m level of the browse image
+    workflow.input_options.input_file_path = hres_file
+    workflow.output_options.min_height = 500
+    workflow.worker_settings.scheduler = "threads"
+    run(workflow, RunConfig())
+
+    (output_file,) = (workflow.output_directory).glob("*.nc")
+    with xr.open_dataset(output_file) as out:
+        assert out.height.min() >= 500
+    assert output_file.with_suffix(".png").exists()
+
+
+@pytest.mark.parametrize("scheduler", ["threads", "distributed"])
+def test_tropo_many_failed_file(tmp_path, hres_file, workflow, scheduler):
+    # Input without temperatures, failing the input checkup
+    invalid_file = tmp_path / "invalid.nc"
+    with xr.open_dataset(hres_file) as ds:
+        ds.assign(t=ds.t * float("nan")).to_netcdf(invalid_file, engine="h5netcdf")
+    input_files = [invalid_file, tmp_path / "missing.nc", hres_file]
+    output_files = [tmp_path / f"out_{i}.nc" for i in range(3)]
+
+    reports = tropo_many(
+        input_files,
+        output_files,
+        num_workers=1,
+        num_threads=2,
+        max_memory="1GB",
+        scheduler=scheduler,
+        **_get_product_options(workflow),
+    )
+    status = {report["input"]: report["status"] for report in reports}
+    assert status == {
+        str(invalid_file): "failed",
+        str(tmp_path / "missing.nc"): "failed",
+        str(hres_file): "succeeded",
+    }
+    for report in reports:
+        assert (report["error"] is None) == (report["status"] == "succeeded")
+    assert [f.exists() for f in output_files] == [False, False, True]
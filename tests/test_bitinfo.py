@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from opera_tropo._pack import pack_delays
+from opera_tropo.bitinfo import (
+    BandKeepBits,
+    get_bit_information,
+    get_error_bits,
+    get_information_bits,
+    plan_keep_bits,
+)
+from opera_tropo.utils import cast_round_mantissa
+
+
+@pytest.fixture
+def delays():
+    # Smooth delays decreasing with height, with small-scale noise
+    rng = np.random.default_rng(0)
+    heights = np.linspace(0, 40000, 41)
+    lon = np.linspace(0, 2 * np.pi, 200)
+    lat = np.linspace(-1, 1, 6)
+    field = 1 + 0.2 * np.sin(lon) * np.cos(lat)[:, None]
+    wet = 0.3 * field[None, :, :, None] * np.exp(-heights / 2000)
+    hydrostatic = 2.3 * field[None, :, :, None] * np.exp(-heights / 8000)
+    wet = wet * (1 + 1e-4 * rng.normal(size=wet.shape))
+    return {"wet_delay": wet, "hydrostatic_delay": hydrostatic}, heights
+
+
+def test_get_bit_information():
+    rng = np.random.default_rng(0)
+    noise = rng.uniform(1, 2, size=(100, 1000)).astype(np.float32)
+    smooth = (1 + np.sin(np.linspace(0, 10, 100_000))).astype(np.float32)
+
+    noise_info = get_bit_information(noise)
+    assert noise_info.shape == (32,)
+    # Random mantissa bits carry no information
+    assert np.all(noise_info[9:] == 0)
+    assert get_information_bits(noise_info) == 0
+    assert get_information_bits(get_bit_information(smooth)) > 5
+
+    # NaN pairs are ignored
+    smooth[::7] = np.nan
+    assert get_bit_information(smooth).sum() > 0
+
+
+def test_get_error_bits():
+    rng = np.random.default_rng(0)
+    data = rng.uniform(-3, 3, size=10_000).astype(np.float32)
+    max_abs = float(np.abs(data).max())
+    for max_error in [1e-2, 2.5e-4, 1e-5]:
+        bits = get_error_bits(max_abs, max_error)
+        error = np.abs(cast_round_mantissa(data, np.float32, bits) - data).max()
+        assert error <= max_error
+        # One bit less exceeds the error bound
+        error = np.abs(cast_round_mantissa(data, np.float32, bits - 1) - data).max()
+        assert error > max_error
+    assert get_error_bits(0.0, 1e-3) == 0
+    assert get_error_bits(np.nan, 1e-3) == 0
+
+
+def test_plan_keep_bits(delays):
+    delays, heights = delays
+    max_bits = {"wet_delay": 10, "hydrostatic_delay": 12}
+    keep_bits = plan_keep_bits(
+        delays, heights, max_bits, height_edges=[3000, 15000], max_error=2.5e-4
+    )
+    assert keep_bits.height_edges == (3000.0, 15000.0)
+    for name, bits in keep_bits.keep_bits.items():
+        assert len(bits) == 3
+        assert all(0 <= b <= max_bits[name] for b in bits)
+    # Fewer bits for the small wet delays at the top
+    assert keep_bits.keep_bits["wet_delay"][-1] < keep_bits.keep_bits["wet_delay"][0]
+
+    attrs = keep_bits.to_attrs("wet_delay")
+    np.testing.assert_array_equal(attrs["keep_bits"], keep_bits.keep_bits["wet_delay"])
+    np.testing.assert_array_equal(attrs["keep_bits_height_edges"], [3000, 15000])
+    assert attrs["max_quantization_error"] == 2.5e-4
+
+    with pytest.raises(ValueError, match="max_error"):
+        plan_keep_bits(delays, heights, max_bits, max_error=0)
+
+
+@pytest.mark.parametrize("max_error", [2.5e-4, 1e-6])
+def test_pack_delays_band_keep_bits(delays, max_error):
+    delays, heights = delays
+    wet, hydrostatic = delays["wet_delay"], delays["hydrostatic_delay"]
+    # Planned bits too few for the error bound, raised in the packed blocks
+    keep_bits = BandKeepBits(
+        (3000.0, 15000.0),
+        {"wet_delay": (0, 0, 0), "hydrostatic_delay": (0, 0, 0)},
+        max_error,
+    )
+    packed_wet, packed_hydrostatic, zs = pack_delays(
+        wet, hydrostatic, heights, keep_bits=keep_bits, max_height=30000
+    )
+    height_mask = heights <= 30000
+    np.testing.assert_array_equal(zs, heights[height_mask])
+    for packed, data in [(packed_wet, wet), (packed_hydrostatic, hydrostatic)]:
+        data = data[..., height_mask].transpose(0, 3, 1, 2)
+        assert packed.dtype == np.float32
+        assert np.abs(packed - data).max() <= max_error
+
+    # Same as writing to a preallocated output
+    out = np.empty((2, *packed_wet.shape), dtype=np.float32)
+    pack_delays(
+        wet, hydrostatic, heights, keep_bits=keep_bits, max_height=30000, out=out
+    )
+    np.testing.assert_array_equal(out[0], packed_wet)
+    np.testing.assert_array_equal(out[1], packed_hydrostatic)
@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from opera_tropo import run
+from opera_tropo._checkpoint import open_checkpoint, run_checkpointed
+from opera_tropo.core import calculate_ztd_block
+
+
+def test_run_checkpointed(tmp_path):
+    calls: list = []
+
+    def _double(data):
+        calls.append(1)
+        return data * 2
+
+    data = np.arange(6.0).reshape(2, 3)
+    first = run_checkpointed(_double, tmp_path, "block.npy", data)
+    second = run_checkpointed(_double, tmp_path, "block.npy", data)
+    assert len(calls) == 1
+    np.testing.assert_array_equal(first, second)
+
+
+def test_checkpoint_resume(tmp_path, hres_file, monkeypatch):
+    options = {
+        "block_size": [8, 16],
+        "out_chunk_size": [1, 16, 8, 16],
+        "engine": "native",
+        "scheduler": "synchronous",
+    }
+    expected_file = tmp_path / "expected.nc"
+    run.tropo(str(hres_file), str(expected_file), **options)
+
+    # Interrupt the run after two of the four blocks
+    calls = {"count": 0, "limit": 2}
+
+    def _interrupted_block(*args, **kwargs):
+        if calls["count"] == calls["limit"]:
+            raise RuntimeError("interrupted")
+        calls["count"] += 1
+        return calculate_ztd_block(*args, **kwargs)
+
+    monkeypatch.setattr(run, "calculate_ztd_block", _interrupted_block)
+    temp_dir = tmp_path / "tmp"
+    output_file = tmp_path / "output.nc"
+    with pytest.raises(RuntimeError, match="interrupted"):
+        run.tropo(
+            str(hres_file),
+            str(output_file),
+            temp_dir=str(temp_dir),
+            checkpoint=True,
+            **options,
+        )
+    (checkpoint_dir,) = (temp_dir / "checkpoints").iterdir()
+    assert len(list(checkpoint_dir.glob("*.npy"))) == 2
+
+    # The rerun only computes the missing blocks
+    calls.update(count=0, limit=None)
+    run.tropo(
+        str(hres_file),
+        str(output_file),
+        temp_dir=str(temp_dir),
+        checkpoint=True,
+        **options,
+    )
+    assert calls["count"] == 2
+    assert not checkpoint_dir.exists()
+    with xr.open_dataset(output_file) as out, xr.open_dataset(expected_file) as exp:
+        xr.testing.assert_identical(out.drop_attrs(), exp.drop_attrs())
+
+
+def test_open_checkpoint(tmp_path):
+    input_file = tmp_path / "input.nc"
+    input_file.write_bytes(b"data")
+    root = tmp_path / "checkpoints"
+    checkpoint_dir = open_checkpoint(root, input_file, {"out_heights": None})
+    assert (checkpoint_dir / "manifest.json").exists()
+    assert open_checkpoint(root, input_file, {"out_heights": None}) == checkpoint_dir
+    assert open_checkpoint(root, input_file, {"out_heights": [0]}) != checkpoint_dir
+
+    input_file.write_bytes(b"other data")
+    assert open_checkpoint(root, input_file, {"out_heights": None}) != checkpoint_dir
+
+
+def test_open_checkpoint_removes_interrupted_saves(tmp_path):
+    input_file = tmp_path / "input.nc"
+    input_file.write_bytes(b"data")
+    root = tmp_path / "checkpoints"
+    checkpoint_dir = open_checkpoint(root, input_file, {})
+    np.save(checkpoint_dir / "block_a.npy", np.zeros(2))
+    # Save of a worker killed before renaming the file
+    (checkpoint_dir / "block_b.1234.tmp").write_bytes(b"partial")
+
+    assert open_checkpoint(root, input_file, {}) == checkpoint_dir
+    assert sorted(path.name for path in checkpoint_dir.iterdir()) == [
+        "block_a.npy",
+        "manifest.json",
+    ]
+
+
+def test_run_checkpointed_tmp_removed(tmp_path, monkeypatch):
+    # A run resuming from the same checkpoint removes the file being saved
+    save = np.save
+
+    def _save_removed(f, out):
+        save(f, out)
+        os.unlink(f.name)
+
+    monkeypatch.setattr(np, "save", _save_removed)
+    out = run_checkpointed(np.negative, tmp_path, "block.npy", np.ones(3))
+    np.testing.assert_array_equal(out, -np.ones(3))
+    assert not any(tmp_path.iterdir())
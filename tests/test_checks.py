@@ -0,0 +1,104 @@
+import dask
+import numpy as np
+import pytest
+import xarray as xr
+
+from opera_tropo.checks import (
+    ValidationError,
+    clip_valid_range,
+    get_sampled_stats,
+    get_validation_stats,
+    report_validation,
+    sample_check,
+    validate_input,
+)
+
+
+@pytest.fixture
+def input_ds() -> xr.Dataset:
+    rng = np.random.default_rng(0)
+    shape = (1, 4, 5, 6)
+    ds = xr.Dataset(
+        {
+            "t": (
+                ("time", "level", "latitude", "longitude"),
+                rng.uniform(200, 300, shape),
+            ),
+            "q": (
+                ("time", "level", "latitude", "longitude"),
+                rng.uniform(0, 0.01, shape),
+            ),
+            "z": (
+                ("time", "level", "latitude", "longitude"),
+                rng.uniform(0, 1e4, shape),
+            ),
+            "lnsp": (
+                ("time", "level", "latitude", "longitude"),
+                rng.uniform(11, 11.5, shape),
+            ),
+        },
+        coords={
+            "time": np.array(["2024-01-01"], dtype="datetime64[ns]"),
+            "level": np.arange(1, 5),
+            "latitude": np.linspace(40, 38, 5),
+            "longitude": np.linspace(0, 2.5, 6),
+        },
+    ).astype(np.float32)
+    ds.t[0, 1, 2, 3] = 400
+    ds.q[0, 2, 1, 1] = -1e-4
+    ds.t[0, 0, 0, 0] = np.nan
+    return ds
+
+
+@pytest.mark.parametrize("nan_q", [False, True])
+def test_clip_valid_range(input_ds, nan_q):
+    if nan_q:
+        # NaN humidity is set to 0 with the negative values
+        input_ds.q[0, 3, 4, 5] = np.nan
+    expected = validate_input(input_ds.copy(deep=True).chunk())
+    xr.testing.assert_identical(clip_valid_range(input_ds), expected.compute())
+    assert not clip_valid_range(input_ds).q.isnull().any()
+
+
+def test_report_validation(input_ds):
+    (stats,) = dask.compute(get_validation_stats(input_ds.chunk({"latitude": 2})))
+    assert stats["t"][2] == 1
+
+    out_range = report_validation(stats)
+    assert set(out_range) == {"t", "q"}
+    assert out_range["t"][1] == 400
+
+    stats["lnsp"] = (np.nan, np.nan, 30)
+    with pytest.raises(ValidationError):
+        report_validation(stats)
+
+
+@pytest.mark.parametrize("method", ["strided", "random"])
+def test_sampled_stats(input_ds, method):
+    ds = input_ds.chunk({"latitude": 1})
+    full = get_sampled_stats(ds, 1.0, method)
+    (expected,) = dask.compute(get_validation_stats(ds))
+    for var, (min_val, max_val, nan_count) in full.items():
+        np.testing.assert_allclose([min_val, max_val], expected[var][:2])
+        assert nan_count == expected[var][2]
+
+    # The invalid t values are in latitude rows 0 and 2, not in the last one
+    stats = get_sampled_stats(ds, 0.2, method, seed=0)
+    assert stats["t"][2] <= 1
+    if method == "strided":
+        assert stats["t"][2] == 1
+        assert stats["t"][1] < 400
+
+
+def test_validate_input_sampled(input_ds):
+    clean = input_ds.copy(deep=True)
+    clean["t"] = clean.t.fillna(250).clip(max=300)
+    clean["q"] = clean.q.clip(min=0)
+    assert sample_check(clean.chunk({"latitude": 1}), 0.5)
+    out = validate_input(clean.chunk({"latitude": 1}), sample_fraction=0.5)
+    xr.testing.assert_identical(out.compute(), clean)
+
+    # Issues found in the sample fall back to the full check and clipping
+    expected = validate_input(input_ds.copy(deep=True).chunk())
+    out = validate_input(input_ds.copy(deep=True).chunk(), sample_fraction=0.5)
+    xr.testing.assert_identical(out.compute(), expected.compute())
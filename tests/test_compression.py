@@ -0,0 +1,168 @@
+import h5py
+import numpy as np
+import pytest
+import xarray as xr
+
+from opera_tropo._writer import write_netcdf, write_zarr
+from opera_tropo.compression import (
+    COMPRESSION_PROFILES,
+    _get_chunk_encoder,
+    bench_encoding,
+    compare_compression,
+    get_compression_options,
+)
+from opera_tropo.run import build_tropo
+
+# HDF5 filter IDs of the profiles
+FILTER_IDS = {"zlib": 1, "zstd": 32015, "blosc-lz4": 32001, "blosc-zstd": 32001}
+
+
+def _skip_unsupported(profile):
+    try:
+        get_compression_options(profile)
+    except ValueError:
+        pytest.skip(f"{profile} filter plugin not available")
+
+
+@pytest.fixture
+def dataset() -> xr.Dataset:
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(1, 10, 21, 37)).astype(np.float32)
+    data[0, 0, 0, :5] = np.nan
+    dims = ("time", "height", "latitude", "longitude")
+    ds = xr.Dataset(
+        {"wet_delay": (dims, data, {"units": "m", "_FillValue": 9.96921e36})},
+        coords={"height": np.arange(10.0), "latitude": np.arange(21.0)},
+    )
+    return ds.chunk({"height": 4, "latitude": 7, "longitude": 10})
+
+
+def test_get_compression_options():
+    assert get_compression_options() == COMPRESSION_PROFILES["zlib"]
+    assert get_compression_options("zlib") == COMPRESSION_PROFILES["zlib"]
+    # Plain options update the zlib profile
+    assert get_compression_options({"complevel": 9}) == {
+        "zlib": True,
+        "complevel": 9,
+        "shuffle": True,
+    }
+    # Profile overrides
+    assert get_compression_options({"profile": "zlib", "shuffle": False}) == {
+        "zlib": True,
+        "complevel": 4,
+        "shuffle": False,
+    }
+    with pytest.raises(ValueError, match="Unknown compression profile"):
+        get_compression_options("lzma")
+
+
+@pytest.mark.parametrize("profile", list(COMPRESSION_PROFILES))
+def test_write_profile(tmp_path, dataset, profile):
+    _skip_unsupported(profile)
+    output_file = tmp_path / "output.nc"
+    encoding = {**get_compression_options(profile), "chunksizes": (1, 3, 8, 16)}
+    write_netcdf(dataset, output_file, encoding={"wet_delay": encoding})
+
+    with xr.open_dataset(output_file) as out:
+        xr.testing.assert_equal(out, dataset.compute())
+    with h5py.File(output_file, "r") as hf:
+        plist = hf["wet_delay"].id.get_create_plist()
+        filters = [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+    assert FILTER_IDS[profile] in filters
+
+
+@pytest.mark.parametrize("profile", ["zstd", "blosc-zstd"])
+def test_write_zarr_profile(tmp_path, dataset, profile):
+    pytest.importorskip("zarr")
+    # Encoded with numcodecs, without the netCDF4 filter plugins
+    options = get_compression_options(profile, check_plugin=False)
+    encoding = {**options, "chunksizes": (1, 3, 8, 16)}
+    store = tmp_path / "output.zarr"
+    write_zarr(dataset, store, {"wet_delay": encoding})
+
+    with xr.open_zarr(store) as out:
+        xr.testing.assert_equal(out.compute(), dataset.compute())
+
+
+def test_compare_compression(tmp_path, dataset):
+    product_file = tmp_path / "product.nc"
+    encoding = {"zlib": True, "chunksizes": (1, 3, 8, 16)}
+    dataset.to_netcdf(product_file, encoding={"wet_delay": encoding})
+
+    profiles = ["zlib", "zstd"]
+    _skip_unsupported("zstd")
+    reports = compare_compression(product_file, profiles, work_dir=tmp_path)
+    assert [report["profile"] for report in reports] == profiles
+    for report in reports:
+        assert report["size"] > 0
+        for key in ["encode_mb_s", "write_mb_s", "decode_mb_s"]:
+            assert report[key] > 0
+    # Temporary copies are removed
+    assert sorted(tmp_path.iterdir()) == [product_file]
+
+
+@pytest.mark.parametrize("profile", list(COMPRESSION_PROFILES))
+def test_get_chunk_encoder(tmp_path, dataset, profile):
+    # Chunks encoded as stored by the HDF5 filters
+    _skip_unsupported(profile)
+    output_file = tmp_path / "output.nc"
+    options = get_compression_options(profile)
+    encoding = {**options, "chunksizes": (1, 10, 21, 37)}
+    # Rounded as the products, compressible by all filters
+    ds = dataset.compute().round(2).fillna(9.96921e36)
+    ds.to_netcdf(output_file, encoding={"wet_delay": encoding})
+
+    with h5py.File(output_file, "r") as hf:
+        _, stored = hf["wet_delay"].id.read_direct_chunk((0, 0, 0, 0))
+    assert _get_chunk_encoder(options)(ds.wet_delay.values) == stored
+
+
+def test_bench_encoding(tmp_path, dataset):
+    product_file = tmp_path / "product.nc"
+    dataset.to_netcdf(product_file)
+
+    reports = bench_encoding(
+        product_file,
+        chunk_shapes=[(1, 4, 8, 8), (1, 10, 64, 64)],
+        profiles=["zlib"],
+        keep_bits=[None, 4],
+        n_reads=2,
+        window=8,
+        dem_max_height=5,
+        sort_by="size",
+        work_dir=tmp_path,
+    )
+    assert len(reports) == 4
+    sizes = [report["size"] for report in reports]
+    assert sizes == sorted(sizes)
+    # Chunks are clipped to the product shape
+    assert {report["chunks"] for report in reports} == {
+        (1, 4, 8, 8),
+        (1, 10, 21, 37),
+    }
+    # Rounding to 4 bits is within half a unit of the last kept bit
+    max_value = float(np.abs(dataset.wet_delay).max())
+    for report in reports:
+        if report["keep_bits"] is None:
+            assert report["max_error"] == 0
+        else:
+            assert 0 < report["max_error"] <= 2**-5 * max_value
+        for key in ["encode_s", "write_s", "map_ms", "column_ms", "cube_ms"]:
+            assert report[key] > 0
+    with pytest.raises(ValueError, match="Unknown sort key"):
+        bench_encoding(product_file, sort_by="speed")
+
+
+def test_zarr_output_without_plugin(monkeypatch, hres_file):
+    netCDF4 = pytest.importorskip("netCDF4")
+    monkeypatch.setattr(netCDF4, "__has_zstandard_support__", False)
+    with pytest.raises(ValueError, match="not supported by the netCDF4 library"):
+        build_tropo(str(hres_file), compression_options="zstd", engine="native")
+    # Zarr stores are encoded without the netCDF4 filter plugins
+    _, encoding, _ = build_tropo(
+        str(hres_file),
+        compression_options="zstd",
+        output_format="zarr",
+        engine="native",
+    )
+    assert encoding["wet_delay"]["compression"] == "zstd"
@@ -0,0 +1,22 @@
+import numpy as np
+import xarray as xr
+from numpy.testing import assert_allclose
+
+from opera_tropo._interp import get_height_weights, interpolate_heights
+
+
+def test_height_weights_match_cubic_interp():
+    rng = np.random.default_rng(0)
+    heights = np.cumsum(rng.uniform(10, 1000, size=60))
+    profiles = np.cumsum(rng.random((4, 5, heights.size)), axis=-1)[..., ::-1]
+    out_heights = [heights[0] - 1, heights[0], 500.0, 12345.6, heights[-1]]
+
+    ds = xr.DataArray(profiles, dims=("y", "x", "height"), coords={"height": heights})
+    expected = ds.interp(height=out_heights, method="cubic").values
+
+    weights = get_height_weights(heights, out_heights)
+    assert weights.shape == (len(out_heights), heights.size)
+    out = interpolate_heights(profiles, weights)
+    assert_allclose(out, expected, rtol=1e-12)
+    # Targets below the source heights are NaN
+    assert np.isnan(out[..., 0]).all()
@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+import xarray as xr
+from numpy.testing import assert_allclose, assert_array_equal
+from scipy.interpolate import interp1d
+
+from opera_tropo.core import calculate_ztd
+from opera_tropo.points import _get_lon_nodes, compute_point_delays
+
+
+def test_point_delays_at_grid_nodes(load_input_model, tmp_path):
+    ds = load_input_model
+    hres_file = tmp_path / "hres.nc"
+    ds.to_netcdf(hres_file, engine="h5netcdf")
+
+    expected = calculate_ztd(ds, engine="native", chunk_size=None, keep_bits=False)
+    heights = expected.height.values
+
+    rng = np.random.default_rng(0)
+    ilat = rng.integers(0, ds.sizes["latitude"], size=10)
+    ilon = rng.integers(0, ds.sizes["longitude"], size=10)
+    iheight = rng.integers(0, heights.size - 1, size=10)
+    points = np.stack(
+        [
+            ds.latitude.values[ilat],
+            ds.longitude.values[ilon],
+            heights[iheight],
+        ],
+        axis=-1,
+    )
+
+    out = compute_point_delays(hres_file, points)
+    for name in ["wet_delay", "hydrostatic_delay"]:
+        grid = expected[name].isel(time=0).values[iheight, ilat, ilon]
+        assert_allclose(out[name].isel(time=0).values, grid, rtol=1e-6)
+
+
+def _get_off_node_points(lats, lons, point_heights):
+    # Points between the nodes (2, 3) and (3, 4), a quarter of the way in
+    # latitude and 3/5 in longitude
+    lat = lats[2] + 0.25 * (lats[3] - lats[2])
+    lon = lons[3] + 0.6 * (lons[4] - lons[3])
+    n = len(point_heights)
+    return np.stack([np.full(n, lat), np.full(n, lon), point_heights], axis=-1)
+
+
+def _bilinear(grid):
+    # Weights of the nodes around the points of `_get_off_node_points`
+    lat_weights = {2: 0.75, 3: 0.25}
+    lon_weights = {3: 0.4, 4: 0.6}
+    return sum(
+        lat_weights[i] * lon_weights[j] * grid[..., i, j]
+        for i in lat_weights
+        for j in lon_weights
+    )
+
+
+def test_point_delays_off_nodes(hres_file, monkeypatch):
+    # The synthetic model top is below 56 km: leave its zero delays unmasked,
+    # as those above the top of the real model
+    monkeypatch.setattr("opera_tropo._ztd.N_TOP_ZERO_HEIGHTS", 25)
+    with xr.open_dataset(hres_file) as ds:
+        expected = calculate_ztd(
+            ds.load(), engine="native", chunk_size=None, keep_bits=False
+        )
+    heights = expected.height.values
+    point_heights = np.array([1234.5, 5678.9])
+    points = _get_off_node_points(
+        expected.latitude.values, expected.longitude.values, point_heights
+    )
+
+    out = compute_point_delays(hres_file, points)
+    for name in ["wet_delay", "hydrostatic_delay"]:
+        grid = expected[name].isel(time=0).values
+        assert not np.isnan(grid).any()
+        profiles = interp1d(heights, grid, kind="cubic", axis=0)(point_heights)
+        values = _bilinear(profiles)
+        assert np.all(np.isfinite(values))
+        assert_allclose(out[name].isel(time=0).values, values, rtol=1e-6)
+
+
+def test_point_delays_masked_columns(hres_file):
+    # The zero delays above the synthetic model top are masked, as in the
+    # gridded product at the same heights
+    point_heights = np.array([1234.5, 5678.9])
+    with xr.open_dataset(hres_file) as ds:
+        expected = calculate_ztd(
+            ds.load(),
+            out_heights=list(point_heights),
+            engine="native",
+            chunk_size=None,
+            keep_bits=False,
+        )
+    points = _get_off_node_points(
+        expected.latitude.values, expected.longitude.values, point_heights
+    )
+
+    out = compute_point_delays(hres_file, points)
+    for name in ["wet_delay", "hydrostatic_delay"]:
+        values = _bilinear(expected[name].isel(time=0).values)
+        assert np.isnan(values).all()
+        assert_array_equal(out[name].isel(time=0).values, values)
+
+
+def test_point_delays_times(hres_file, tmp_path):
+    with xr.open_dataset(hres_file) as ds:
+        ds = ds.isel(latitude=slice(4), longitude=slice(4)).load()
+    # Second model time 6 hours later, 1 K warmer
+    later = ds.assign(t=ds.t + 1).assign_coords(time=ds.time + np.timedelta64(6, "h"))
+    ds = xr.concat([ds, later], dim="time").drop_encoding()
+    hres_file = tmp_path / "hres.nc"
+    ds.to_netcdf(hres_file, engine="h5netcdf")
+    points = [[39.2, 0.7, 1000.0], [38.8, 1.3, 3000.0]]
+
+    out = compute_point_delays(hres_file, points)
+    assert_array_equal(out.time.values, ds.time.values)
+    for itime in range(2):
+        time_file = tmp_path / f"hres_{itime}.nc"
+        ds.isel(time=[itime]).to_netcdf(time_file, engine="h5netcdf")
+        expected = compute_point_delays(time_file, points)
+        xr.testing.assert_identical(out.isel(time=[itime]), expected)
+    assert not np.array_equal(
+        out.wet_delay.isel(time=0).values, out.wet_delay.isel(time=1).values
+    )
+
+
+def test_point_delays_outside_grid(hres_file):
+    # Regional grid from 0 to 15.5° longitude, not wrapped around
+    for lon in [-0.25, 15.75, 180.0]:
+        with pytest.raises(ValueError, match="longitudes"):
+            compute_point_delays(hres_file, [[35.0, lon, 1000.0]])
+    with pytest.raises(ValueError, match="latitudes"):
+        compute_point_delays(hres_file, [[45.0, 5.0, 1000.0]])
+
+
+def test_get_lon_nodes():
+    # Global grid, points past the last longitude wrap around to the first
+    lons = np.arange(0, 360, 0.5)
+    idx, weights = _get_lon_nodes(lons, np.array([359.75, -0.125, 10.0]))
+    assert_array_equal(idx, [[719, 0], [719, 0], [20, 21]])
+    assert_allclose(weights, [[0.5, 0.5], [0.25, 0.75], [1.0, 0.0]])
+
+    # Regional grid across the antimeridian, in [-180, 180] or [0, 360]
+    lons = np.arange(170, 190.5, 0.5)
+    idx, weights = _get_lon_nodes(lons, np.array([-175.25, 185.25, 190.0]))
+    assert_array_equal(idx, [[29, 30], [30, 31], [39, 40]])
+    assert_allclose(weights, [[0.5, 0.5], [0.5, 0.5], [0.0, 1.0]])
+    with pytest.raises(ValueError, match="outside"):
+        _get_lon_nodes(lons, np.array([190.25]))
@@ -4,6 +4,8 @@ import numpy as np
 import pytest
 from numpy.testing import assert_allclose
 
+from opera_tropo import _ztd
+
 
 def test_prepare_hres_model(load_input_model, init_raider):
     # Init RAiDER HRES instance
@@ -148,3 +150,76 @@ def test_hres_class(load_hres_model, key):
             f"Values for key '{key}' do not match: golden_dict = {golden_value},"
             f" model_dict = {model_value}"
         )
+
+
+def test_native_engine_steps(load_input_model):
+    # load test data
+    da = load_input_model
+    da = da.isel(time=0)
+
+    # Step 1: Calculate surface_pressure, geopotenial heights
+    geop, pres, hgt = _ztd.calculate_geoh(
+        da.z.isel(level=0).values,
+        da.lnsp.isel(level=0).values,
+        da.t.values,
+        da.q.values,
+    )
+    err_msg = "f:calculate_geoh, %s values do not match!"
+    assert_allclose(da.geop, geop, err_msg=err_msg % "geopotential")
+    assert_allclose(da.p, pres, err_msg=err_msg % "surface_pressure")
+    assert_allclose(da.ght, hgt, err_msg=err_msg % "geo_height")
+
+    # Step 2: Convert geoheight to ellipsoidal heights
+    h = _ztd.geo_to_height(da.latitude.values[:, np.newaxis], hgt)
+    err_msg = "f:geo_to_height, %s values do not match!"
+    assert_allclose(da.hgt, h, err_msg=err_msg % "ellipsoidal_height")
+
+    # Step 3: Get partial water vapor pressure
+    e = _ztd.find_e(
+        np.flip(da.t.values, axis=0),
+        np.flip(da.q.values, axis=0),
+        np.flip(pres, axis=0),
+    )
+    err_msg = "f:find_e, %s values do not match!"
+    assert_allclose(da.e, e, err_msg=err_msg % "partial_water_vapor")
+
+
+def test_calculate_geoh_out_buffers(load_input_model):
+    # load test data
+    da = load_input_model
+    da = da.isel(time=0)
+
+    t = da.t.values
+    buffers = tuple(np.empty_like(t) for _ in range(3))
+    out = _ztd.calculate_geoh(
+        da.z.isel(level=0).values,
+        da.lnsp.isel(level=0).values,
+        t,
+        da.q.values,
+        out=buffers,
+    )
+    assert all(arr is buf for arr, buf in zip(out, buffers))
+
+    err_msg = "f:calculate_geoh, %s values do not match!"
+    assert_allclose(da.geop, out[0], err_msg=err_msg % "geopotential")
+    assert_allclose(da.p, out[1], err_msg=err_msg % "surface_pressure")
+    assert_allclose(da.ght, out[2], rtol=1e-6, err_msg=err_msg % "geo_height")
+
+
+def test_ztd_columns_chunking(load_input_model):
+    # load test data
+    da = load_input_model
+    da = da.isel(time=0)
+
+    n_levels = da.sizes["level"]
+    args = (
+        np.broadcast_to(da.latitude.values[:, np.newaxis], da.z.shape[1:]).ravel(),
+        da.t.values.reshape(n_levels, -1),
+        da.q.values.reshape(n_levels, -1),
+        da.z.isel(level=0).values.ravel(),
+        da.lnsp.isel(level=0).values.ravel(),
+    )
+    full = _ztd.ztd_columns(*args, chunk_size=None)
+    chunked = _ztd.ztd_columns(*args, chunk_size=7)
+    for ref, arr in zip(full, chunked):
+        np.testing.assert_array_equal(ref, arr)
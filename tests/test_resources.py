@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from opera_tropo.resources import (
+    MAX_BLOCK_SIDE,
+    THREAD_ENV_VARS,
+    estimate_column_memory,
+    get_native_threads,
+    get_thread_env,
+    get_thread_limits,
+    limit_native_threads,
+    plan_resources,
+)
+
+GIB = 2**30
+
+
+def test_plan_resources_auto():
+    plan = plan_resources(
+        (1801, 3600), engine="native", cpu_count=16, memory_limit=64 * GIB
+    )
+    assert plan.threads_per_worker == 2
+    assert plan.n_workers == 8
+    assert plan.max_memory == int(0.8 * 64 * GIB / 8)
+    assert plan.block_shape[0] == plan.block_shape[1] <= MAX_BLOCK_SIDE
+    # Blocks of all threads of a worker fit in its memory
+    assert plan.block_memory * plan.threads_per_worker <= plan.max_memory
+
+
+def test_plan_resources_explicit():
+    plan = plan_resources(
+        (20, 40),
+        n_workers=3,
+        threads_per_worker=1,
+        max_memory="1GB",
+        block_shape=(8, 16),
+        cpu_count=16,
+        memory_limit=64 * GIB,
+    )
+    assert (plan.n_workers, plan.threads_per_worker) == (3, 1)
+    assert plan.max_memory == "1GB"
+    assert plan.block_shape == [8, 16]
+
+
+@pytest.mark.parametrize("memory_limit", [2 * GIB, 64 * GIB])
+def test_plan_resources_block_scaling(memory_limit):
+    # Small grids are split for load balancing, large grids by memory
+    small = plan_resources((20, 40), cpu_count=4, memory_limit=memory_limit)
+    assert small.block_shape == [8, 8]
+    large = plan_resources((1801, 3600), cpu_count=4, memory_limit=memory_limit)
+    budget = large.max_memory / large.threads_per_worker
+    assert large.block_memory <= budget
+
+
+def test_estimate_column_memory():
+    assert estimate_column_memory(engine="native") < estimate_column_memory()
+    assert estimate_column_memory(10) < estimate_column_memory(100)
+
+
+def test_get_native_threads():
+    assert get_native_threads(8, cpu_count=16) == 2
+    assert get_native_threads(16, cpu_count=16) == 1
+    assert get_native_threads(32, cpu_count=16) == 1
+
+
+def test_limit_native_threads():
+    threadpoolctl = pytest.importorskip("threadpoolctl")
+    limits = {}
+
+    def _task():
+        limit_native_threads(1)
+        limits.update(get_thread_limits())
+
+    # BLAS limits are process-wide, restore them after
+    with threadpoolctl.threadpool_limits(limits=None):
+        thread = threading.Thread(target=_task)
+        thread.start()
+        thread.join()
+    assert all(n_threads == 1 for n_threads in limits.values())
+    assert get_thread_env(1) == dict.fromkeys(THREAD_ENV_VARS, 1)
@@ -0,0 +1,140 @@
+import dask.array as da
+import numpy as np
+import pytest
+import xarray as xr
+
+from opera_tropo._interp import get_height_weights
+from opera_tropo.checks import ValidationError
+from opera_tropo.core import calculate_ztd
+from opera_tropo.run import (
+    build_tropo,
+    get_column_block_size,
+    get_task_native_threads,
+    select_scheduler,
+    tropo,
+)
+
+
+@pytest.mark.parametrize("scheduler", ["distributed", "threads", "synchronous"])
+def test_select_scheduler_explicit(scheduler):
+    assert select_scheduler(scheduler, input_nbytes=2**40) == scheduler
+
+
+def test_select_scheduler_auto():
+    assert select_scheduler("auto", input_nbytes=2**20) == "threads"
+    assert select_scheduler("auto", input_nbytes=2**34) == "distributed"
+    # Small inputs still need a cluster if they do not fit in a worker
+    assert select_scheduler("auto", 2**27, max_memory="512MB") == "distributed"
+
+
+def test_select_scheduler_unknown():
+    with pytest.raises(ValueError):
+        select_scheduler("mpi", input_nbytes=0)
+
+
+def test_interp_weights_in_graph_once(hres_file):
+    out_heights = np.arange(0, 20000, 500.0)
+    out_ds, _, _ = build_tropo(
+        str(hres_file), out_heights=out_heights, engine="native", block_size=[8, 16]
+    )
+    graph = dict(out_ds.wet_delay.data.__dask_graph__())
+    weights = [key for key in graph if str(key).startswith("ndarray-")]
+    assert len(weights) == 1
+
+
+def test_interp_weights_shape(hres_file):
+    ds = xr.open_dataset(hres_file).isel(latitude=slice(4), longitude=slice(4))
+    out_heights = np.arange(0, 20000, 500.0)
+    weights = get_height_weights(np.arange(50.0), out_heights)
+    with pytest.raises(ValueError, match="interp_weights"):
+        calculate_ztd(
+            ds, out_heights=out_heights, engine="native", interp_weights=weights
+        )
+
+
+def test_get_column_block_size():
+    # Whole rows, rounded down to the rows fitting in the batch
+    assert get_column_block_size(1000, (100, 360)) == [2, 360]
+    assert get_column_block_size(360, (100, 360)) == [1, 360]
+    assert get_column_block_size(10**6, (100, 360)) == [100, 360]
+    # Part of a row, the last block holds the remaining 60 longitudes
+    assert get_column_block_size(100, (100, 360)) == [1, 100]
+    with pytest.raises(ValueError):
+        get_column_block_size(0, (100, 360))
+
+
+def test_column_blocks_remainder():
+    # Blocks of at most n_columns, all full except the last along each dimension
+    shape = (7, 360)
+    for n_columns in [50, 100, 359, 360, 500, 1000]:
+        block = get_column_block_size(n_columns, shape)
+        chunks = da.empty(shape, chunks=block).chunks
+        sizes = np.outer(*chunks)
+        assert sizes.max() <= n_columns
+        assert sizes.max() == block[0] * block[1]
+        for dim_chunks, size in zip(chunks, block):
+            assert all(c == size for c in dim_chunks[:-1])
+            assert 0 < dim_chunks[-1] <= size
+
+
+@pytest.mark.parametrize("output_format", ["netcdf", "zarr"])
+def test_tropo_invalid_input_removed(hres_file, tmp_path, output_format):
+    if output_format == "zarr":
+        pytest.importorskip("zarr")
+    invalid_file = tmp_path / "invalid.nc"
+    with xr.open_dataset(hres_file) as ds:
+        ds.assign(t=ds.t * np.nan).to_netcdf(invalid_file, engine="h5netcdf")
+
+    output_file = tmp_path / f"out.{'zarr' if output_format == 'zarr' else 'nc'}"
+    with pytest.raises(ValidationError, match="only NaN"):
+        tropo(
+            str(invalid_file),
+            str(output_file),
+            block_size=[8, 16],
+            engine="native",
+            scheduler="synchronous",
+            output_format=output_format,
+        )
+    assert not output_file.exists()
+
+
+def test_get_task_native_threads(monkeypatch):
+    monkeypatch.setattr("opera_tropo.resources.CPU_COUNT", 64)
+    # Distributed workers keep one native thread per task thread
+    assert get_task_native_threads("distributed", 4, 2) == 1
+    # Local schedulers share the CPUs left over by the task threads
+    assert get_task_native_threads("threads", 4, 2) == 8
+    assert get_task_native_threads("processes", 4, 2) == 16
+    assert get_task_native_threads("synchronous", 4, 2) == 64
+
+
+def test_plan_keep_bits_sample(hres_file, monkeypatch):
+    # Record the sampled rows and heights of the keep_bits planning
+    import opera_tropo.core
+
+    sampled = {}
+    compute_delays = opera_tropo.core._compute_delays
+    plan_keep_bits = opera_tropo.core.plan_keep_bits
+
+    def _compute_delays(*args, **kwargs):
+        sampled["lat"] = kwargs["lat"]
+        return compute_delays(*args, **kwargs)
+
+    def _plan_keep_bits(delays, heights, **kwargs):
+        sampled["heights"] = heights
+        return plan_keep_bits(delays, heights, **kwargs)
+
+    monkeypatch.setattr(opera_tropo.core, "_compute_delays", _compute_delays)
+    monkeypatch.setattr(opera_tropo.core, "plan_keep_bits", _plan_keep_bits)
+    out_ds, _, _ = build_tropo(
+        str(hres_file),
+        bbox=(2.0, 34.0, 10.0, 38.0),
+        min_height=500,
+        max_height=20000,
+        keep_bits_max_error=1e-3,
+        engine="native",
+    )
+    assert np.all((sampled["lat"] >= 34.0) & (sampled["lat"] <= 38.0))
+    assert sampled["heights"].min() >= 500
+    assert sampled["heights"].max() <= 20000
+    assert set(sampled["heights"]) == set(out_ds.height.values)
@@ -1,12 +1,15 @@
 import numpy as np
+import pytest
+import xarray as xr
 from numpy.testing import assert_allclose
 
-from opera_tropo.core import calculate_ztd
+from opera_tropo.core import calculate_ztd, calculate_ztd_block
 from opera_tropo.product_info import TropoProducts
 from opera_tropo.utils import rounding_mantissa_blocks
 
 
-def test_wet_delay(load_input_model, load_golden_output):
+@pytest.mark.parametrize("engine", ["raider", "native"])
+def test_wet_delay(load_input_model, load_golden_output, engine):
     # Load test dataset
     ds = load_input_model
 
@@ -15,7 +18,7 @@ def test_wet_delay(load_input_model, load_golden_output):
     golden_out = golden_out.transpose("time", "height", "latitude", "longitude")
 
     # Calculate ztd
-    out_ds = calculate_ztd(ds)
+    out_ds = calculate_ztd(ds, engine=engine)
 
     # Take into account manitissa rounding
     keep_bits = TropoProducts().wet_delay.keep_bits
@@ -26,7 +29,8 @@ def test_wet_delay(load_input_model, load_golden_output):
     assert_allclose(out_ds.wet_delay, golden_out.wet_ztd)
 
 
-def test_hydrostatic_delay(load_input_model, load_golden_output):
+@pytest.mark.parametrize("engine", ["raider", "native"])
+def test_hydrostatic_delay(load_input_model, load_golden_output, engine):
     # Load test dataset
     ds = load_input_model
 
@@ -35,7 +39,7 @@ def test_hydrostatic_delay(load_input_model, load_golden_output):
     golden_out = golden_out.transpose("time", "height", "latitude", "longitude")
 
     # Calculate ztd
-    out_ds = calculate_ztd(ds)
+    out_ds = calculate_ztd(ds, engine=engine)
 
     # Take into account manitissa rounding
     keep_bits = TropoProducts().hydrostatic_delay.keep_bits
@@ -44,3 +48,34 @@ def test_hydrostatic_delay(load_input_model, load_golden_output):
     )
 
     assert_allclose(out_ds.hydrostatic_delay, golden_out.hydrostatic_ztd)
+
+
+def test_multi_time(load_input_model):
+    ds = load_input_model.isel(time=[0])
+    ds_next = ds.assign_coords(time=ds.time + np.timedelta64(6, "h"))
+    ds_next["t"] = ds_next.t + 1.0
+    multi_ds = xr.concat([ds, ds_next], dim="time")
+
+    out_ds = calculate_ztd(multi_ds, engine="native")
+    assert out_ds.sizes["time"] == 2
+    for itime, step_ds in enumerate([ds, ds_next]):
+        expected = calculate_ztd(step_ds, engine="native")
+        xr.testing.assert_identical(
+            out_ds.isel(time=[itime]).drop_attrs(), expected.drop_attrs()
+        )
+
+
+@pytest.mark.parametrize("engine", ["raider", "native"])
+def test_calculate_ztd_block(load_input_model, engine):
+    ds = load_input_model
+    expected = calculate_ztd(ds, engine=engine, clip_input=True)
+
+    delays = calculate_ztd_block(
+        *[ds[var].values for var in ("t", "q", "z", "lnsp")],
+        lat=ds.latitude.values,
+        lon=ds.longitude.values,
+        engine=engine,
+        clip_input=True,
+    )
+    np.testing.assert_array_equal(delays[0], expected.wet_delay.values)
+    np.testing.assert_array_equal(delays[1], expected.hydrostatic_delay.values)
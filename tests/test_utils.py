@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from opera_tropo.utils import (
+    align_block_size,
+    cast_round_mantissa,
+    get_aligned_chunks,
+    get_longitude_runs,
+    get_read_amplification,
+    round_mantissa,
+    subset_bbox,
+)
+
+
+@pytest.fixture
+def global_grid() -> xr.Dataset:
+    lats = np.arange(90, -90.5, -0.5)
+    lons = np.arange(0, 360, 0.5)
+    data = np.arange(lats.size * lons.size, dtype=np.float32)
+    return xr.Dataset(
+        {"t": (("latitude", "longitude"), data.reshape(lats.size, lons.size))},
+        coords={"latitude": lats, "longitude": lons},
+    )
+
+
+@pytest.mark.parametrize(
+    ("bbox", "expected_lons"),
+    [
+        ((20, 30, 25, 35), np.arange(20, 25.5, 0.5)),
+        ((380, 30, 385, 35), np.arange(20, 25.5, 0.5)),
+        ((-10, 30, 10, 35), np.r_[np.arange(350, 360, 0.5), np.arange(0, 10.5, 0.5)]),
+        ((170, 30, -170, 35), np.arange(170, 190.5, 0.5)),
+        ((-180, 30, 180, 35), np.arange(0, 360, 0.5)),
+    ],
+)
+def test_subset_bbox(global_grid, bbox, expected_lons):
+    out = subset_bbox(global_grid, bbox)
+    np.testing.assert_array_equal(out.longitude, expected_lons)
+    np.testing.assert_array_equal(out.latitude, np.arange(35, 29.5, -0.5))
+    expected = global_grid.sel(longitude=expected_lons, latitude=out.latitude)
+    xr.testing.assert_identical(out, expected)
+
+
+def test_subset_bbox_invalid(global_grid):
+    with pytest.raises(ValueError):
+        subset_bbox(global_grid, (10, 35, 20, 30))
+    with pytest.raises(ValueError):
+        subset_bbox(global_grid, (10.1, 30, 10.2, 35))
+
+
+@pytest.mark.parametrize(
+    "lons",
+    [
+        np.arange(0, 360, 0.5),
+        np.arange(0, 20, 0.5),
+        np.r_[np.arange(350, 360, 0.5), np.arange(0, 10.5, 0.5)],
+        np.arange(170, 190.5, 0.5),
+    ],
+)
+def test_get_longitude_runs(lons):
+    runs = get_longitude_runs(lons)
+    ordered = np.concatenate([lons[run] for run in runs])
+    expected = np.sort((lons + 180) % 360 - 180)
+    np.testing.assert_array_equal((ordered + 180) % 360 - 180, expected)
+
+
+def test_get_longitude_runs_unsortable():
+    assert get_longitude_runs(np.array([0, 200, 10, 210])) is None
+
+
+def test_align_block_size():
+    assert align_block_size([128, 256], [50, 100], [721, 1440]) == [100, 200]
+    # Blocks smaller than a disk chunk, or spanning the dimension, are kept
+    assert align_block_size([32, 40], [50, 100], [721, 40]) == [32, 40]
+
+
+def test_get_aligned_chunks():
+    # Subset starting mid-block, then a wrap back to the start of the file
+    positions = np.r_[np.arange(5, 20), np.arange(0, 3)]
+    assert get_aligned_chunks(positions, 8) == (3, 8, 4, 3)
+
+
+def test_get_read_amplification():
+    positions = {"lat": np.arange(16), "lon": np.arange(32)}
+    disk_chunks = {"lat": 8, "lon": 16}
+    aligned = {"lat": (8, 8), "lon": (16, 16)}
+    assert get_read_amplification(positions, aligned, disk_chunks) == 1
+    shifted = {"lat": (4, 8, 4), "lon": (16, 16)}
+    assert get_read_amplification(positions, shifted, disk_chunks) == 2
+
+
+@pytest.mark.parametrize("keep_bits", [0, 1, 10, 12, 23])
+def test_cast_round_mantissa(keep_bits):
+    rng = np.random.default_rng(0)
+    # Within the float32 range, down to its subnormals
+    data = rng.normal(size=(2, 30, 40, 145)) * 10.0 ** rng.integers(-40, 30, 145)
+    data[0, 0, 0, :4] = [np.nan, np.inf, -np.inf, 1e-310]
+
+    # Contiguous, transposed and strided inputs
+    for z in [data, data.transpose(0, 2, 1, 3), data[..., ::3]]:
+        expected = z.astype(np.float32)
+        round_mantissa(expected, keep_bits=keep_bits)
+        out = cast_round_mantissa(z, np.float32, keep_bits=keep_bits)
+        np.testing.assert_array_equal(out.view(np.int32), expected.view(np.int32))
+
+        # Written to a transposed view of the output
+        out = np.empty(z.shape, dtype=np.float32).transpose(0, 3, 1, 2)
+        cast_round_mantissa(z, np.float32, keep_bits, out=out.transpose(0, 2, 3, 1))
+        np.testing.assert_array_equal(
+            out.transpose(0, 2, 3, 1).view(np.int32), expected.view(np.int32)
+        )
+
+    # Out of range values overflow to inf, as with astype
+    with pytest.warns(RuntimeWarning, match="overflow"):
+        out = cast_round_mantissa(np.array([1e300, -1e300]), np.float32, keep_bits)
+    np.testing.assert_array_equal(out, [np.inf, -np.inf])
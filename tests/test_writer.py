@@ -0,0 +1,118 @@
+import h5py
+import numpy as np
+import pytest
+import xarray as xr
+
+from opera_tropo._writer import submit_netcdf, write_netcdf, write_zarr, zarr_to_netcdf
+
+
+@pytest.fixture
+def dataset() -> xr.Dataset:
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(1, 10, 21, 37)).astype(np.float32)
+    data[0, 0, 0, :5] = np.nan
+    dims = ("time", "height", "latitude", "longitude")
+    ds = xr.Dataset(
+        {"wet_delay": (dims, data, {"units": "m", "_FillValue": 9.96921e36})},
+        coords={"height": np.arange(10.0), "latitude": np.arange(21.0)},
+    )
+    return ds.chunk({"height": 4, "latitude": 7, "longitude": 10})
+
+
+@pytest.mark.parametrize(
+    "encoding",
+    [
+        {"zlib": True, "complevel": 4, "shuffle": True, "chunksizes": (1, 3, 8, 16)},
+        {"zlib": False, "chunksizes": (1, 10, 21, 37)},
+        # NaNs masked with the fill value
+        {"zlib": True, "chunksizes": (1, 3, 8, 16), "_FillValue": -9999.0},
+        # Not written with direct chunk writes
+        {"zlib": True, "fletcher32": True, "chunksizes": (1, 3, 8, 16)},
+    ],
+)
+def test_write_netcdf(tmp_path, dataset, encoding):
+    expected_file, output_file = tmp_path / "expected.nc", tmp_path / "output.nc"
+    if "_FillValue" in encoding:
+        del dataset.wet_delay.attrs["_FillValue"]
+    dataset.to_netcdf(expected_file, encoding={"wet_delay": encoding})
+    write_netcdf(dataset, output_file, encoding={"wet_delay": encoding})
+
+    with xr.open_dataset(expected_file) as expected:
+        with xr.open_dataset(output_file) as out:
+            xr.testing.assert_identical(out, expected)
+            out_encoding = out.wet_delay.encoding
+            expected_encoding = expected.wet_delay.encoding
+    for key in ["chunksizes", "zlib", "shuffle", "complevel", "_FillValue"]:
+        assert out_encoding.get(key) == expected_encoding.get(key)
+
+    # Same stored chunks, with NaNs encoded as the fill value
+    with h5py.File(expected_file) as expected, h5py.File(output_file) as out:
+        expected_id, out_id = expected["wet_delay"].id, out["wet_delay"].id
+        assert out_id.get_num_chunks() == expected_id.get_num_chunks()
+        for i in range(expected_id.get_num_chunks()):
+            offset = expected_id.get_chunk_info(i).chunk_offset
+            assert out_id.read_direct_chunk(offset) == expected_id.read_direct_chunk(
+                offset
+            )
+
+
+@pytest.mark.parametrize("zarr_format", [2, 3])
+def test_write_zarr(tmp_path, dataset, zarr_format):
+    pytest.importorskip("zarr")
+    encoding = {"zlib": True, "complevel": 4, "chunksizes": (1, 3, 8, 16)}
+    expected_file = tmp_path / "expected.nc"
+    dataset.to_netcdf(expected_file, encoding={"wet_delay": encoding})
+    store, output_file = tmp_path / "output.zarr", tmp_path / "output.nc"
+    write_zarr(dataset, store, {"wet_delay": encoding}, zarr_format=zarr_format)
+    zarr_to_netcdf(store, output_file)
+
+    with xr.open_dataset(expected_file) as expected:
+        with xr.open_zarr(store) as out:
+            xr.testing.assert_identical(out.compute(), expected)
+            assert out.wet_delay.encoding["chunks"] == encoding["chunksizes"]
+        with xr.open_dataset(output_file) as out:
+            xr.testing.assert_identical(out, expected)
+            assert out.wet_delay.encoding["chunksizes"] == encoding["chunksizes"]
+
+
+def test_export_netcdf_same_path(tmp_path):
+    from click.testing import CliRunner
+
+    from opera_tropo.cli.export import export_netcdf
+
+    store = tmp_path / "product.nc"
+    store.mkdir()
+    result = CliRunner().invoke(export_netcdf, ["-i", str(store)])
+    assert result.exit_code == 2
+    assert "overwrite the input store" in result.output
+    assert store.is_dir()
+
+
+def test_submit_netcdf(tmp_path, dataset):
+    distributed = pytest.importorskip("distributed")
+    encoding = {"wet_delay": {"zlib": True, "chunksizes": (1, 3, 8, 16)}}
+    expected_file = tmp_path / "expected.nc"
+    dataset.to_netcdf(expected_file, encoding=encoding)
+
+    # Two files written at the same time from one set of futures
+    output_files = [tmp_path / "first.nc", tmp_path / "second.nc"]
+    with distributed.Client(processes=False, n_workers=1, threads_per_worker=2) as c:
+        writes = [
+            submit_netcdf(dataset, output_file, encoding, client=c)
+            for output_file in output_files
+        ]
+        owners = {future: write for write in writes for future in write.futures}
+        for future, data in distributed.as_completed(owners, with_results=True):
+            owners[future].add_result(future, data)
+        assert all(write.done for write in writes)
+        for write in writes:
+            write.close()
+
+    for output_file in output_files:
+        with h5py.File(expected_file) as expected, h5py.File(output_file) as out:
+            expected_id, out_id = expected["wet_delay"].id, out["wet_delay"].id
+            for i in range(expected_id.get_num_chunks()):
+                offset = expected_id.get_chunk_info(i).chunk_offset
+                assert out_id.read_direct_chunk(
+                    offset
+                ) == expected_id.read_direct_chunk(offset)